@@ -4,45 +4,128 @@ Created on Fri Feb 24 19:17:30 2023
 """
 
 
-import tensorflow as tf
+import os
+
 import numpy as np
 import pandas as pd
 
 from utils.config import SETTINGS
-from utils.audio_utils import get_mel_spectrogram, get_onset_times, get_onset_samples
+from utils.audio_utils import get_mel_spectrogram, get_onsets, get_onset_samples, get_pooled_features, to_analysis_rate
+from utils.instrumentation import Instrumentation
+from utils.model_registry import load_model
 
 
 class DrumTranscriber:
-    def __init__(self):
-        try:
-            self.model = tf.keras.models.load_model(SETTINGS["SAVED_MODEL_PATH"], compile=False, safe_mode=False)
-        except TypeError:
-            # Fallback for older keras versions that don't verify safe_mode
-            self.model = tf.keras.models.load_model(SETTINGS["SAVED_MODEL_PATH"], compile=False)
-
-    def predict(self, samples: np.array, sr: int) -> pd.DataFrame:
+    def __init__(self, analysis_sr: int = None, cascade_threshold: float = SETTINGS['CASCADE_THRESHOLD'],
+                 model_path: str = SETTINGS['SAVED_MODEL_PATH'], num_threads: int = None, model=None):
+        """
+        :param analysis_sr (int): sample rate onsets and features are computed at, SETTINGS['ANALYSIS_SR'] if not provided
+        :param cascade_threshold (float): hits the first stage classifier (SETTINGS['CASCADE_MODEL_PATH']) is at least
+                                          this confident about skip the full model, None runs the full model on every hit
+        :param model_path (str): keras model, SavedModel directory or .tflite file written by convert_model.py,
+                                 the weights of a .tflite file are shared by all the processes loading it
+        :param num_threads (int): threads of a .tflite model, TFLite's default if not provided
+        :param model: already loaded model with a keras-like predict(x, verbose=0), model_path is not loaded
+                      when provided (optional)
         """
-        :param file_path (str): Path to audio file to predict
-        :param seconds (int): amount of seconds to predict
-        :return predictions (np.array): Hits probability predicted by the model
+        self.analysis_sr = SETTINGS['ANALYSIS_SR'] if analysis_sr is None else analysis_sr
+        self.cascade_threshold = cascade_threshold
+        self.first_stage = None
+
+        if cascade_threshold is not None:
+            if os.path.exists(SETTINGS['CASCADE_MODEL_PATH']):
+                import joblib
+                self.first_stage = joblib.load(SETTINGS['CASCADE_MODEL_PATH'])
+            else:
+                print(f"{SETTINGS['CASCADE_MODEL_PATH']} not found, running the full model on every hit.")
+
+        # checked against SETTINGS['MODEL_REGISTRY_PATH'] and loaded once per process
+        self.model = load_model(model_path, num_threads=num_threads) if model is None else model
+
+    def predict(self, samples: np.array, sr: int, instrumentation: Instrumentation = None) -> pd.DataFrame:
         """
-        # get onset
-        onset_samples = get_onset_samples(samples, sr=sr)
+        :param samples (np.array): samples array of the audio
+        :param sr (int): sample rate used for the samples
+        :param instrumentation (Instrumentation): if provided, records per-stage timings and reports progress (optional)
+        :return predictions (pd.DataFrame): Hits probability predicted by the model, with the number of model
+                                            inferences saved by onset suppression in predictions.attrs['suppressed_onsets'],
+                                            the fraction of hits the full model ran on in predictions.attrs['escalation_rate']
+                                            and the stage report in predictions.attrs['instrumentation'] when
+                                            instrumentation is enabled
+        """
+        if instrumentation is None:
+            instrumentation = Instrumentation(enabled=False)
+
+        with instrumentation.profile('drum_transcriber'):
+            if sr != self.analysis_sr:
+                with instrumentation.stage('resample'):
+                    samples, sr = to_analysis_rate(samples, sr, self.analysis_sr)
+
+            # get onset
+            instrumentation.report_progress(0.0, "Detecting onsets...")
+            with instrumentation.stage('onset_detection') as stage:
+                # onset windows and onset times for each hit, near-duplicate onsets are not classified
+                onset_frames, hit_times, n_suppressed = get_onsets(samples, sr)
+                stage['onsets'] = len(hit_times)
+                stage['suppressed'] = n_suppressed
+
+            with instrumentation.stage('window_extraction', onsets=len(onset_frames)):
+                onset_samples = get_onset_samples(samples, sr, onset_frames)
 
-        # convert to mel spectrogram
-        mel_specs = np.array([get_mel_spectrogram(s, sr=sr)
-                             for s in onset_samples])
-        mel_specs = np.expand_dims(mel_specs, axis=-1).repeat(3, axis=-1)
+            # hits the first stage is confident about keep its probabilities, the rest escalate to the full model
+            predictions = np.zeros((len(onset_samples), len(SETTINGS['LABELS_INDEX'])))
+            escalated = np.ones(len(onset_samples), dtype=bool)
+            if self.first_stage is not None and len(onset_samples):
+                with instrumentation.stage('first_stage', onsets=len(onset_samples)) as stage:
+                    probabilities = self.first_stage_predict(onset_samples, sr)
+                    escalated = probabilities.max(axis=1) < self.cascade_threshold
+                    predictions[~escalated] = probabilities[~escalated]
+                    stage['escalated'] = int(escalated.sum())
 
-        # onset times for each hit
-        hit_times = get_onset_times(samples, sr)
+                onset_samples = [s for s, escalate in zip(onset_samples, escalated) if escalate]
 
-        # get the predicted label
-        predictions = self.model.predict(mel_specs)
+            # convert to mel spectrogram
+            with instrumentation.stage('mel_conversion', onsets=len(onset_samples)):
+                mel_specs = []
+                for i, s in enumerate(onset_samples):
+                    mel_specs.append(get_mel_spectrogram(s, sr=sr))
+                    if i % SETTINGS['PREDICT_BATCH_SIZE'] == 0:
+                        instrumentation.report_progress(0.1 + 0.3*i/len(onset_samples),
+                                                        f"Computing features ({i}/{len(onset_samples)})...")
 
-        df = pd.DataFrame(predictions,
-                          columns=list(SETTINGS['LABELS_INDEX'].values()))
+                mel_specs = np.expand_dims(np.array(mel_specs), axis=-1).repeat(3, axis=-1)
 
-        df['time'] = hit_times
+            # get the predicted label
+            batch_size = SETTINGS['PREDICT_BATCH_SIZE']
+            with instrumentation.stage('model_inference', onsets=len(mel_specs), batch_size=batch_size):
+                escalated_indices = np.flatnonzero(escalated)
+                for i in range(0, len(mel_specs), batch_size):
+                    instrumentation.report_progress(0.4 + 0.55*i/len(mel_specs),
+                                                    f"Classifying hits ({i}/{len(mel_specs)})...")
+                    predictions[escalated_indices[i:i+batch_size]] = self.model.predict(mel_specs[i:i+batch_size], verbose=0)
+
+            with instrumentation.stage('dataframe_assembly'):
+                df = pd.DataFrame(predictions,
+                                  columns=list(SETTINGS['LABELS_INDEX'].values()))
+
+                df['time'] = hit_times
+                df.attrs['suppressed_onsets'] = n_suppressed
+                df.attrs['escalation_rate'] = float(escalated.mean()) if len(escalated) else 0.0
+
+            instrumentation.report_progress(1.0, "Transcription complete.")
+
+        if instrumentation.enabled:
+            df.attrs['instrumentation'] = instrumentation.report()
 
         return df
+
+    def first_stage_predict(self, onset_samples: list, sr: int) -> np.array:
+        """
+        :param onset_samples (list): onset windows, see get_onset_samples
+        :param sr (int): sample rate used for the samples
+        :return probabilities (np.array): first stage probabilities, columns in SETTINGS['LABELS_INDEX'] order
+        """
+        probabilities = self.first_stage.predict_proba(get_pooled_features(np.array(onset_samples), sr))
+
+        columns = [list(self.first_stage.classes_).index(label) for label in SETTINGS['LABELS_INDEX'].values()]
+        return probabilities[:, columns]
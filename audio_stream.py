@@ -0,0 +1,234 @@
+import os
+import queue
+import shutil
+import tempfile
+import subprocess
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.config import SETTINGS
+
+
+def get_ffmpeg_dir():
+    """
+    Returns the directory of a portable ffmpeg shipped next to the app (see run_portable.bat), None if there is none.
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+    for relative_dir in ['ffmpeg', 'bin']:
+        possible_path = os.path.join(base_dir, relative_dir)
+        if os.path.exists(os.path.join(possible_path, 'ffmpeg.exe')):
+            return possible_path
+
+    return None
+
+
+def get_ffmpeg_executable():
+    ffmpeg_dir = get_ffmpeg_dir()
+    if ffmpeg_dir is not None:
+        return os.path.join(ffmpeg_dir, 'ffmpeg.exe')
+
+    return shutil.which('ffmpeg')
+
+
+def resolve_media_url(url):
+    """
+    Uses yt-dlp to turn a page URL (YouTube or a plain file URL) into a direct audio stream URL.
+
+    :return media_url, headers (str, dict): URL ffmpeg can read and the HTTP headers it needs
+    """
+    import yt_dlp
+
+    ydl_opts = {'format': 'bestaudio/best', 'quiet': True, 'no_warnings': True}
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if 'entries' in info:
+        info = info['entries'][0]
+
+    return info['url'], info.get('http_headers', {})
+
+
+def stream_audio(url, start_time=0, duration=None, sr=SETTINGS['ANALYSIS_SR'],
+                 block_seconds=SETTINGS['STREAM_BLOCK_SECONDS']):
+    """
+    Decodes only the requested range of a remote audio stream and yields it block by block as it arrives.
+    ffmpeg seeks the input with HTTP range requests, so the rest of the file is never fetched.
+
+    :param url (str): YouTube or direct audio URL
+    :param start_time (float): offset in seconds of the range to decode
+    :param duration (float): length in seconds of the range to decode, None for the rest of the stream
+    :param sr (int): sample rate of the yielded blocks
+    :param block_seconds (float): length in seconds of the yielded blocks
+    :return blocks (generator): mono float32 np.arrays
+    """
+    ffmpeg = get_ffmpeg_executable()
+    if ffmpeg is None:
+        raise FileNotFoundError("ffmpeg not found. Please install it and make sure it is in PATH.")
+
+    media_url, headers = resolve_media_url(url)
+
+    command = [ffmpeg, '-nostdin', '-loglevel', 'error']
+    if headers:
+        command += ['-headers', ''.join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    command += ['-ss', str(start_time)]
+    if duration is not None:
+        command += ['-t', str(duration)]
+    command += ['-i', media_url, '-f', 'f32le', '-ac', '1', '-ar', str(sr), 'pipe:1']
+
+    # stderr goes to a file, a full pipe nobody reads would block ffmpeg
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+    block_bytes = int(sr*block_seconds)*4
+
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+
+            # a read can end between two float32 samples
+            usable = len(data) - len(data) % 4
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=np.float32)
+
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"ffmpeg failed: {stderr.read().decode(errors='ignore').strip()}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        stderr.close()
+
+
+def prefetch(blocks, max_blocks=SETTINGS['STREAM_PREFETCH_BLOCKS']):
+    """
+    Runs a block generator in a background thread so fetching and decoding keep going while the caller
+    is busy transcribing. Exceptions raised by the generator are re-raised in the caller.
+
+    :param blocks (iterable): blocks to fetch, closed when the caller stops early if it is a generator
+    :param max_blocks (int): blocks fetched ahead of the caller at most, the producer waits for the caller beyond
+    """
+    buffer = queue.Queue(maxsize=max_blocks or 0)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # gives up once the caller stopped, nobody would take the item
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for block in blocks:
+                if not put(block):
+                    break
+            else:
+                put(done)
+        except Exception as e:
+            put(e)
+        finally:
+            # e.g. stream_audio kills ffmpeg when closed
+            if hasattr(blocks, 'close'):
+                blocks.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def transcribe_stream(transcriber, blocks, sr, chunk_seconds=SETTINGS['STREAM_CHUNK_SECONDS'],
+                      expected_seconds=None, progress=None, on_chunk=None, preprocess=None):
+    """
+    Transcribes audio blocks as they arrive, one chunk at a time. Each chunk is analysed with one
+    classification window of margin on both sides and only keeps the hits that start inside it,
+    so hits at the chunk borders get the same windows as in a single DrumTranscriber.predict call.
+
+    :param transcriber (DrumTranscriber): loaded transcriber
+    :param blocks (iterable): mono np.arrays at sample rate sr
+    :param sr (int): sample rate of the blocks
+    :param chunk_seconds (float): seconds of new audio transcribed at a time
+    :param expected_seconds (float): expected length of the stream, only used for progress (optional)
+    :param progress (callable): called as progress(fraction, desc) (optional)
+    :param on_chunk (callable): called with the predictions of each chunk as soon as it is transcribed,
+                                e.g. to append them to a file with utils.export.export_records (optional)
+    :param preprocess (callable): applied to every analysed segment before transcription, e.g.
+                                  utils.audio_utils.get_percussive, the returned samples stay untouched (optional)
+    :return samples, predictions (np.array, pd.DataFrame): the whole stream and its predictions
+    """
+    margin = int(sr*SETTINGS['WINDOW_LENGTH'])
+    chunk = int(sr*chunk_seconds)
+
+    # every block for the returned samples, and a rolling buffer holding only the audio from one margin
+    # before the next chunk onwards, so each chunk costs the same however long the stream gets
+    blocks_received = []
+    n_received = 0
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0
+    received = []
+    next_start = 0
+    results = []
+
+    def transcribe(start, end):
+        segment_start = max(start - margin, 0)
+        segment = buffer[segment_start - buffer_start:min(end + margin, buffer_start + len(buffer)) - buffer_start]
+        if preprocess is not None:
+            segment = preprocess(segment)
+        df = transcriber.predict(segment, sr)
+        df['time'] += segment_start/sr
+        df = df[(df['time'] >= start/sr) & (df['time'] < end/sr)]
+        if on_chunk is not None:
+            on_chunk(df)
+        return df
+
+    for block in blocks:
+        blocks_received.append(block)
+        received.append(block)
+        n_received += len(block)
+
+        if progress is not None and expected_seconds:
+            progress(min(n_received/sr/expected_seconds, 1.0),
+                     f"Streaming audio ({n_received/sr:.0f}s received, {next_start/sr:.0f}s transcribed)...")
+
+        if n_received - next_start < chunk + margin:
+            continue
+
+        buffer = np.concatenate([buffer] + received)
+        received = []
+
+        while n_received - next_start >= chunk + margin:
+            results.append(transcribe(next_start, next_start + chunk))
+            next_start += chunk
+
+        # the audio before the margin of the next chunk is not analysed again
+        drop = max(next_start - margin, 0) - buffer_start
+        buffer, buffer_start = buffer[drop:], buffer_start + drop
+
+    buffer = np.concatenate([buffer] + received)
+    if next_start < n_received:
+        results.append(transcribe(next_start, n_received))
+
+    samples = np.concatenate(blocks_received) if blocks_received else np.zeros(0, dtype=np.float32)
+
+    columns = list(SETTINGS['LABELS_INDEX'].values()) + ['time']
+    predictions = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=columns)
+
+    return samples, predictions
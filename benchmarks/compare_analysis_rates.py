@@ -0,0 +1,167 @@
+"""
+Compares onsets, predicted labels and speed at several analysis sample rates against a 44.1 kHz
+reference, and recommends the lowest rate that stays within the given agreement thresholds.
+
+    python benchmarks/compare_analysis_rates.py --rates 44100 32000 22050 16000 --fixtures song.wav
+"""
+
+import sys
+import os
+
+# make the repository root importable when running this file as a script
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+import argparse
+import tempfile
+import time
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from utils.config import SETTINGS
+from utils.audio_utils import get_mel_spectrogram, get_onsets, get_onset_samples, match_onsets
+
+from synthetic import make_drum_clip
+
+REFERENCE_SR = 44100
+
+
+def f_measure(n_matched, n_reference, n_estimate):
+    if n_reference + n_estimate == 0:
+        return 1.0
+    return 2*n_matched/(n_reference + n_estimate)
+
+
+def analyse(audio_path, rate, transcriber=None):
+    """
+    :return result (dict): onset times, top labels (None without a model) and seconds spent per stage
+    """
+    seconds = {}
+
+    start = time.perf_counter()
+    samples, sr = librosa.load(audio_path, sr=rate)
+    seconds['decode'] = time.perf_counter() - start
+
+    if transcriber is not None:
+        transcriber.analysis_sr = rate
+
+        start = time.perf_counter()
+        df = transcriber.predict(samples, sr)
+        seconds['predict'] = time.perf_counter() - start
+
+        labels = list(SETTINGS['LABELS_INDEX'].values())
+        return {'times': df['time'].to_numpy(),
+                'labels': np.array(labels)[np.argmax(df[labels].to_numpy(), axis=1)],
+                'seconds': seconds}
+
+    start = time.perf_counter()
+    onset_frames, times, _ = get_onsets(samples, sr)
+    seconds['onset_detection'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    [get_mel_spectrogram(s, sr=sr) for s in get_onset_samples(samples, sr, onset_frames)]
+    seconds['mel_conversion'] = time.perf_counter() - start
+
+    return {'times': times, 'labels': None, 'seconds': seconds}
+
+
+def compare_clip(audio_path, rates, transcriber=None, truth=None, tolerance=0.05):
+    reference = analyse(audio_path, REFERENCE_SR, transcriber)
+
+    rows = []
+    for rate in rates:
+        result = reference if rate == REFERENCE_SR else analyse(audio_path, rate, transcriber)
+
+        ref_idx, est_idx = match_onsets(reference['times'], result['times'], tolerance)
+        row = {
+            'rate': rate,
+            'seconds': sum(result['seconds'].values()),
+            'onset_f': f_measure(len(ref_idx), len(reference['times']), len(result['times'])),
+            'label_agreement': None,
+            'truth_f': None,
+        }
+
+        if result['labels'] is not None and len(ref_idx):
+            row['label_agreement'] = float(np.mean(reference['labels'][ref_idx] == result['labels'][est_idx]))
+
+        if truth is not None:
+            truth_idx, _ = match_onsets(truth, result['times'], tolerance)
+            row['truth_f'] = f_measure(len(truth_idx), len(truth), len(result['times']))
+
+        rows.append(row)
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', type=int, nargs='+', default=[44100, 32000, 22050, 16000, 11025])
+    parser.add_argument('--durations', type=float, nargs='+', default=[30],
+                        help='lengths in seconds of the synthetic clips')
+    parser.add_argument('--fixtures', nargs='*', default=[], help='additional audio files to compare on')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='onset matching tolerance in seconds')
+    parser.add_argument('--min-onset-f', type=float, default=0.95)
+    parser.add_argument('--min-label-agreement', type=float, default=0.95)
+    parser.add_argument('--skip-model', action='store_true')
+    args = parser.parse_args()
+
+    transcriber = None
+    if not args.skip_model and os.path.exists(SETTINGS['SAVED_MODEL_PATH']):
+        from DrumTranscriber import DrumTranscriber
+        transcriber = DrumTranscriber()
+    elif not args.skip_model:
+        print(f"{SETTINGS['SAVED_MODEL_PATH']} not found, comparing onsets only.")
+
+    rates = sorted(set(args.rates) | {REFERENCE_SR}, reverse=True)
+    all_rows = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        clips = []
+        for duration in args.durations:
+            samples, times, _ = make_drum_clip(duration)
+            path = os.path.join(temp_dir, f"synthetic_{duration:g}s.wav")
+            sf.write(path, samples, REFERENCE_SR, subtype='PCM_16')
+            # hits played together count as one onset
+            truth = times[np.concatenate(([True], np.diff(times) > 0.02))]
+            clips.append((path, truth))
+
+        clips += [(path, None) for path in args.fixtures]
+
+        # keep numba compilation and lazy imports out of the first timings
+        warmup_path = os.path.join(temp_dir, 'warmup.wav')
+        sf.write(warmup_path, make_drum_clip(2)[0], REFERENCE_SR, subtype='PCM_16')
+        analyse(warmup_path, REFERENCE_SR, transcriber)
+
+        for path, truth in clips:
+            print(f"Comparing rates on {os.path.basename(path)}...")
+            all_rows += compare_clip(path, rates, transcriber, truth, args.tolerance)
+
+    print(f"{'rate':>6} {'seconds':>8} {'onset F':>8} {'labels':>8} {'truth F':>8}")
+    recommended = REFERENCE_SR
+    safe = True
+    for rate in rates:
+        rows = [r for r in all_rows if r['rate'] == rate]
+
+        seconds = sum(r['seconds'] for r in rows)
+        onset_f = np.mean([r['onset_f'] for r in rows])
+        agreements = [r['label_agreement'] for r in rows if r['label_agreement'] is not None]
+        truth_fs = [r['truth_f'] for r in rows if r['truth_f'] is not None]
+
+        agreement = np.mean(agreements) if agreements else None
+        truth_f = np.mean(truth_fs) if truth_fs else None
+
+        def fmt(value):
+            return f"{value:8.3f}" if value is not None else f"{'-':>8}"
+
+        print(f"{rate:>6} {seconds:8.2f} {fmt(onset_f)} {fmt(agreement)} {fmt(truth_f)}")
+
+        # rates are descending, the first one to miss a threshold ends the safe range
+        safe = safe and onset_f >= args.min_onset_f and \
+            (agreement is None or agreement >= args.min_label_agreement)
+        if safe:
+            recommended = rate
+
+    print(f"Lowest safe analysis rate: {recommended} Hz (set SETTINGS['ANALYSIS_SR'])")
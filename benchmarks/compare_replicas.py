@@ -0,0 +1,117 @@
+"""
+Measures how the server's worker pool scales: throughput and memory of 1, 2, 4... pinned replicas,
+with the Keras model loaded by every worker and with the memory-mapped .tflite model they share.
+Memory is reported as the sum of the workers' PSS (shared pages split between the processes that map
+them) next to the sum of their RSS, which counts the shared weights once per worker.
+
+    python benchmarks/compare_replicas.py --workers 1 2 4 --jobs 16
+"""
+
+import sys
+import os
+
+# make the repository root importable when running this file as a script
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+import argparse
+import tempfile
+import time
+
+import soundfile as sf
+
+from utils.config import SETTINGS
+from utils.job_queue import JobQueue, DONE, FAILED
+from server import TranscriptionService
+
+from synthetic import make_drum_clip
+
+
+def get_memory_mb(pid):
+    """
+    :return pss, rss (float, float): proportional and resident set size of the process in MB, None on other OSes
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            values = {line.split(':')[0]: int(line.split()[1]) for line in f if line.split(':')[0] in ('Pss', 'Rss')}
+        return values['Pss']/1024, values['Rss']/1024
+    except (OSError, KeyError):
+        return None, None
+
+
+def run(model_path, n_workers, n_jobs, clip_path, threads=None, timeout=1800):
+    with tempfile.TemporaryDirectory() as data_dir:
+        db_path = os.path.join(data_dir, 'jobs.sqlite')
+        queue = JobQueue(db_path)
+
+        service = TranscriptionService(db_path, data_dir, n_workers=n_workers, model_path=model_path,
+                                       threads=threads, maintenance_interval=1.0)
+        job_ids = [queue.submit(clip_path, {'engine': 'drum_transcriber', 'separate': False, 'start': 0,
+                                            'duration': None, 'format': 'csv'}) for _ in range(n_jobs)]
+        service.start()
+
+        start = time.time()
+        while time.time() - start < timeout:
+            counts = queue.counts()
+            if counts.get(DONE, 0) + counts.get(FAILED, 0) == n_jobs:
+                break
+            time.sleep(0.5)
+
+        # measured while the models are still loaded
+        memory = [get_memory_mb(process.pid) for process in service.workers.values()]
+        service.stop()
+
+        jobs = [queue.get(job_id) for job_id in job_ids]
+        done = [job for job in jobs if job['status'] == DONE]
+        if not done:
+            raise RuntimeError(f"No job finished: {jobs[0]['error']}")
+
+        # from the first claim to the last result, model loading is left out
+        seconds = max(job['finished_at'] for job in done) - min(job['started_at'] for job in done)
+        audio_seconds = sum(job['info']['audio_seconds'] for job in done)
+
+        pss = [m[0] for m in memory if m[0] is not None]
+        rss = [m[1] for m in memory if m[1] is not None]
+        return {
+            'jobs': len(done),
+            'seconds': seconds,
+            'audio_per_second': audio_seconds/seconds,
+            'pss_mb': sum(pss) if pss else None,
+            'rss_mb': sum(rss) if rss else None,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--jobs', type=int, default=16, help='jobs per run')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of audio per job')
+    parser.add_argument('--threads', type=int, default=None, help='threads per worker, the cores split evenly by default')
+    parser.add_argument('--models', nargs='+', default=[SETTINGS['SAVED_MODEL_PATH'], SETTINGS['SHARED_MODEL_PATH']])
+    args = parser.parse_args()
+
+    if SETTINGS['SHARED_MODEL_PATH'] in args.models and not os.path.exists(SETTINGS['SHARED_MODEL_PATH']):
+        from utils.shared_model import convert_to_shared
+        print(f"Converting {SETTINGS['SAVED_MODEL_PATH']} to {SETTINGS['SHARED_MODEL_PATH']}...")
+        convert_to_shared()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        clip_path = os.path.join(temp_dir, 'clip.wav')
+        sf.write(clip_path, make_drum_clip(args.duration)[0], 44100, subtype='PCM_16')
+
+        rows = []
+        for model_path in args.models:
+            for n_workers in args.workers:
+                print(f"Running {args.jobs} jobs on {n_workers} workers with {os.path.basename(model_path)}...")
+                rows.append((model_path, n_workers, run(model_path, n_workers, args.jobs, clip_path, args.threads)))
+
+    def fmt(value):
+        return f"{value:8.0f}" if value is not None else f"{'n/a':>8}"
+
+    print(f"{'model':>24} {'workers':>7} {'seconds':>8} {'audio s/s':>9} {'scaling':>7} {'PSS MB':>8} {'RSS MB':>8}")
+    for model_path, n_workers, result in rows:
+        single = next(r for m, n, r in rows if m == model_path and n == min(args.workers))
+        scaling = result['audio_per_second']/single['audio_per_second']
+        print(f"{os.path.basename(model_path):>24} {n_workers:7d} {result['seconds']:8.1f} "
+              f"{result['audio_per_second']:9.1f} {scaling:7.2f} {fmt(result['pss_mb'])} {fmt(result['rss_mb'])}")
@@ -0,0 +1,178 @@
+"""
+Compares the three source modes of gradio_app (full mix, HPSS percussive part, Demucs drums stem) on
+synthetic drum clips mixed with sustained chords: preparation speed, onsets against the ground truth and
+how much the onsets and labels of each mode agree with the others. Demucs is skipped when not installed.
+
+    python benchmarks/compare_source_modes.py --durations 30 60 --fixtures song.wav
+"""
+
+import sys
+import os
+
+# make the repository root importable when running this file as a script
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+import argparse
+import itertools
+import shutil
+import tempfile
+import time
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from utils.config import SETTINGS
+from utils.audio_utils import get_onsets, get_percussive, match_onsets
+
+from synthetic import make_drum_clip, make_harmonic_bed
+from compare_analysis_rates import f_measure
+
+MODES = ['mix', 'hpss', 'demucs']
+
+
+def prepare(mode, audio_path, samples, sr, temp_dir):
+    """
+    :return source (np.array): what the model is given in this mode, None if the mode is unavailable
+    """
+    if mode == 'mix':
+        return samples
+    if mode == 'hpss':
+        return get_percussive(samples)
+
+    from demucs_processing import DemucsSeparator
+    drums_path = DemucsSeparator(output_dir=os.path.join(temp_dir, 'separated')).separate(audio_path)
+    if drums_path is None:
+        return None
+    return librosa.load(drums_path, sr=sr)[0]
+
+
+def analyse(source, sr, transcriber=None):
+    """
+    :return times, labels (np.array, np.array): onset times and top labels (None without a model)
+    """
+    if transcriber is None:
+        return get_onsets(source, sr)[1], None
+
+    df = transcriber.predict(source, sr)
+    labels = list(SETTINGS['LABELS_INDEX'].values())
+    return df['time'].to_numpy(), np.array(labels)[np.argmax(df[labels].to_numpy(), axis=1)]
+
+
+def compare_clip(audio_path, modes, transcriber=None, truth=None, tolerance=0.05, temp_dir='.'):
+    samples, sr = librosa.load(audio_path, sr=SETTINGS['ANALYSIS_SR'])
+    duration = len(samples)/sr
+
+    results = {}
+    for mode in modes:
+        start = time.perf_counter()
+        source = prepare(mode, audio_path, samples, sr, temp_dir)
+        prepare_seconds = time.perf_counter() - start
+        if source is None:
+            print(f"  {mode}: separation failed, skipped")
+            continue
+
+        start = time.perf_counter()
+        times, labels = analyse(source, sr, transcriber)
+
+        results[mode] = {
+            'times': times,
+            'labels': labels,
+            'prepare_seconds': prepare_seconds,
+            'analyse_seconds': time.perf_counter() - start,
+            # the mix needs no preparation
+            'realtime_factor': duration/prepare_seconds if mode != 'mix' else None,
+            'truth_f': None,
+        }
+
+        if truth is not None:
+            truth_idx, _ = match_onsets(truth, times, tolerance)
+            results[mode]['truth_f'] = f_measure(len(truth_idx), len(truth), len(times))
+
+    agreement = {}
+    for a, b in itertools.combinations(results, 2):
+        a_idx, b_idx = match_onsets(results[a]['times'], results[b]['times'], tolerance)
+        pair = {'onset_f': f_measure(len(a_idx), len(results[a]['times']), len(results[b]['times'])),
+                'label_agreement': None}
+        if results[a]['labels'] is not None and len(a_idx):
+            pair['label_agreement'] = float(np.mean(results[a]['labels'][a_idx] == results[b]['labels'][b_idx]))
+        agreement[(a, b)] = pair
+
+    return results, agreement
+
+
+def fmt(value):
+    return f"{value:8.3f}" if value is not None else f"{'-':>8}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--durations', type=float, nargs='+', default=[30],
+                        help='lengths in seconds of the synthetic clips')
+    parser.add_argument('--bed-level', type=float, default=0.7, help='level of the chords against the drums')
+    parser.add_argument('--fixtures', nargs='*', default=[], help='additional audio files to compare on')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='onset matching tolerance in seconds')
+    parser.add_argument('--skip-model', action='store_true')
+    args = parser.parse_args()
+
+    modes = list(args.modes)
+    if 'demucs' in modes and shutil.which('demucs') is None:
+        print("demucs not found, skipping the Demucs mode (pip install demucs).")
+        modes.remove('demucs')
+
+    transcriber = None
+    if not args.skip_model and os.path.exists(SETTINGS['SAVED_MODEL_PATH']):
+        from DrumTranscriber import DrumTranscriber
+        transcriber = DrumTranscriber()
+    elif not args.skip_model:
+        print(f"{SETTINGS['SAVED_MODEL_PATH']} not found, comparing onsets only.")
+
+    sr = SETTINGS['ANALYSIS_SR']
+    totals = {mode: [] for mode in modes}
+    agreements = {}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        clips = []
+        for duration in args.durations:
+            drums, times, _ = make_drum_clip(duration, sr=sr)
+            mix = drums + args.bed_level*make_harmonic_bed(duration, sr=sr)
+            path = os.path.join(temp_dir, f"synthetic_mix_{duration:g}s.wav")
+            sf.write(path, mix/np.max(np.abs(mix)), sr, subtype='PCM_16')
+            # hits played together count as one onset
+            truth = times[np.concatenate(([True], np.diff(times) > 0.02))]
+            clips.append((path, truth))
+
+        clips += [(path, None) for path in args.fixtures]
+
+        # keep numba compilation and lazy imports out of the first timings
+        warmup = make_drum_clip(2, sr=sr)[0]
+        for mode in set(modes) - {'demucs'}:
+            analyse(prepare(mode, None, warmup, sr, temp_dir), sr, transcriber)
+
+        for path, truth in clips:
+            print(f"Comparing source modes on {os.path.basename(path)}...")
+            results, agreement = compare_clip(path, modes, transcriber, truth, args.tolerance, temp_dir)
+            for mode, result in results.items():
+                totals[mode].append(result)
+            for pair, values in agreement.items():
+                agreements.setdefault(pair, []).append(values)
+
+    print(f"{'mode':>7} {'prepare s':>9} {'x realtime':>10} {'analyse s':>9} {'onsets':>7} {'truth F':>8}")
+    for mode in modes:
+        rows = totals[mode]
+        if not rows:
+            continue
+        truth_fs = [r['truth_f'] for r in rows if r['truth_f'] is not None]
+        realtime = f"{np.mean([r['realtime_factor'] for r in rows]):10.1f}" if mode != 'mix' else f"{'-':>10}"
+        print(f"{mode:>7} {sum(r['prepare_seconds'] for r in rows):9.2f} {realtime} "
+              f"{sum(r['analyse_seconds'] for r in rows):9.2f} "
+              f"{sum(len(r['times']) for r in rows):7d} {fmt(np.mean(truth_fs) if truth_fs else None)}")
+
+    print(f"\n{'pair':>13} {'onset F':>8} {'labels':>8}")
+    for (a, b), rows in agreements.items():
+        label_agreements = [r['label_agreement'] for r in rows if r['label_agreement'] is not None]
+        print(f"{a + '/' + b:>13} {fmt(np.mean([r['onset_f'] for r in rows]))} "
+              f"{fmt(np.mean(label_agreements) if label_agreements else None)}")
@@ -0,0 +1,61 @@
+"""
+Times the dev/preprocessing steps on synthetic clips. Started by run.py from the dev/ directory,
+prints its results as JSON on the last line.
+"""
+
+import sys
+import os
+
+# dev/ has its own utils package that has to shadow the root one
+dev_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dev')
+sys.path.insert(0, dev_dir)
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from preprocessing import Preprocessor
+from utils.audio_utils import get_onset_samples
+
+from synthetic import make_drum_clip
+
+
+def benchmark_preprocessing(duration):
+    stages = {}
+
+    samples, times, labels = make_drum_clip(duration)
+
+    start = time.perf_counter()
+    X = np.array(get_onset_samples(samples))
+    stages['window_extraction'] = time.perf_counter() - start
+
+    # onsets and ground truth do not line up exactly, labels only need the right distribution here
+    y = np.resize(labels, len(X))
+    preprocessor = Preprocessor(X, y)
+
+    start = time.perf_counter()
+    X_balanced, y_balanced = preprocessor.balance_dataset(X, y)
+    stages['balance_dataset'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    X_augmented = preprocessor.augment_train_data(X_balanced, seed=0)
+    stages['augment_train_data'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preprocessor.convert_to_mel_spectrograms(X_augmented, X[:0], X[:0])
+    stages['convert_to_mel_spectrograms'] = time.perf_counter() - start
+
+    return {'windows': len(X_balanced), 'stages': stages,
+            'windows_per_second': len(X_balanced)/sum(stages.values())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--durations', type=float, nargs='+', default=[10])
+    args = parser.parse_args()
+
+    results = {f"synthetic_{d:g}s": benchmark_preprocessing(d) for d in args.durations}
+
+    print(json.dumps(results))
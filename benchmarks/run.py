@@ -0,0 +1,242 @@
+"""
+Benchmark suite for the transcription pipeline.
+
+Times every stage of DrumTranscriber.predict on synthetic (and optionally fixture) drum clips,
+the gradio piano roll player and the dev/ preprocessing, and compares the results against a
+saved JSON baseline.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json --tolerance 0.25
+"""
+
+import sys
+import os
+
+# make the repository root importable when running this file as a script
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from utils.config import SETTINGS
+from utils.instrumentation import Instrumentation, get_rss_mb
+from DrumTranscriber import DrumTranscriber
+
+from synthetic import make_drum_clip
+
+
+class RandomScoresModel:
+    """
+    Stands in for the model when it is not available, random scores keep the other stages of
+    DrumTranscriber.predict measurable.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+
+    def predict(self, x, verbose=0):
+        return self.rng.random((len(x), len(SETTINGS['LABELS_INDEX'])))
+
+
+def benchmark_clip(audio_path, transcriber, player=None):
+    """
+    Times DrumTranscriber.predict stage by stage through its instrumentation on an audio file.
+
+    :param audio_path (str): path of the clip to decode
+    :param transcriber (DrumTranscriber): transcriber to run, see load_transcriber
+    :param player (callable): create_interactive_player, None to skip it
+    :return result (dict): stage timings in seconds, throughput and memory growth while the clip ran
+    """
+    instrumentation = Instrumentation()
+    rss_before = get_rss_mb()
+
+    with instrumentation.stage('decode'):
+        samples, sr = librosa.load(audio_path, sr=transcriber.analysis_sr)
+
+    df = transcriber.predict(samples, sr, instrumentation=instrumentation)
+
+    if player is not None:
+        labels = list(SETTINGS['LABELS_INDEX'].values())
+        top_indices = np.argmax(df[labels].to_numpy(), axis=1)
+        df['prediction'] = [SETTINGS['LABELS_INDEX'][i] for i in top_indices]
+        df['confidence'] = df[labels].to_numpy()[np.arange(len(df)), top_indices]
+
+        with instrumentation.stage('interactive_player'):
+            player(df, samples, sr)
+
+    stages = {s['stage']: s['seconds'] for s in instrumentation.stages}
+    if isinstance(transcriber.model, RandomScoresModel):
+        # only times the stand-in, keep it out of the comparisons with runs using the model
+        stages.pop('model_inference', None)
+
+    # RSS sampled at the end of every stage, relative to before the clip so clips don't inherit
+    # the high-water mark of a larger clip run earlier in this process
+    rss = [s['rss_mb'] for s in instrumentation.stages if s.get('rss_mb') is not None]
+    rss_delta = max(rss) - rss_before if rss and rss_before is not None else None
+
+    audio_seconds = len(samples)/sr
+    pipeline_seconds = sum(v for k, v in stages.items() if k != 'interactive_player')
+
+    return {
+        'audio_seconds': audio_seconds,
+        'hits': len(df),
+        'suppressed_onsets': df.attrs['suppressed_onsets'],
+        'stages': stages,
+        'total_seconds': pipeline_seconds,
+        'hits_per_second': len(df)/pipeline_seconds,
+        'realtime_factor': audio_seconds/pipeline_seconds,
+        'rss_delta_mb': rss_delta,
+    }
+
+
+def benchmark_preprocessing(durations):
+    """
+    dev/ has its own utils package, so the preprocessing benchmark runs in a separate interpreter.
+    """
+    command = [sys.executable, os.path.join(os.path.dirname(__file__), 'preprocessing_bench.py'),
+               '--durations', *[str(d) for d in durations]]
+
+    output = subprocess.run(command, check=True, capture_output=True, text=True,
+                            cwd=os.path.join(root_dir, 'dev'))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def load_transcriber(skip_model=False):
+    if skip_model:
+        return DrumTranscriber(model=RandomScoresModel())
+
+    if not os.path.exists(SETTINGS['SAVED_MODEL_PATH']):
+        print(f"{SETTINGS['SAVED_MODEL_PATH']} not found, skipping model inference.")
+        return DrumTranscriber(model=RandomScoresModel())
+
+    return DrumTranscriber()
+
+
+def load_player():
+    try:
+        from gradio_app import create_interactive_player
+    except ImportError as e:
+        print(f"Could not import gradio_app ({e}), skipping the interactive player.")
+        return None
+
+    return create_interactive_player
+
+
+def compare(results, baseline, tolerance, min_seconds=0.005):
+    """
+    :param results (dict): results of this run
+    :param baseline (dict): results of a previous run
+    :param tolerance (float): allowed relative slowdown before a stage counts as a regression
+    :param min_seconds (float): ignore absolute slowdowns smaller than this
+    :return regressions (list): list of human readable regressions
+    """
+    regressions = []
+
+    for suite in ('clips', 'preprocessing'):
+        for case, result in results.get(suite, {}).items():
+            previous = baseline.get(suite, {}).get(case)
+            if previous is None:
+                continue
+
+            for stage, seconds in result['stages'].items():
+                before = previous['stages'].get(stage)
+                if before is None:
+                    continue
+
+                if seconds > before*(1 + tolerance) and seconds - before > min_seconds:
+                    regressions.append(
+                        f"{suite}/{case}/{stage}: {before:.3f}s -> {seconds:.3f}s (+{(seconds/before - 1)*100:.0f}%)")
+
+    return regressions
+
+
+def print_results(results):
+    for suite in ('clips', 'preprocessing'):
+        for case, result in results.get(suite, {}).items():
+            stages = ' | '.join(f"{k}={v:.3f}s" for k, v in result['stages'].items())
+            print(f"[{suite}] {case}: {stages}")
+
+            if 'realtime_factor' in result:
+                rss_delta = 'n/a' if result['rss_delta_mb'] is None else f"{result['rss_delta_mb']:+.0f} MB"
+                print(f"    {result['hits']} hits ({result.get('suppressed_onsets', 0)} duplicate onsets not classified), "
+                      f"{result['hits_per_second']:.1f} hits/s, "
+                      f"{result['realtime_factor']:.1f}x realtime, RSS {rss_delta}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=float, nargs='+', default=[10, 60, 600],
+                        help='lengths in seconds of the synthetic clips')
+    parser.add_argument('--fixtures', nargs='*', default=[],
+                        help='additional audio files to benchmark')
+    parser.add_argument('--output', default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='compare against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown of a stage reported as a regression')
+    parser.add_argument('--skip-model', action='store_true')
+    parser.add_argument('--skip-player', action='store_true')
+    parser.add_argument('--skip-preprocessing', action='store_true')
+    args = parser.parse_args()
+
+    transcriber = load_transcriber(args.skip_model)
+    player = None if args.skip_player else load_player()
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'cpus': os.cpu_count()},
+        'clips': {},
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # the first librosa calls pay for numba compilation and lazy imports, keep them out of the results
+        warmup_path = os.path.join(temp_dir, 'warmup.wav')
+        sf.write(warmup_path, make_drum_clip(2)[0], 44100, subtype='PCM_16')
+        benchmark_clip(warmup_path, transcriber, player)
+
+        for duration in sorted(args.durations):
+            samples, _, _ = make_drum_clip(duration)
+            path = os.path.join(temp_dir, f"synthetic_{duration:g}s.wav")
+            sf.write(path, samples, 44100, subtype='PCM_16')
+
+            print(f"Benchmarking synthetic {duration:g}s clip...")
+            results['clips'][f"synthetic_{duration:g}s"] = benchmark_clip(path, transcriber, player)
+
+    for path in args.fixtures:
+        print(f"Benchmarking {path}...")
+        results['clips'][os.path.basename(path)] = benchmark_clip(path, transcriber, player)
+
+    if not args.skip_preprocessing:
+        print("Benchmarking dev preprocessing...")
+        results['preprocessing'] = benchmark_preprocessing(
+            [d for d in args.durations if d <= 60])
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"    {regression}")
+            sys.exit(1)
+
+        print(f"No regressions against {args.baseline}.")
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+def _decay(sr, seconds, length):
+    return np.exp(-np.arange(int(sr*length))/(sr*seconds))
+
+
+def get_hit_templates(sr: int = 44100, seed: int = 0) -> dict:
+    """
+    :param sr (int): sample rate used for the templates
+    :param seed (int): seed for the noise based templates
+    :return templates (dict): one-shot samples for every label in SETTINGS['LABELS_INDEX']
+    """
+    rng = np.random.default_rng(seed)
+
+    def noise(length):
+        return rng.uniform(-1, 1, int(sr*length))
+
+    def tone(freq, length):
+        return np.sin(2*np.pi*np.cumsum(np.broadcast_to(freq, int(sr*length)))/sr)
+
+    kick_sweep = np.geomspace(150, 45, int(sr*0.4))
+    hihat_noise = np.diff(noise(0.15), prepend=0)
+    ride_tone = tone(3200, 0.8) + tone(4700, 0.8) + 0.5*noise(0.8)
+
+    templates = {
+        'kick_drum': tone(kick_sweep, 0.4)*_decay(sr, 0.12, 0.4),
+        'snare': (0.6*noise(0.3) + 0.4*tone(190, 0.3))*_decay(sr, 0.06, 0.3),
+        'hihat_c': hihat_noise*_decay(sr, 0.02, 0.15),
+        'tom_h': tone(np.geomspace(260, 180, int(sr*0.4)), 0.4)*_decay(sr, 0.1, 0.4),
+        'ride': ride_tone*_decay(sr, 0.25, 0.8)/2,
+        'crash': np.diff(noise(1.5), prepend=0)*_decay(sr, 0.5, 1.5),
+    }
+
+    return {k: (v/np.max(np.abs(v))).astype(np.float32) for k, v in templates.items()}
+
+
+def make_drum_clip(duration: float, sr: int = 44100, bpm: int = 120, seed: int = 0):
+    """
+    Renders a rock beat on an 8th note grid: kick on 1 and 3, snare on 2 and 4, hi-hat on every 8th,
+    a crash every 4 bars, ride bars and tom fills at random.
+
+    :param duration (float): length of the clip in seconds
+    :param sr (int): sample rate of the clip
+    :param bpm (int): tempo of the beat
+    :param seed (int): seed for the arrangement and templates
+    :return samples, times, labels (np.array, np.array, np.array): the clip and its ground truth hits
+    """
+    rng = np.random.default_rng(seed)
+    templates = get_hit_templates(sr, seed)
+
+    samples = np.zeros(int(duration*sr), dtype=np.float32)
+    times = []
+    labels = []
+
+    eighth = 60/bpm/2
+    for step, t in enumerate(np.arange(0, duration, eighth)):
+        bar, beat = divmod(step, 8)
+        ride_bar = bar % 8 >= 6
+        fill_bar = bar % 4 == 3 and beat >= 4
+
+        hits = ['ride' if ride_bar else 'hihat_c']
+        if beat in (0, 4):
+            hits.append('kick_drum')
+        if beat in (2, 6):
+            hits.append('snare')
+        if beat == 0 and bar % 4 == 0:
+            hits.append('crash')
+        if fill_bar and rng.random() < 0.6:
+            hits = ['tom_h']
+
+        for label in hits:
+            # a little timing and velocity humanisation
+            start = max(int((t + rng.normal(0, 0.004))*sr), 0)
+            template = templates[label][:len(samples) - start]
+            samples[start:start+len(template)] += rng.uniform(0.6, 1.0)*template
+
+            times.append(start/sr)
+            labels.append(label)
+
+    samples /= max(np.max(np.abs(samples)), 1e-9)
+    order = np.argsort(times, kind='stable')
+
+    return samples, np.array(times)[order], np.array(labels)[order]
+
+
+def make_harmonic_bed(duration: float, sr: int = 44100, bpm: int = 120, seed: int = 0) -> np.array:
+    """
+    Renders sustained chords changing every bar with soft attacks, standing in for the non-drum
+    instruments of a mix.
+
+    :param duration (float): length of the bed in seconds
+    :param sr (int): sample rate of the bed
+    :param bpm (int): tempo, chords last one 4/4 bar
+    :param seed (int): seed for the chord progression
+    :return samples (np.array): the bed, peak normalised
+    """
+    rng = np.random.default_rng(seed)
+    bar = int(sr*4*60/bpm)
+    n = int(duration*sr)
+
+    samples = np.zeros(n, dtype=np.float32)
+    envelope = np.minimum(np.arange(bar)/(0.08*sr), 1.0)*np.exp(-np.arange(bar)/(3*sr))
+    t = np.arange(bar)/sr
+
+    for start in range(0, n, bar):
+        root = 110*2**(rng.integers(0, 12)/12)
+        # a major triad an octave up plus the root, with a few harmonics each
+        chord = sum(sum(np.sin(2*np.pi*f*h*t)/h**1.5 for h in range(1, 5))
+                    for f in [root, 2*root, 2*root*2**(4/12), 2*root*2**(7/12)])
+        length = min(bar, n - start)
+        samples[start:start+length] += (chord*envelope)[:length]
+
+    return samples/max(np.max(np.abs(samples)), 1e-9)
@@ -0,0 +1,108 @@
+"""
+Converts the Keras model to faster loading artifacts and records them in the model registry
+(SETTINGS['MODEL_REGISTRY_PATH']) with their hash, label map and input shape:
+
+    saved_model  SavedModel with a pre-traced serving signature (SETTINGS['SIGNATURE_MODEL_PATH'])
+    tflite       memory-mapped TFLite flatbuffer shared between processes (SETTINGS['SHARED_MODEL_PATH'])
+
+    python convert_model.py --formats saved_model tflite --benchmark
+
+Point SETTINGS['SAVED_MODEL_PATH'] at the artifact to serve, DrumTranscriber verifies it against the registry.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+from utils.config import SETTINGS
+from utils.model_registry import register_model, load_model, load_keras_model
+
+OUTPUT_PATHS = {
+    'saved_model': SETTINGS['SIGNATURE_MODEL_PATH'],
+    'tflite': SETTINGS['SHARED_MODEL_PATH'],
+}
+
+
+def convert(source_path=SETTINGS['SAVED_MODEL_PATH'], formats=tuple(OUTPUT_PATHS)):
+    """
+    :return paths (dict): path of the registered source model and of every artifact, keyed by format
+    """
+    from utils.shared_model import convert_to_saved_model, convert_to_shared
+
+    converters = {'saved_model': convert_to_saved_model, 'tflite': convert_to_shared}
+    input_shape = load_keras_model(source_path).input_shape[1:]
+
+    paths = {'keras': source_path}
+    register_model(source_path, input_shape)
+    for model_format in formats:
+        print(f"Converting {source_path} to {model_format}...")
+        paths[model_format] = converters[model_format](source_path, OUTPUT_PATHS[model_format])
+        register_model(paths[model_format], input_shape, source_path=source_path)
+
+    return paths
+
+
+def measure(path, n_inputs=SETTINGS['PREDICT_BATCH_SIZE']):
+    """
+    Cold load time and first prediction of one artifact, meant to run in a fresh interpreter.
+
+    :return result (dict): load seconds, first prediction seconds and predictions on a fixed random batch
+    """
+    start = time.perf_counter()
+    import tensorflow  # noqa: F401, counted apart from the model itself
+    import_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model = load_model(path)
+    load_seconds = time.perf_counter() - start
+
+    images = np.random.default_rng(0).random((n_inputs, *model.input_shape[1:]), dtype=np.float32)
+    start = time.perf_counter()
+    predictions = model.predict(images, verbose=0)
+    first_predict_seconds = time.perf_counter() - start
+
+    return {
+        'import_seconds': import_seconds,
+        'load_seconds': load_seconds,
+        'first_predict_seconds': first_predict_seconds,
+        'predictions': predictions.tolist(),
+    }
+
+
+def measure_in_subprocess(path):
+    # a fresh interpreter per artifact, nothing is cached between them
+    output = subprocess.run([sys.executable, __file__, '--measure', path],
+                            check=True, capture_output=True, text=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=SETTINGS['SAVED_MODEL_PATH'], help='keras model to convert')
+    parser.add_argument('--formats', nargs='+', choices=list(OUTPUT_PATHS), default=list(OUTPUT_PATHS))
+    parser.add_argument('--benchmark', action='store_true', help='compare cold load time and outputs of the artifacts')
+    parser.add_argument('--measure', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+        sys.exit()
+
+    paths = convert(args.source, args.formats)
+    print(f"Registered {', '.join(paths.values())} in {SETTINGS['MODEL_REGISTRY_PATH']}")
+
+    if args.benchmark:
+        results = {model_format: measure_in_subprocess(path) for model_format, path in paths.items()}
+        reference = np.array(results['keras']['predictions'])
+
+        print(f"{'format':>12} {'import s':>8} {'load s':>7} {'1st predict s':>13} {'max abs diff':>12}")
+        for model_format, result in results.items():
+            difference = np.max(np.abs(np.array(result['predictions']) - reference))
+            print(f"{model_format:>12} {result['import_seconds']:8.2f} {result['load_seconds']:7.2f} "
+                  f"{result['first_predict_seconds']:13.2f} {difference:12.2e}")
@@ -2,6 +2,12 @@ import os
 import subprocess
 import shutil
 
+import librosa
+import soundfile as sf
+
+from utils.config import SETTINGS
+from utils.instrumentation import Instrumentation
+
 class DemucsSeparator:
     def __init__(self, output_dir="separated"):
         self.output_dir = output_dir
@@ -9,10 +15,23 @@ class DemucsSeparator:
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-    def separate(self, audio_path):
+    def separate(self, audio_path, instrumentation=None, offset=None, duration=None,
+                 margin=SETTINGS['DEMUCS_CONTEXT_MARGIN']):
         """
         Separates the audio file using Demucs and returns the path to the drums.wav.
+        If an Instrumentation is provided, the separation is recorded as the 'demucs_separation' stage.
+
+        With offset or duration only that range is separated, with margin seconds of context on both sides
+        so the model sees the music around it, and the returned drums.wav starts at offset and lasts duration.
         """
+        if instrumentation is None:
+            instrumentation = Instrumentation(enabled=False)
+
+        source_path = audio_path
+        if offset is not None or duration is not None:
+            with instrumentation.stage('demucs_cut_input'):
+                audio_path, lead = self._cut_input(source_path, offset or 0, duration, margin)
+
         print(f"Separating audio: {audio_path}")
         
         # Run Demucs CLI
@@ -28,13 +47,19 @@ class DemucsSeparator:
         ]
         
         try:
-            subprocess.run(command, check=True)
+            instrumentation.report_progress(0.0, "Separating drums with Demucs...")
+            with instrumentation.profile('demucs'), instrumentation.stage('demucs_separation'):
+                subprocess.run(command, check=True)
+            instrumentation.report_progress(1.0, "Separation complete.")
         except subprocess.CalledProcessError as e:
             print(f"Error running Demucs: {e}")
             return None
         except FileNotFoundError:
              print("Demucs command not found. Please install with `pip install demucs`.")
              return None
+        finally:
+            if audio_path != source_path and os.path.exists(audio_path):
+                os.remove(audio_path)
 
         # Construct path to the output file
         # Demucs output structure: output_dir/htdemucs/filename_no_ext/drums.wav
@@ -44,12 +69,37 @@ class DemucsSeparator:
         drums_path = os.path.join(self.output_dir, "htdemucs", filename_no_ext, "drums.wav")
         
         if os.path.exists(drums_path):
+            if audio_path != source_path:
+                # drop the context margins so the stem lines up with the requested range
+                drums, drums_sr = sf.read(drums_path)
+                start = int(lead*drums_sr)
+                end = len(drums) if duration is None else start + int(duration*drums_sr)
+                sf.write(drums_path, drums[start:end], drums_sr)
+
             print(f"Separation complete. Drums at: {drums_path}")
             return drums_path
         else:
             print(f"Separation failed. Could not find output file: {drums_path}")
             return None
 
+    def _cut_input(self, audio_path, offset, duration, margin):
+        """
+        Writes the requested range plus the margins to a wav named after the source and the range.
+
+        :return cut_path, lead (str, float): path of the cut audio and the seconds of margin before offset
+        """
+        start = max(offset - margin, 0)
+        cut_duration = None if duration is None else offset - start + duration + margin
+
+        samples, sr = librosa.load(audio_path, sr=None, mono=False, offset=start, duration=cut_duration)
+
+        filename_no_ext = os.path.splitext(os.path.basename(audio_path))[0]
+        range_name = f"{offset:g}s" if duration is None else f"{offset:g}s_{duration:g}s"
+        cut_path = os.path.join(self.output_dir, f"{filename_no_ext}_{range_name}.wav")
+        sf.write(cut_path, samples.T, sr)
+
+        return cut_path, offset - start
+
 if __name__ == "__main__":
     # Test stub
     pass
@@ -0,0 +1,139 @@
+"""
+Retrains the shipped model's classifier head as a GlobalAveragePooling head on cached backbone features,
+saves the full model and compares load time, RSS, latency and accuracy of both models.
+
+    cd dev && python convert_head.py
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+SHIPPED_MODEL_PATH = '../model/drum_transcriber.h5'
+# copy to SETTINGS['SAVED_MODEL_PATH'] to serve it with DrumTranscriber
+OUTPUT_MODEL_PATH = './drum_transcriber_gap.h5'
+REPORT_PATH = './head_report.json'
+
+
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # not available on windows
+        return None
+
+    # ru_maxrss is in KB on linux and in bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024**2 if sys.platform == 'darwin' else peak/1024
+
+
+def measure(path, batch_size, repeats=10):
+    """
+    Loads and runs one model the way DrumTranscriber does, meant to run in a fresh interpreter.
+
+    :return result (dict): file size, parameters, load time, peak RSS after loading and per-hit latency
+    """
+    import tensorflow as tf
+
+    start = time.perf_counter()
+    model = tf.keras.models.load_model(path, compile=False)
+    load_seconds = time.perf_counter() - start
+    rss_after_load = get_peak_rss_mb()
+
+    images = np.random.default_rng(0).random((batch_size, *model.input_shape[1:]), dtype=np.float32)
+    model.predict(images, verbose=0)  # warmup
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict(images, verbose=0)
+    ms_per_hit = (time.perf_counter() - start)/(repeats*batch_size)*1000
+
+    return {
+        'file_mb': os.path.getsize(path)/1024**2,
+        'parameters': model.count_params(),
+        'load_seconds': load_seconds,
+        'peak_rss_mb': rss_after_load,
+        'ms_per_hit': ms_per_hit,
+    }
+
+
+def measure_in_subprocess(path, batch_size):
+    # a fresh interpreter per model keeps the load time and RSS of one from leaking into the other
+    output = subprocess.run([sys.executable, __file__, '--measure', path, '--batch-size', str(batch_size)],
+                            check=True, capture_output=True, text=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def convert(shipped_model_path=SHIPPED_MODEL_PATH, output_model_path=OUTPUT_MODEL_PATH):
+    """
+    :return test_accuracy (dict): test accuracy of the shipped head and of the new head on the cached features
+    """
+    from tensorflow.keras import models, layers, optimizers
+
+    from train import get_head, assemble_model
+    from train_head import get_embeddings
+
+    shipped = models.load_model(shipped_model_path, compile=False)
+
+    # the backbone is frozen, so the shipped one is reused as is and only the head is retrained
+    conv_base = shipped.layers[0]
+    conv_base.trainable = False
+
+    X_train, y_train = get_embeddings(conv_base, 'train')
+    X_val, y_val = get_embeddings(conv_base, 'val')
+    X_test, y_test = get_embeddings(conv_base, 'test')
+
+    head = get_head(X_train.shape[1:], head_type='gap')
+    head.compile(loss='binary_crossentropy',
+                 optimizer=optimizers.Adam(learning_rate=0.0005),
+                 metrics=['acc'])
+    head.fit(X_train, y_train,
+             batch_size=64,
+             epochs=50,
+             validation_data=(X_val, y_val),
+             shuffle=True)
+
+    shipped_head = models.Sequential([layers.Input(shape=X_test.shape[1:]), *shipped.layers[1:]])
+
+    y_test_int = np.argmax(y_test, axis=1)
+    test_accuracy = {
+        name: float(np.mean(np.argmax(model.predict(X_test, batch_size=64, verbose=0), axis=1) == y_test_int))
+        for name, model in [('flatten', shipped_head), ('gap', head)]
+    }
+
+    assemble_model(conv_base, head).save(output_model_path)
+    print(f"Saved GlobalAveragePooling model to {output_model_path}")
+
+    return test_accuracy
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--measure', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--skip-training', action='store_true', help=f'only compare with an existing {OUTPUT_MODEL_PATH}')
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.batch_size)))
+        sys.exit()
+
+    report = {'test_accuracy': None if args.skip_training else convert()}
+    for name, path in [('flatten', SHIPPED_MODEL_PATH), ('gap', OUTPUT_MODEL_PATH)]:
+        report[name] = measure_in_subprocess(path, args.batch_size)
+
+    print(f"{'head':>8} {'params':>12} {'file MB':>8} {'load s':>7} {'RSS MB':>7} {'ms/hit':>7} {'accuracy':>8}")
+    for name in ['flatten', 'gap']:
+        r = report[name]
+        accuracy = f"{report['test_accuracy'][name]:8.3f}" if report['test_accuracy'] else f"{'-':>8}"
+        rss = f"{r['peak_rss_mb']:7.0f}" if r['peak_rss_mb'] is not None else f"{'n/a':>7}"
+        print(f"{name:>8} {r['parameters']:12,d} {r['file_mb']:8.1f} {r['load_seconds']:7.2f} {rss} "
+              f"{r['ms_per_hit']:7.2f} {accuracy}")
+
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
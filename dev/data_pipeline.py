@@ -0,0 +1,133 @@
+import numpy as np
+import tensorflow as tf
+
+from utils.audio_utils import Augmenter, get_mel_spectrogram
+from utils.config import SETTINGS
+
+
+def labels_to_categorical(y) -> np.array:
+    """
+    :param y (np.array): array of string labels
+    :return y_categorical (np.array): float32 one-hot array following SETTINGS['LABELS_INDEX']
+    """
+    labels_dict_reverse = {v: k for k, v in SETTINGS['LABELS_INDEX'].items()}
+    y_int = np.array([labels_dict_reverse[label] for label in y])
+
+    return np.eye(len(labels_dict_reverse), dtype=np.float32)[y_int]
+
+
+def windows_to_images(X) -> np.array:
+    """
+    :param X (np.array): 2D array of onset windows
+    :return images (np.array): float32 array of mel spectrograms in [0, 1] with 3 identical channels,
+                               the same input the model sees from the png dataset and at inference
+    """
+    mel_specs = np.array([get_mel_spectrogram(x) for x in X], dtype=np.float32)
+    return np.repeat(mel_specs[..., np.newaxis], 3, axis=-1)
+
+
+def _map_batches(dataset, load_batch, deterministic):
+    image_shape = (None, *SETTINGS['TARGET_SHAPE'], 3)
+    label_shape = (None, len(SETTINGS['LABELS_INDEX']))
+
+    def tf_load_batch(batch_number, batch_indices):
+        images, labels = tf.numpy_function(load_batch, [batch_number, batch_indices],
+                                           [tf.float32, tf.float32])
+        images.set_shape(image_shape)
+        labels.set_shape(label_shape)
+        return images, labels
+
+    return dataset.map(tf_load_batch,
+                       num_parallel_calls=tf.data.AUTOTUNE,
+                       deterministic=deterministic).prefetch(tf.data.AUTOTUNE)
+
+
+def get_train_dataset(X_train, y_train, batch_size=64, seed=None, augment=True) -> tf.data.Dataset:
+    """
+    Endless, class balanced training stream. Only the raw onset windows are kept in memory,
+    every batch is sampled, augmented and converted to mel spectrograms on the fly so each
+    epoch sees fresh augmentations.
+
+    :param X_train (np.array): 2D array of raw onset windows
+    :param y_train (np.array): array of string labels
+    :param batch_size (int): number of windows per batch
+    :param seed (int): seed for sampling and augmentation, None for non-deterministic batches
+    :param augment (bool): whether to apply waveform augmentation
+    :return dataset (tf.data.Dataset): dataset yielding (images, one-hot labels) batches
+    """
+    X_train = np.asarray(X_train, dtype=np.float32)
+    y_train = labels_to_categorical(y_train)
+    y_int = np.argmax(y_train, axis=1)
+
+    # one reshuffled, repeating stream of indices per label, drawn with equal weights
+    class_datasets = []
+    for label in SETTINGS['LABELS_INDEX'].keys():
+        label_indices = np.where(y_int == label)[0]
+        if len(label_indices) == 0:
+            continue
+
+        class_datasets.append(tf.data.Dataset.from_tensor_slices(label_indices)
+                              .shuffle(len(label_indices), seed=seed, reshuffle_each_iteration=True)
+                              .repeat())
+
+    indices = tf.data.Dataset.sample_from_datasets(class_datasets, seed=seed)
+    indices = indices.batch(batch_size, drop_remainder=True)
+
+    # the batch number seeds the augmentation so that seeded runs stay reproducible
+    # while batches are mapped in parallel
+    dataset = tf.data.Dataset.zip((tf.data.Dataset.counter(), indices))
+
+    def load_batch(batch_number, batch_indices):
+        windows = X_train[batch_indices]
+
+        if augment:
+            augmenter = Augmenter(sr=SETTINGS['ANALYSIS_SR'],
+                                  seed=None if seed is None else seed + int(batch_number))
+            windows = augmenter.augment_batch(windows)
+
+        return windows_to_images(windows), y_train[batch_indices]
+
+    return _map_batches(dataset, load_batch, deterministic=seed is not None)
+
+
+def get_eval_dataset(X, y, batch_size=64) -> tf.data.Dataset:
+    """
+    :param X (np.array): 2D array of raw onset windows
+    :param y (np.array): array of string labels
+    :param batch_size (int): number of windows per batch
+    :return dataset (tf.data.Dataset): single pass dataset yielding (images, one-hot labels) batches
+    """
+    X = np.asarray(X, dtype=np.float32)
+    y = labels_to_categorical(y)
+
+    indices = tf.data.Dataset.range(len(X)).batch(batch_size)
+    dataset = tf.data.Dataset.zip((tf.data.Dataset.counter(), indices))
+
+    def load_batch(batch_number, batch_indices):
+        return windows_to_images(X[batch_indices]), y[batch_indices]
+
+    return _map_batches(dataset, load_batch, deterministic=True)
+
+
+def get_mel_dataset(X_mel, y, batch_size=64, shuffle=False, seed=None) -> tf.data.Dataset:
+    """
+    :param X_mel (np.array): 3D array of mel spectrograms in [0, 1], e.g. from Preprocessor.preprocess
+    :param y (np.array): 2D array of targets, one-hot labels or soft targets
+    :param batch_size (int): number of spectrograms per batch
+    :param shuffle (bool): reshuffle every epoch
+    :param seed (int): seed for shuffling
+    :return dataset (tf.data.Dataset): single pass dataset yielding (images, targets) batches, the 3 channel
+                                       images are only built per batch
+    """
+    y = np.asarray(y, dtype=np.float32)
+
+    indices = tf.data.Dataset.range(len(X_mel))
+    if shuffle:
+        indices = indices.shuffle(len(X_mel), seed=seed, reshuffle_each_iteration=True)
+    dataset = tf.data.Dataset.zip((tf.data.Dataset.counter(), indices.batch(batch_size)))
+
+    def load_batch(batch_number, batch_indices):
+        mel_specs = np.asarray(X_mel[batch_indices], dtype=np.float32)
+        return np.repeat(mel_specs[..., np.newaxis], 3, axis=-1), y[batch_indices]
+
+    return _map_batches(dataset, load_batch, deterministic=seed is not None or not shuffle)
@@ -2,6 +2,7 @@ from utils.audio_utils import *
 from utils.config import SETTINGS
 
 import json
+import hashlib
 
 import pandas as pd
 from sklearn.model_selection import train_test_split
@@ -12,6 +13,9 @@ from collections import Counter
 
 import os
 
+# dataset indices of the train, val and test sets, shared by train.py, train_cascade.py and train_distill.py
+SPLIT_PATH = './split.json'
+
 
 class Labels():
     def __init__(self, json_path):
@@ -34,7 +38,7 @@ class Labels():
 
         audio_path = self.get_audio_path()
 
-        samples, _ = librosa.load(audio_path, sr=44100)
+        samples, _ = librosa.load(audio_path, sr=SETTINGS['ANALYSIS_SR'])
         onset_samples = get_onset_samples(samples)
 
         labeled_samples = [
@@ -81,14 +85,44 @@ class Preprocessor():
         self.X = X
         self.y = y
 
-    def train_val_test_split(self):
-        X_train, X_test, y_train, y_test = train_test_split(
-            self.X, self.y, test_size=SETTINGS['VAL_TEST_RATIO'], stratify=self.y)
+    def get_split_indices(self, split_path=SPLIT_PATH):
+        """
+        Seeded stratified split of the dataset, saved to split_path the first time and loaded afterwards,
+        so no model is evaluated on hits another one was trained on.
 
-        X_val, X_test, y_val, y_test = train_test_split(
-            X_test, y_test, test_size=SETTINGS['TEST_RATIO'], stratify=y_test)
+        :return train, val, test (list, list, list): dataset indices of each set
+        """
+        y = np.asarray(self.y)
+        labels_sha256 = hashlib.sha256('\n'.join(map(str, y)).encode()).hexdigest()
 
-        return X_train, y_train, X_val, y_val, X_test, y_test
+        if split_path is not None and os.path.exists(split_path):
+            with open(split_path, 'r') as f:
+                split = json.load(f)
+
+            if split['labels_sha256'] != labels_sha256:
+                raise ValueError(f"{split_path} was saved for another dataset, delete it to split this one")
+
+            return split['train'], split['val'], split['test']
+
+        train, test = train_test_split(
+            np.arange(len(y)), test_size=SETTINGS['VAL_TEST_RATIO'], stratify=y, random_state=SETTINGS['SPLIT_SEED'])
+
+        val, test = train_test_split(
+            test, test_size=SETTINGS['TEST_RATIO'], stratify=y[test], random_state=SETTINGS['SPLIT_SEED'])
+
+        split = {'seed': SETTINGS['SPLIT_SEED'], 'labels_sha256': labels_sha256,
+                 'train': train.tolist(), 'val': val.tolist(), 'test': test.tolist()}
+        if split_path is not None:
+            with open(split_path, 'w') as f:
+                json.dump(split, f)
+
+        return split['train'], split['val'], split['test']
+
+    def train_val_test_split(self, split_path=SPLIT_PATH):
+        train, val, test = self.get_split_indices(split_path)
+
+        X, y = np.asarray(self.X), np.asarray(self.y)
+        return X[train], y[train], X[val], y[val], X[test], y[test]
 
     def balance_dataset(self, X_train, y_train, N=None, verbose=False):
         label_counts = dict(Counter(y_train))
@@ -101,6 +135,10 @@ class Preprocessor():
             N = max(label_counts.values())
 
         for label in SETTINGS['LABELS_INDEX'].values():
+            if label not in label_counts:
+                print(f"No {label} samples to balance, leaving it out.")
+                continue
+
             if verbose:
                 print(f"Sampling {label} from {label_counts[label]} to {N}...")
 
@@ -126,8 +164,9 @@ class Preprocessor():
 
         return X_train_sampled, y_train_sampled
 
-    def augment_train_data(self, X_train):
-        return np.array([apply_augmentation(x) for x in X_train])
+    def augment_train_data(self, X_train, seed=SETTINGS['AUGMENTATION_SEED']):
+        augmenter = Augmenter(sr=SETTINGS['ANALYSIS_SR'], seed=seed)
+        return augmenter.augment_batch(np.array(X_train))
 
     def convert_to_mel_spectrograms(self, X_train, X_val, X_test):
         X_train = np.array([get_mel_spectrogram(x) for x in X_train])
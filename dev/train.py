@@ -7,6 +7,7 @@ from tensorflow.keras.applications import InceptionResNetV2
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 
 from preprocessing import Dataset, Preprocessor
+from data_pipeline import get_train_dataset, get_eval_dataset
 
 from utils.config import SETTINGS
 from datetime import datetime
@@ -16,32 +17,93 @@ import mlflow.keras
 
 MODEL_PATH = None
 
+# stream balanced, augmented batches from the raw onset windows in ./labels
+# instead of reading the precomputed png dataset from ./dataset
+STREAMING_PIPELINE = False
+LABELS_PATH = './labels'
+
+
+def get_conv_base():
+    conv_base = InceptionResNetV2(weights="imagenet",
+                                  include_top=False,
+                                  input_shape=(*SETTINGS['TARGET_SHAPE'], 3)
+                                  )
+
+    # make it so the conv_base is not trainable
+    conv_base.trainable = False
+
+    return conv_base
+
+
+def get_head_layers(head_type=SETTINGS['HEAD_TYPE']):
+    """
+    :param head_type (str): 'flatten' or 'gap', see SETTINGS['HEAD_TYPE']
+    :return layers (list): the classifier head layers, from the backbone output to the 6 sigmoid outputs
+    """
+    if head_type == 'gap':
+        return [
+            layers.GlobalAveragePooling2D(),
+            layers.Dense(512, activation='relu'),
+            layers.Dropout(0.4),
+            layers.Dense(128, activation='relu'),
+            layers.Dropout(0.2),
+            layers.Dense(6, activation='sigmoid')  # 6 classes
+        ]
+
+    if head_type != 'flatten':
+        raise ValueError(f"Unknown head type {head_type!r}, expected 'flatten' or 'gap'")
+
+    return [
+        layers.Flatten(),
+        layers.Dense(2048, activation='relu'),
+        layers.Dropout(0.5),
+        layers.Dense(1024, activation='relu'),
+        layers.Dropout(0.3),
+        layers.Dense(512, activation='relu'),
+        layers.Dropout(0.3),
+        layers.Dense(256, activation='relu'),
+        layers.Dropout(0.25),
+        layers.Dense(128, activation='relu'),
+        layers.Dropout(0.15),
+        layers.Dense(6, activation='sigmoid')  # 6 classes
+    ]
+
+
+def get_head(feature_shape, head_type=SETTINGS['HEAD_TYPE']):
+    """
+    :param feature_shape (tuple): shape of the conv_base output, without the batch dimension
+    :param head_type (str): 'flatten' or 'gap', see SETTINGS['HEAD_TYPE']
+    :return head (models.Sequential): the classifier head on its own, trainable on cached conv_base features
+    """
+    head = models.Sequential()
+    head.add(layers.Input(shape=feature_shape))
+    for layer in get_head_layers(head_type):
+        head.add(layer)
+
+    return head
+
+
+def assemble_model(conv_base, head):
+    """
+    :param conv_base (models.Model): the frozen backbone
+    :param head (models.Sequential): head trained on the conv_base features
+    :return model (models.Sequential): full model with the same layout as get_model, loadable by DrumTranscriber
+    """
+    model = models.Sequential()
+    model.add(conv_base)
+    for layer in head.layers:
+        model.add(layer)
 
-def get_model(path=None):
-    if path is None:
-        conv_base = InceptionResNetV2(weights="imagenet",
-                                      include_top=False,
-                                      input_shape=(256, 256, 3)
-                                      )
+    return model
 
-        # make it so the conv_base is not trainable
-        conv_base.trainable = False
 
+def get_model(path=None, head_type=SETTINGS['HEAD_TYPE']):
+    if path is None:
         # add more layers on top of the Inception model
         model = models.Sequential()
-        model.add(conv_base)
-        model.add(layers.Flatten())
-        model.add(layers.Dense(2048, activation='relu'))
-        model.add(layers.Dropout(0.5))
-        model.add(layers.Dense(1024, activation='relu'))
-        model.add(layers.Dropout(0.3))
-        model.add(layers.Dense(512, activation='relu'))
-        model.add(layers.Dropout(0.3))
-        model.add(layers.Dense(256, activation='relu'))
-        model.add(layers.Dropout(0.25))
-        model.add(layers.Dense(128, activation='relu'))
-        model.add(layers.Dropout(0.15))
-        model.add(layers.Dense(6, activation='sigmoid'))  # 6 classes
+        model.add(get_conv_base())
+        for layer in get_head_layers(head_type):
+            model.add(layer)
 
     else:
         model = models.load_model(path)
@@ -52,25 +114,37 @@ def get_model(path=None):
 if __name__ == '__main__':
     mlflow.tensorflow.autolog()
 
-    train_datagen = ImageDataGenerator(rescale=1./255)
-    val_datagen = ImageDataGenerator(rescale=1./255)
-    test_datagen = ImageDataGenerator(rescale=1./255)
-
-    train_generator = train_datagen.flow_from_directory(
-        './dataset/train',
-        target_size=(256, 256),
-        batch_size=64,
-        class_mode='categorical')
-    validation_generator = val_datagen.flow_from_directory(
-        './dataset/val',
-        target_size=(256, 256),
-        batch_size=64,
-        class_mode='categorical')
-    test_generator = test_datagen.flow_from_directory(
-        './dataset/test',
-        target_size=(256, 256),
-        batch_size=64,
-        class_mode='categorical')
+    if STREAMING_PIPELINE:
+        dataset = Dataset(LABELS_PATH)
+        X, y = dataset.generate_data(verbose=True)
+
+        X_train, y_train, X_val, y_val, X_test, y_test = Preprocessor(
+            X, y).train_val_test_split()
+
+        train_generator = get_train_dataset(X_train, y_train, batch_size=64)
+        validation_generator = get_eval_dataset(X_val, y_val, batch_size=64).repeat()
+        test_generator = get_eval_dataset(X_test, y_test, batch_size=64)
+
+    else:
+        train_datagen = ImageDataGenerator(rescale=1./255)
+        val_datagen = ImageDataGenerator(rescale=1./255)
+        test_datagen = ImageDataGenerator(rescale=1./255)
+
+        train_generator = train_datagen.flow_from_directory(
+            './dataset/train',
+            target_size=SETTINGS['TARGET_SHAPE'],
+            batch_size=64,
+            class_mode='categorical')
+        validation_generator = val_datagen.flow_from_directory(
+            './dataset/val',
+            target_size=SETTINGS['TARGET_SHAPE'],
+            batch_size=64,
+            class_mode='categorical')
+        test_generator = test_datagen.flow_from_directory(
+            './dataset/test',
+            target_size=SETTINGS['TARGET_SHAPE'],
+            batch_size=64,
+            class_mode='categorical')
 
     # initialise and build CNN model based on InceptionResNetV2
     model = get_model(MODEL_PATH)
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+
+import numpy as np
+import joblib
+
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from tensorflow.keras import models
+
+from preprocessing import Dataset, Preprocessor, SPLIT_PATH
+from data_pipeline import windows_to_images
+
+from utils.audio_utils import get_pooled_features
+from utils.config import SETTINGS
+
+LABELS_PATH = './labels'
+# the full model the first stage escalates to, used to measure the cascade
+FULL_MODEL_PATH = '../model/drum_transcriber.h5'
+# copy to SETTINGS['CASCADE_MODEL_PATH'] to use it in DrumTranscriber
+OUTPUT_MODEL_PATH = './cascade_stage1.joblib'
+REPORT_PATH = './cascade_report.json'
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99]
+# largest accuracy loss against the full model accepted for the recommended threshold
+MAX_ACCURACY_DROP = 0.005
+
+
+def get_first_stage():
+    return make_pipeline(StandardScaler(),
+                         LogisticRegression(max_iter=2000, C=0.5))
+
+
+def time_per_hit(function, X):
+    start = time.perf_counter()
+    output = function(X)
+    return output, (time.perf_counter() - start)/max(len(X), 1)
+
+
+def evaluate_cascade(first_stage, full_model, X_test, y_test, thresholds=THRESHOLDS):
+    """
+    :return report (dict): per-hit latency of both stages, accuracy of each stage on its own and the
+                           escalation rate, accuracy and expected per-hit latency of the cascade per threshold
+    """
+    labels = np.array(list(SETTINGS['LABELS_INDEX'].values()))
+    columns = [list(first_stage.classes_).index(label) for label in labels]
+
+    first_probabilities, first_seconds = time_per_hit(
+        lambda X: first_stage.predict_proba(get_pooled_features(X))[:, columns], X_test)
+    full_probabilities, full_seconds = time_per_hit(
+        lambda X: full_model.predict(windows_to_images(X), batch_size=SETTINGS['PREDICT_BATCH_SIZE'], verbose=0),
+        X_test)
+
+    first_labels = labels[np.argmax(first_probabilities, axis=1)]
+    full_labels = labels[np.argmax(full_probabilities, axis=1)]
+
+    report = {
+        'hits': len(X_test),
+        'first_stage_ms_per_hit': first_seconds*1000,
+        'full_model_ms_per_hit': full_seconds*1000,
+        'first_stage_accuracy': float(np.mean(first_labels == y_test)),
+        'full_model_accuracy': float(np.mean(full_labels == y_test)),
+        'thresholds': [],
+    }
+
+    confidence = first_probabilities.max(axis=1)
+    for threshold in thresholds:
+        escalated = confidence < threshold
+        cascade_labels = np.where(escalated, full_labels, first_labels)
+
+        report['thresholds'].append({
+            'threshold': threshold,
+            'escalation_rate': float(escalated.mean()),
+            'accuracy': float(np.mean(cascade_labels == y_test)),
+            'ms_per_hit': (first_seconds + escalated.mean()*full_seconds)*1000,
+        })
+
+    return report
+
+
+def print_report(report):
+    print(f"First stage: {report['first_stage_accuracy']:.3f} accuracy, {report['first_stage_ms_per_hit']:.1f} ms/hit")
+    print(f"Full model:  {report['full_model_accuracy']:.3f} accuracy, {report['full_model_ms_per_hit']:.1f} ms/hit")
+
+    print(f"{'threshold':>9} {'escalated':>9} {'accuracy':>8} {'ms/hit':>7}")
+    for row in report['thresholds']:
+        print(f"{row['threshold']:9.2f} {row['escalation_rate']:9.1%} {row['accuracy']:8.3f} {row['ms_per_hit']:7.1f}")
+
+    # the lowest threshold escalates the fewest hits, take the first one close enough to the full model
+    acceptable = [row for row in report['thresholds']
+                  if row['accuracy'] >= report['full_model_accuracy'] - MAX_ACCURACY_DROP]
+    if acceptable:
+        print(f"Recommended SETTINGS['CASCADE_THRESHOLD']: {acceptable[0]['threshold']}")
+    else:
+        print("No threshold keeps the accuracy within the allowed drop, keep the cascade disabled.")
+
+
+if __name__ == '__main__':
+    dataset = Dataset(LABELS_PATH)
+    X, y = dataset.generate_data(verbose=True)
+
+    # the split saved when the full model was trained, so its test hits stay unseen by both stages
+    if not os.path.exists(SPLIT_PATH):
+        print(f"{SPLIT_PATH} not found, the new split may test the full model on hits it was trained on.")
+    preprocessor = Preprocessor(X, y)
+    X_train, y_train, X_val, y_val, X_test, y_test = preprocessor.train_val_test_split()
+
+    # same balancing and augmentation as the full model's training set
+    X_train, y_train = preprocessor.balance_dataset(X_train, y_train, N=SETTINGS['TRAINING_SAMPLES_PER_LABEL'])
+    X_train = preprocessor.augment_train_data(X_train)
+
+    print('Computing pooled features...')
+    features_train = get_pooled_features(X_train)
+
+    first_stage = get_first_stage()
+    first_stage.fit(features_train, y_train)
+    print(f"Validation accuracy: {first_stage.score(get_pooled_features(X_val), y_val):.3f}")
+
+    joblib.dump(first_stage, OUTPUT_MODEL_PATH)
+    print(f"Saved first stage to {OUTPUT_MODEL_PATH}")
+
+    full_model = models.load_model(FULL_MODEL_PATH, compile=False)
+    report = evaluate_cascade(first_stage, full_model, np.array(X_test), np.array(y_test))
+    print_report(report)
+
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+
+import numpy as np
+
+from tensorflow.keras import models, layers, optimizers, callbacks
+
+from preprocessing import Dataset, Preprocessor, SPLIT_PATH
+from data_pipeline import get_mel_dataset
+
+from utils.config import SETTINGS
+
+import mlflow
+import mlflow.keras
+
+LABELS_PATH = './labels'
+# the shipped InceptionResNetV2 model the student learns from
+TEACHER_MODEL_PATH = '../model/drum_transcriber.h5'
+# copy to SETTINGS['SAVED_MODEL_PATH'] to serve the student with DrumTranscriber
+OUTPUT_MODEL_PATH = './drum_transcriber_student.h5'
+REPORT_PATH = './distillation_report.json'
+
+# teacher probabilities are softened with this temperature on their logits,
+# the student is fit to ALPHA * hard labels + (1 - ALPHA) * soft targets
+TEMPERATURE = 2.0
+ALPHA = 0.3
+
+
+def get_student(input_shape=(*SETTINGS['TARGET_SHAPE'], 3), n_labels=len(SETTINGS['LABELS_INDEX'])):
+    """
+    :return student (models.Sequential): small CNN taking the same input and giving the same sigmoid
+                                         outputs as the teacher, so DrumTranscriber can load either
+    """
+    model = models.Sequential()
+    model.add(layers.Input(shape=input_shape))
+
+    # a strided first convolution halves the 256x256 input before the separable blocks
+    model.add(layers.Conv2D(16, 3, strides=2, padding='same'))
+    model.add(layers.BatchNormalization())
+    model.add(layers.ReLU())
+
+    for filters in [32, 64, 128]:
+        model.add(layers.SeparableConv2D(filters, 3, padding='same'))
+        model.add(layers.BatchNormalization())
+        model.add(layers.ReLU())
+        model.add(layers.MaxPooling2D(2))
+
+    model.add(layers.SeparableConv2D(128, 3, padding='same'))
+    model.add(layers.BatchNormalization())
+    model.add(layers.ReLU())
+    model.add(layers.GlobalAveragePooling2D())
+    model.add(layers.Dropout(0.3))
+    model.add(layers.Dense(n_labels, activation='sigmoid'))
+
+    return model
+
+
+def soften(probabilities, temperature=TEMPERATURE):
+    """
+    :param probabilities (np.array): sigmoid outputs of the teacher
+    :return soft_targets (np.array): the same outputs with their logits divided by temperature
+    """
+    probabilities = np.clip(probabilities, 1e-6, 1 - 1e-6)
+    logits = np.log(probabilities/(1 - probabilities))
+
+    return 1/(1 + np.exp(-logits/temperature))
+
+
+def get_teacher_predictions(teacher, X_mel, batch_size=SETTINGS['PREDICT_BATCH_SIZE']):
+    return teacher.predict(get_mel_dataset(X_mel, np.zeros((len(X_mel), len(SETTINGS['LABELS_INDEX']))),
+                                           batch_size=batch_size), verbose=1)
+
+
+def benchmark_model(path, X_mel, batch_size=SETTINGS['PREDICT_BATCH_SIZE']):
+    """
+    :return result (dict): load time, file size, parameters, per-hit latency and predictions of the saved model
+    """
+    start = time.perf_counter()
+    model = models.load_model(path, compile=False)
+    load_seconds = time.perf_counter() - start
+
+    images = np.repeat(np.asarray(X_mel[:batch_size], dtype=np.float32)[..., np.newaxis], 3, axis=-1)
+    model.predict(images, verbose=0)  # warmup
+
+    start = time.perf_counter()
+    predictions = model.predict(get_mel_dataset(X_mel, np.zeros((len(X_mel), len(SETTINGS['LABELS_INDEX']))),
+                                                batch_size=batch_size), verbose=0)
+    ms_per_hit = (time.perf_counter() - start)/max(len(X_mel), 1)*1000
+
+    return {
+        'load_seconds': load_seconds,
+        'file_mb': os.path.getsize(path)/1024**2,
+        'parameters': model.count_params(),
+        'ms_per_hit': ms_per_hit,
+        'predictions': predictions,
+    }
+
+
+if __name__ == '__main__':
+    mlflow.tensorflow.autolog()
+
+    dataset = Dataset(LABELS_PATH)
+    X, y = dataset.generate_data(verbose=True)
+
+    # same balancing, augmentation and mel spectrograms as the teacher was trained on, and the split
+    # saved by its training run, so the test hits are unseen by both models
+    if not os.path.exists(SPLIT_PATH):
+        print(f"{SPLIT_PATH} not found, the new split may test the teacher on hits it was trained on.")
+    X_train, y_train, X_val, y_val, X_test, y_test = Preprocessor(X, y).preprocess(verbose=True)
+
+    teacher = models.load_model(TEACHER_MODEL_PATH, compile=False)
+
+    print('Computing teacher soft targets...')
+    train_targets = ALPHA*y_train + (1 - ALPHA)*soften(get_teacher_predictions(teacher, X_train))
+    val_targets = ALPHA*y_val + (1 - ALPHA)*soften(get_teacher_predictions(teacher, X_val))
+    del teacher
+
+    student = get_student()
+    student.compile(loss='binary_crossentropy',
+                    optimizer=optimizers.Adam(learning_rate=0.001),
+                    metrics=['acc'])
+
+    student.fit(
+        get_mel_dataset(X_train, train_targets, batch_size=64, shuffle=True),
+        epochs=50,
+        validation_data=get_mel_dataset(X_val, val_targets, batch_size=64),
+        callbacks=[callbacks.EarlyStopping(patience=5, restore_best_weights=True)])
+
+    student.save(OUTPUT_MODEL_PATH)
+    print(f"Saved student to {OUTPUT_MODEL_PATH}")
+
+    # compare both saved models the way DrumTranscriber loads and runs them
+    y_test_int = np.argmax(y_test, axis=1)
+    report = {}
+    for name, path in [('teacher', TEACHER_MODEL_PATH), ('student', OUTPUT_MODEL_PATH)]:
+        result = benchmark_model(path, X_test)
+        predictions = result.pop('predictions')
+        result['accuracy'] = float(np.mean(np.argmax(predictions, axis=1) == y_test_int))
+        report[name] = result
+        report[name]['labels'] = np.argmax(predictions, axis=1)
+
+    report['student']['teacher_agreement'] = float(np.mean(report['student']['labels'] == report['teacher']['labels']))
+    for name in ['teacher', 'student']:
+        del report[name]['labels']
+
+    print(f"{'model':>8} {'params':>12} {'file MB':>8} {'load s':>7} {'ms/hit':>7} {'accuracy':>8}")
+    for name in ['teacher', 'student']:
+        r = report[name]
+        print(f"{name:>8} {r['parameters']:12,d} {r['file_mb']:8.1f} {r['load_seconds']:7.2f} "
+              f"{r['ms_per_hit']:7.2f} {r['accuracy']:8.3f}")
+    print(f"Student agrees with the teacher on {report['student']['teacher_agreement']:.1%} of test hits")
+
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
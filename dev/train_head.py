@@ -0,0 +1,126 @@
+import os
+import hashlib
+
+import numpy as np
+
+from tensorflow.keras import optimizers, utils
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+from train import get_conv_base, get_head, assemble_model
+
+from utils.config import SETTINGS
+
+import mlflow
+import mlflow.keras
+
+DATASET_PATH = './dataset'
+EMBEDDINGS_PATH = './embeddings'
+OUTPUT_MODEL_PATH = './drum_transcriber.h5'
+
+
+def cache_embeddings(conv_base, generator, path, dtype=np.float16):
+    """
+    Runs the frozen conv_base once over every image of the generator and writes the features to disk.
+
+    :param conv_base (models.Model): the frozen backbone
+    :param generator (DirectoryIterator): non-shuffled image generator of one dataset split
+    :param path (str): path prefix of the cache, {path}_features.npy and {path}_labels.npy are written
+    :param dtype (np.dtype): dtype the features are stored with
+    """
+    features = np.lib.format.open_memmap(f"{path}_features.npy", mode='w+', dtype=dtype,
+                                         shape=(generator.samples, *conv_base.output_shape[1:]))
+
+    i = 0
+    for batch_number in range(len(generator)):
+        print(f"Embedding batch #{batch_number+1}/{len(generator)}...", end='\r')
+        images, _ = generator[batch_number]
+        features[i:i+len(images)] = conv_base.predict_on_batch(images)
+        i += len(images)
+
+    features.flush()
+    print(f"Embedded {generator.samples} images to {path}_features.npy")
+
+    np.save(f"{path}_labels.npy",
+            utils.to_categorical(generator.classes, generator.num_classes))
+
+
+def load_embeddings(path):
+    """
+    :param path (str): path prefix the cache was written with
+    :return features, labels (np.array, np.array): memory mapped features and one-hot labels
+    """
+    features = np.load(f"{path}_features.npy", mmap_mode='r')
+    labels = np.load(f"{path}_labels.npy")
+
+    return features, labels
+
+
+def get_cache_key(conv_base, split_dir):
+    """
+    :param conv_base (models.Model): the frozen backbone
+    :param split_dir (str): image directory of one dataset split
+    :return key (str): short hash of the backbone's shapes and weights and of the names, sizes and modification
+                       times of the split's files, caches of another backbone or dataset are never reused
+    """
+    sha256 = hashlib.sha256()
+    sha256.update(repr((conv_base.input_shape, conv_base.output_shape)).encode())
+    for weights in conv_base.get_weights():
+        sha256.update(np.ascontiguousarray(weights).tobytes())
+
+    for root, _, names in sorted(os.walk(split_dir)):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            sha256.update(f"{os.path.relpath(path, split_dir)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    return sha256.hexdigest()[:16]
+
+
+def get_embeddings(conv_base, split):
+    os.makedirs(EMBEDDINGS_PATH, exist_ok=True)
+    path = f"{EMBEDDINGS_PATH}/{split}_{get_cache_key(conv_base, f'{DATASET_PATH}/{split}')}"
+
+    # the labels are written last, a cache interrupted while embedding is written again
+    if not os.path.exists(f"{path}_labels.npy"):
+        datagen = ImageDataGenerator(rescale=1./255)
+        generator = datagen.flow_from_directory(
+            f"{DATASET_PATH}/{split}",
+            target_size=SETTINGS['TARGET_SHAPE'],
+            batch_size=64,
+            class_mode='categorical',
+            shuffle=False)
+
+        cache_embeddings(conv_base, generator, path)
+
+    return load_embeddings(path)
+
+
+if __name__ == '__main__':
+    mlflow.tensorflow.autolog()
+
+    conv_base = get_conv_base()
+
+    # the backbone only runs the first time, afterwards the cached features are reused
+    X_train, y_train = get_embeddings(conv_base, 'train')
+    X_val, y_val = get_embeddings(conv_base, 'val')
+    X_test, y_test = get_embeddings(conv_base, 'test')
+
+    head = get_head(X_train.shape[1:])
+
+    head.compile(loss='binary_crossentropy',
+                 optimizer=optimizers.Adam(learning_rate=0.0005),
+                 metrics=['acc'])
+
+    history = head.fit(
+        X_train, y_train,
+        batch_size=64,
+        epochs=50,
+        validation_data=(X_val, y_val),
+        shuffle=True)
+
+    head.evaluate(X_test, y_test)
+
+    # put the backbone back in front of the trained head so DrumTranscriber can load it
+    model = assemble_model(conv_base, head)
+    model.save(OUTPUT_MODEL_PATH)
+    print(f"Saved full model to {OUTPUT_MODEL_PATH}")
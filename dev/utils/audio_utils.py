@@ -2,32 +2,40 @@ from PIL import Image
 import librosa
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
-from audiomentations import Compose, TimeMask, Shift, AddGaussianNoise, PitchShift, Gain
 from utils.config import SETTINGS
 
 import matplotlib.pyplot as plt
 
 
-def fix_audio_length(samples: np.array, sr: int, length: int) -> np.array:
+def fix_audio_length(samples: np.array, sr: int, length: float, align: str = 'center') -> np.array:
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
-    :param length (int): target length in seconds
-    :return samples (np.array): samples with padding or trimmings performed
+    :param length (float): target length in seconds
+    :param align (str): 'center' pads or trims both ends symmetrically,
+                        'onset' keeps the start of the samples and pads or trims the end
+    :return samples (np.array): samples with padding or trimmings performed, exactly int(sr*length) long
     """
     desired_length = int(sr*length)
+    if align == 'onset':
+        # keep the attack at the start of the window
+        if len(samples) >= desired_length:
+            return samples[:desired_length]
+
+        return np.concatenate((samples, np.zeros(desired_length - len(samples))))
+
     if len(samples) > desired_length:
         # trim from both ends, symmetrically
         trim_amount = (len(samples) - desired_length)//2
-        return samples[trim_amount:len(samples)-trim_amount]
+        return samples[trim_amount:trim_amount+desired_length]
 
     else:
         # add silence from both ends
         add_amount = (desired_length - len(samples))//2
-        return np.concatenate((np.zeros(add_amount), samples, np.zeros(add_amount)))
+        return np.concatenate((np.zeros(add_amount), samples, np.zeros(desired_length - len(samples) - add_amount)))
 
 
-def get_onset_frames(samples: np.array, sr: int = 44100) -> list:
+def get_onset_frames(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR']) -> list:
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
@@ -36,31 +44,37 @@ def get_onset_frames(samples: np.array, sr: int = 44100) -> list:
     onset_backtracks = librosa.onset.onset_detect(y=samples, sr=sr,
                                                   units='samples', backtrack=True)
 
+    if len(onset_backtracks) == 0:
+        return []
+
     # this to include the last frame end as onset_detect backtracking goes to the previous min point
     onset_backtracks = np.append(onset_backtracks, min(
-        onset_backtracks[-1]+sr, len(samples)))
+        onset_backtracks[-1]+int(sr*SETTINGS['WINDOW_LENGTH']), len(samples)))
 
     onset_frames = list(zip(onset_backtracks[:-1], onset_backtracks[1:]))
     return onset_frames
 
 
-def get_onset_samples(samples: np.array, sr: int = 44100, onset_frames: list = None) -> list:
+def get_onset_samples(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR'], onset_frames: list = None,
+                      window_length: float = SETTINGS['WINDOW_LENGTH'], align: str = SETTINGS['WINDOW_ALIGN']) -> list:
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
     :para onset_frames (list): if provided, will use precomputed onset_frames (optional)
+    :param window_length (float): length in seconds of the window cut around each onset
+    :param align (str): how each onset is placed in its window, see fix_audio_length
     :return on_set_samples (list): list of np.arrays containing samples for each onset
     """
     if onset_frames is None:
         onset_frames = get_onset_frames(samples, sr)
 
-    onset_samples = [fix_audio_length(samples[s:e], sr, 1)
+    onset_samples = [fix_audio_length(samples[s:e], sr, window_length, align)
                      for s, e in onset_frames]
 
     return onset_samples
 
 
-def get_onset_times(samples: np.array, sr: int = 44100) -> np.array:
+def get_onset_times(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR']) -> np.array:
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
@@ -72,18 +86,25 @@ def get_onset_times(samples: np.array, sr: int = 44100) -> np.array:
     return onset_times
 
 
-def get_mel_spectrogram(samples: np.array, sr: int = 44100, target_shape=SETTINGS['TARGET_SHAPE']) -> np.array:
+def get_mel_spectrogram(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR'], target_shape=SETTINGS['TARGET_SHAPE'],
+                        hop_length: int = SETTINGS['MEL_HOP_LENGTH']) -> np.array:
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
+    :param target_shape (tuple): (n_mels, n_frames) of the returned spectrogram
+    :param hop_length (int): hop in samples, None to stretch the samples over target_shape
     :return mel_spectrogram (np.array): np.array containing melspectrogram features in decibels
     """
-    hop_length = len(samples)//target_shape[0]
+    if hop_length is None:
+        hop_length = len(samples)//target_shape[0]
 
     mel_features = librosa.feature.melspectrogram(
         y=samples, sr=sr, hop_length=hop_length, n_mels=target_shape[0])
 
+    # a fixed hop on a short window can give fewer frames than the target, pad them as silence
     mel_features = mel_features[:, :target_shape[1]]
+    if mel_features.shape[1] < target_shape[1]:
+        mel_features = np.pad(mel_features, ((0, 0), (0, target_shape[1] - mel_features.shape[1])))
 
     mel_in_db = librosa.power_to_db(mel_features, ref=np.max)
     scaler = MinMaxScaler(feature_range=(0, 1))
@@ -91,42 +112,176 @@ def get_mel_spectrogram(samples: np.array, sr: int = 44100, target_shape=SETTING
     return scaler.fit_transform(mel_in_db)
 
 
+def get_pooled_features(windows: np.array, sr: int = SETTINGS['ANALYSIS_SR'], n_mels: int = 64,
+                        hop_length: int = 1024) -> np.array:
+    """
+    Cheap fixed-size features for the cascade's first stage, computed for all windows at once.
+
+    :param windows (np.array): 2D array of equally long onset windows
+    :param sr (int): sample rate used for the samples
+    :param n_mels (int): number of mel bands
+    :param hop_length (int): hop in samples
+    :return features (np.array): (n_windows, 3*n_mels) mean, standard deviation and max over time of every band
+                                 of the log-mel spectrogram, relative to the loudest bin so gain does not matter
+    """
+    windows = np.asarray(windows, dtype=np.float32)
+    if len(windows) == 0:
+        return np.zeros((0, 3*n_mels), dtype=np.float32)
+
+    mel_features = librosa.feature.melspectrogram(y=windows, sr=sr, hop_length=hop_length, n_mels=n_mels)
+    mel_in_db = librosa.power_to_db(mel_features, ref=1.0, top_db=None)
+    mel_in_db = np.maximum(mel_in_db - mel_in_db.max(axis=(1, 2), keepdims=True), -80)
+
+    return np.concatenate([mel_in_db.mean(axis=2), mel_in_db.std(axis=2), mel_in_db.max(axis=2)],
+                          axis=1).astype(np.float32)
+
+
+class Augmenter():
+    """
+    Waveform augmenter that is built once and applied to batches of onset windows.
+
+    Time shift, gain, time mask and gaussian noise are vectorized over the whole batch,
+    pitch shift is the only transform that runs per window. The transforms are applied
+    in the same order as the original audiomentations pipeline:
+    time shift -> gain -> pitch shift -> time mask -> gaussian noise
+    """
+
+    def __init__(self, sr: int = SETTINGS['ANALYSIS_SR'], seed: int = None,
+                 shift_p: float = 0.5, gain_p: float = 0.5, pitch_p: float = 0.25,
+                 mask_p: float = 0.5, noise_p: float = 0.5):
+        """
+        :param sr (int): sample rate used for the samples
+        :param seed (int): seed for the random generator, None for a non-deterministic augmenter
+        :param *_p (float): probability of applying each transform to a window
+        """
+        self.sr = sr
+        self.rng = np.random.default_rng(seed)
+
+        self.shift_p = shift_p
+        self.gain_p = gain_p
+        self.pitch_p = pitch_p
+        self.mask_p = mask_p
+        self.noise_p = noise_p
+
+        # fades used by the shift and mask transforms, matching audiomentations
+        self.shift_fade_length = int(sr*0.005)
+        self.mask_fade_length = int(sr*0.01)
+
+    def __call__(self, samples: np.array) -> np.array:
+        """
+        :param samples (np.array): samples array of the audio
+        :return augmented (np.array): np.array containing samples of augmented audio
+        """
+        return self.augment_batch(samples[np.newaxis, :])[0]
+
+    def augment_batch(self, X: np.array, batch_size: int = SETTINGS['AUGMENTATION_BATCH_SIZE']) -> np.array:
+        """
+        :param X (np.array): 2D array of windows with shape (n_windows, n_samples)
+        :param batch_size (int): number of windows augmented together, bounds the temporary memory used
+        :return augmented (np.array): float32 np.array with the same shape as X
+        """
+        X = np.asarray(X)
+        augmented = np.empty(X.shape, dtype=np.float32)
+
+        for i in range(0, len(X), batch_size):
+            batch = X[i:i+batch_size].astype(np.float32)
+
+            batch = self.time_shift(batch)
+            batch = self.gain(batch)
+            batch = self.pitch_shift(batch)
+            batch = self.time_mask(batch)
+            batch = self.gaussian_noise(batch)
+
+            augmented[i:i+batch_size] = batch
+
+        return augmented
+
+    def _choose(self, n: int, p: float) -> np.array:
+        return self.rng.random(n) < p
+
+    def time_shift(self, X: np.array) -> np.array:
+        n_windows, n_samples = X.shape
+        apply = self._choose(n_windows, self.shift_p)
+
+        shifts = self.rng.uniform(SETTINGS["SHIFT_MIN"], SETTINGS["SHIFT_MAX"], n_windows)
+        shifts = np.where(apply, (shifts*n_samples).astype(np.int64), 0)
+
+        # source index for every output sample, out of range means silence (no rollover)
+        source = np.arange(n_samples)[np.newaxis, :] - shifts[:, np.newaxis]
+        valid = (source >= 0) & (source < n_samples)
+
+        shifted = np.take_along_axis(X, np.clip(source, 0, n_samples-1), axis=1)
+        shifted[~valid] = 0
+
+        # fade in/out next to the inserted silence
+        fade = max(self.shift_fade_length, 1)
+        fade_in = np.clip(source/fade, 0, 1)
+        fade_out = np.clip((n_samples-1-source)/fade, 0, 1)
+        ramp = np.where((shifts > 0)[:, np.newaxis], fade_in, 1.0) * \
+            np.where((shifts < 0)[:, np.newaxis], fade_out, 1.0)
+
+        return (shifted*ramp).astype(np.float32)
+
+    def gain(self, X: np.array) -> np.array:
+        apply = self._choose(len(X), self.gain_p)
+
+        gain_db = self.rng.uniform(SETTINGS["GAIN_MIN_DB"], SETTINGS["GAIN_MAX_DB"], len(X))
+        amplitude = np.where(apply, 10**(gain_db/20), 1.0).astype(np.float32)
+
+        return X*amplitude[:, np.newaxis]
+
+    def pitch_shift(self, X: np.array) -> np.array:
+        apply = np.where(self._choose(len(X), self.pitch_p))[0]
+
+        semitones = self.rng.uniform(SETTINGS["PITCH_MIN"], SETTINGS["PITCH_MAX"], len(apply))
+
+        for i, n_steps in zip(apply, semitones):
+            X[i] = librosa.effects.pitch_shift(X[i], sr=self.sr, n_steps=n_steps)
+
+        return X
+
+    def time_mask(self, X: np.array) -> np.array:
+        n_windows, n_samples = X.shape
+        apply = self._choose(n_windows, self.mask_p)
+
+        mask_lengths = self.rng.integers(int(SETTINGS["MASK_MIN_BAND"]*n_samples),
+                                         int(SETTINGS["MASK_MAX_BAND"]*n_samples) + 1,
+                                         n_windows)
+        mask_starts = self.rng.integers(0, n_samples - mask_lengths + 1)
+
+        position = np.arange(n_samples)[np.newaxis, :] - mask_starts[:, np.newaxis]
+        inside = (position >= 0) & (position < mask_lengths[:, np.newaxis]) & apply[:, np.newaxis]
+
+        # linear fade out at the start of the mask and fade in at its end
+        fade = np.maximum(np.minimum(self.mask_fade_length, mask_lengths//10), 1)[:, np.newaxis]
+        fade_out = np.clip(1 - position/fade, 0, 1)
+        fade_in = np.clip(1 - (mask_lengths[:, np.newaxis]-1-position)/fade, 0, 1)
+
+        mask = np.where(inside, np.maximum(fade_out, fade_in), 1.0)
+
+        return (X*mask).astype(np.float32)
+
+    def gaussian_noise(self, X: np.array) -> np.array:
+        apply = self._choose(len(X), self.noise_p)
+
+        amplitude = self.rng.uniform(SETTINGS["GAUSSIAN_MIN_AMP"], SETTINGS["GAUSSIAN_MAX_AMP"], len(X))
+        amplitude = np.where(apply, amplitude, 0).astype(np.float32)
+
+        noise = self.rng.standard_normal(X.shape, dtype=np.float32)
+
+        return X + noise*amplitude[:, np.newaxis]
+
+
+_default_augmenter = None
+
+
 def apply_augmentation(samples):
     """
     :param samples (np.array): samples array of the audio
     :return augmented (np.array): np.array containing samples of augmented audio
     """
-    gaussian_noise = AddGaussianNoise(
-        min_amplitude=SETTINGS["GAUSSIAN_MIN_AMP"],
-        max_amplitude=SETTINGS["GAUSSIAN_MAX_AMP"],
-        p=0.5
-    )
-
-    time_mask = TimeMask(
-        min_band_part=SETTINGS["MASK_MIN_BAND"],
-        max_band_part=SETTINGS["MASK_MAX_BAND"],
-        fade=True,
-        p=0.5
-    )
-
-    time_shift = Shift(
-        min_fraction=SETTINGS["SHIFT_MIN"],
-        max_fraction=SETTINGS["SHIFT_MAX"],
-        rollover=False,
-        fade=True,
-        p=0.5
-    )
-
-    pitch_shift = PitchShift(
-        min_semitones=SETTINGS["PITCH_MIN"],
-        max_semitones=SETTINGS["PITCH_MAX"],
-        p=0.25
-    )
-
-    gain = Gain(p=0.5)
-
-    augmenter = Compose(
-        [time_shift, gain, pitch_shift, time_mask, gaussian_noise])
-
-    return augmenter(samples=samples,
-                     sample_rate=44100)
+    global _default_augmenter
+    if _default_augmenter is None:
+        _default_augmenter = Augmenter(sr=SETTINGS['ANALYSIS_SR'], seed=SETTINGS["AUGMENTATION_SEED"])
+
+    return _default_augmenter(samples)
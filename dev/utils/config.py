@@ -9,6 +9,8 @@ SETTINGS = {
     },
     "VAL_TEST_RATIO": 0.2,
     "TEST_RATIO": 0.25,
+    # the split is saved to preprocessing.SPLIT_PATH the first time, every training script reuses it
+    "SPLIT_SEED": 0,
     "GAUSSIAN_MIN_AMP": 0.001,
     "GAUSSIAN_MAX_AMP": 0.005,
     "MASK_MIN_BAND": 0.05,
@@ -17,6 +19,24 @@ SETTINGS = {
     "SHIFT_MAX": 0.1,
     "PITCH_MIN": -1,
     "PITCH_MAX": 1,
+    "GAIN_MIN_DB": -12,
+    "GAIN_MAX_DB": 12,
+    "AUGMENTATION_SEED": None,
+    "AUGMENTATION_BATCH_SIZE": 256,
     "TRAINING_SAMPLES_PER_LABEL": 1500,
+    # sample rate audio is decoded and analysed at, onset times are always reported in seconds.
+    # The shipped model was trained at 44100, use benchmarks/compare_analysis_rates.py before lowering it
+    'ANALYSIS_SR': 44100,
     'TARGET_SHAPE': (256, 256),
+    # length in seconds of the window classified for every hit and how the onset is placed in it,
+    # 'center' matches the shipped model, 'onset' keeps the attack when using short windows.
+    # MEL_HOP_LENGTH None stretches the window over TARGET_SHAPE, with a fixed hop
+    # TARGET_SHAPE[1] should be about 1 + WINDOW_LENGTH*sr/MEL_HOP_LENGTH frames,
+    # e.g. WINDOW_LENGTH 0.2, WINDOW_ALIGN 'onset', MEL_HOP_LENGTH 128 and TARGET_SHAPE (128, 75)
+    'WINDOW_LENGTH': 1,
+    'WINDOW_ALIGN': 'center',
+    'MEL_HOP_LENGTH': None,
+    # classifier head on top of the backbone: 'flatten' is the shipped model's Flatten + Dense(2048) head,
+    # 'gap' a GlobalAveragePooling head with a small MLP, about 100x fewer weights
+    'HEAD_TYPE': 'flatten',
 }
@@ -0,0 +1,179 @@
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import librosa
+
+from utils.config import SETTINGS
+from utils.audio_utils import match_onsets
+from utils.instrumentation import Instrumentation
+from utils.export import save_predictions
+
+
+class EnsembleTranscriber:
+    """
+    Runs DrumTranscriber and OmnizartWrapper on the same audio in two worker threads and fuses their hits.
+
+    Hits of both engines closer than SETTINGS['ENSEMBLE_TOLERANCE'] are matched with a single sorted merge
+    and their label scores are averaged with SETTINGS['ENSEMBLE_WEIGHTS']. Hits found by only one engine are
+    kept with that engine's weighted score, so they rank below hits both engines agree on.
+    """
+
+    def __init__(self, drum_transcriber=None, omnizart=None, tolerance=SETTINGS['ENSEMBLE_TOLERANCE'],
+                 weights=SETTINGS['ENSEMBLE_WEIGHTS']):
+        """
+        :param drum_transcriber (DrumTranscriber): loaded CNN transcriber, a new one is loaded if not provided
+        :param omnizart (OmnizartWrapper): loaded Omnizart wrapper, a new one is loaded if not provided
+        :param tolerance (float): maximum distance in seconds between hits of both engines to count as one hit
+        :param weights (dict): weight of each engine's scores, keyed 'drum_transcriber' and 'omnizart',
+                               not negative and not both 0
+        """
+        if set(weights) != {'drum_transcriber', 'omnizart'}:
+            raise ValueError(f"weights must be keyed 'drum_transcriber' and 'omnizart', got {sorted(weights)}")
+        if any(not weight >= 0 for weight in weights.values()) or sum(weights.values()) <= 0:
+            raise ValueError(f"weights must not be negative and must have a positive sum, got {weights}")
+
+        if drum_transcriber is None:
+            from DrumTranscriber import DrumTranscriber
+            drum_transcriber = DrumTranscriber()
+
+        if omnizart is None:
+            from omnizart_wrapper import OmnizartWrapper
+            omnizart = OmnizartWrapper()
+
+        self.engines = {'drum_transcriber': drum_transcriber, 'omnizart': omnizart}
+        self.tolerance = tolerance
+        self.weights = weights
+        self.labels = list(SETTINGS['LABELS_INDEX'].values())
+
+    def _run_engine(self, name, samples, sr):
+        instrumentation = Instrumentation()
+
+        start = time.perf_counter()
+        try:
+            df = self.engines[name].predict(samples, sr, instrumentation=instrumentation)
+            error = None
+        except Exception as e:
+            print(f"Error running {name}: {e}")
+            df, error = None, str(e)
+
+        return df, {'seconds': time.perf_counter() - start, 'error': error,
+                    'stages': instrumentation.report()['stages']}
+
+    def _scores(self, name, df):
+        """
+        :return times, scores (np.array, np.array): sorted hit times and an (n_hits, n_labels) score matrix
+        """
+        if df is None or len(df) == 0:
+            return np.zeros(0), np.zeros((0, len(self.labels)))
+
+        df = df.sort_values('time', kind='stable')
+
+        if name == 'drum_transcriber':
+            return df['time'].to_numpy(), df[self.labels].to_numpy()
+
+        # omnizart only gives its top label, use its confidence as that label's score
+        label_indices = df['prediction'].map({label: i for i, label in enumerate(self.labels)})
+        known = label_indices.notna().to_numpy()
+
+        scores = np.zeros((known.sum(), len(self.labels)))
+        scores[np.arange(known.sum()), label_indices[known].astype(int).to_numpy()] = \
+            df['confidence'].to_numpy()[known]
+
+        return df['time'].to_numpy()[known], scores
+
+    def fuse(self, cnn_df, omnizart_df, weights=None) -> pd.DataFrame:
+        """
+        :param cnn_df (pd.DataFrame): DrumTranscriber.predict output
+        :param omnizart_df (pd.DataFrame): OmnizartWrapper.predict output
+        :param weights (dict): engine weights, self.weights if not provided
+        :return predictions (pd.DataFrame): fused label scores, time, prediction, confidence and the engines
+                                            that found each hit, sorted by time
+        """
+        cnn_times, cnn_scores = self._scores('drum_transcriber', cnn_df)
+        omni_times, omni_scores = self._scores('omnizart', omnizart_df)
+
+        weights = self.weights if weights is None else weights
+        w_cnn = weights['drum_transcriber']
+        w_omni = weights['omnizart']
+        total = w_cnn + w_omni
+
+        cnn_idx, omni_idx = match_onsets(cnn_times, omni_times, self.tolerance)
+        cnn_only = np.setdiff1d(np.arange(len(cnn_times)), cnn_idx)
+        omni_only = np.setdiff1d(np.arange(len(omni_times)), omni_idx)
+
+        # matched hits keep the CNN onset time, which the player and csv are based on
+        times = np.concatenate([cnn_times[cnn_idx], cnn_times[cnn_only], omni_times[omni_only]])
+        scores = np.concatenate([
+            (w_cnn*cnn_scores[cnn_idx] + w_omni*omni_scores[omni_idx])/total,
+            w_cnn*cnn_scores[cnn_only]/total,
+            w_omni*omni_scores[omni_only]/total,
+        ])
+        engines = np.concatenate([
+            np.full(len(cnn_idx), 'both'),
+            np.full(len(cnn_only), 'drum_transcriber'),
+            np.full(len(omni_only), 'omnizart'),
+        ]).astype(object)
+
+        df = pd.DataFrame(scores, columns=self.labels)
+        df['time'] = times
+        df['prediction'] = np.array(self.labels, dtype=object)[np.argmax(scores, axis=1)] if len(df) else []
+        df['confidence'] = scores.max(axis=1) if len(df) else []
+        df['engines'] = engines
+
+        return df.sort_values('time', kind='stable', ignore_index=True)
+
+    def predict(self, samples: np.array, sr: int) -> pd.DataFrame:
+        """
+        :param samples (np.array): samples array of the audio
+        :param sr (int): sample rate used for the samples
+        :return predictions (pd.DataFrame): fused predictions, see fuse, with the per-engine timing breakdown
+                                            in predictions.attrs['timings']
+        """
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=len(self.engines)) as executor:
+            futures = {name: executor.submit(self._run_engine, name, samples, sr) for name in self.engines}
+            results = {name: future.result() for name, future in futures.items()}
+
+        if all(df is None for df, _ in results.values()):
+            raise RuntimeError(f"All engines failed: {[timing['error'] for _, timing in results.values()]}")
+
+        # an engine that failed does not count, the other one's scores are kept as they are,
+        # even when it was given no weight
+        weights = {name: weight if results[name][0] is not None else 0 for name, weight in self.weights.items()}
+        if sum(weights.values()) == 0:
+            weights = {name: float(results[name][0] is not None) for name in weights}
+
+        fuse_start = time.perf_counter()
+        df = self.fuse(results['drum_transcriber'][0], results['omnizart'][0], weights)
+
+        df.attrs['timings'] = {
+            **{name: timing for name, (_, timing) in results.items()},
+            'fusion_seconds': time.perf_counter() - fuse_start,
+            'total_seconds': time.perf_counter() - start,
+        }
+
+        return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe an audio file with DrumTranscriber and Omnizart combined.")
+    parser.add_argument('audio_path')
+    parser.add_argument('--start', type=float, default=0, help='offset in seconds')
+    parser.add_argument('--duration', type=float, default=None, help='seconds to transcribe')
+    parser.add_argument('--output', default='predictions.csv', help='.csv, .mid or .hits (hit records)')
+    args = parser.parse_args()
+
+    samples, sr = librosa.load(args.audio_path, sr=SETTINGS['ANALYSIS_SR'], offset=args.start, duration=args.duration)
+
+    ensemble = EnsembleTranscriber()
+    preds = ensemble.predict(samples, sr)
+    save_predictions(preds, args.output)
+
+    timings = preds.attrs['timings']
+    print(f"{len(preds)} hits ({(preds['engines'] == 'both').sum()} found by both engines) written to {args.output}")
+    print(f"drum_transcriber {timings['drum_transcriber']['seconds']:.2f}s | omnizart {timings['omnizart']['seconds']:.2f}s | "
+          f"fusion {timings['fusion_seconds']:.3f}s | total {timings['total_seconds']:.2f}s")
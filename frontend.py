@@ -1,56 +1,99 @@
-import time
+import tempfile
+
 from pytube import YouTube
 from streamlit_player import st_player
 
 from DrumTranscriber import DrumTranscriber
 from utils.config import SETTINGS
+from utils.peaks import build_peaks, get_peaks
 
-import os
 import streamlit as st
-import pandas as pd
 import numpy as np
-import plotly.express as px
-import matplotlib.pyplot as plt
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 
 import librosa
-import librosa.display
 
 
-@st.experimental_memo
-def get_predictions(input, start_from=0):
-    yt = YouTube(input)
+LANE_ORDER = ['crash', 'ride', 'hihat_c', 'tom_h', 'snare', 'kick_drum']
 
-    video = yt.streams.filter(only_audio=True).first()
 
-    out_file = video.download(output_path=".")
+@st.cache_resource
+def initialise_transcriber():
+    transcriber = DrumTranscriber()
 
-    base, ext = os.path.splitext(out_file)
-    new_file = base + '.wav'
-    os.rename(out_file, new_file)
+    return transcriber
 
-    samples, sr = librosa.load(
-        new_file, sr=44100, duration=30, offset=start_from)
-    st.audio(samples, sample_rate=sr)
 
-    os.remove(new_file)
+@st.cache_data(ttl=SETTINGS['FRONTEND_CACHE_TTL'], max_entries=SETTINGS['FRONTEND_CACHE_ENTRIES'],
+               show_spinner="Transcribing...")
+def get_predictions(url, start_from=0):
+    """
+    Cached per (url, start_from). Everything a rerun needs is computed here once: the predictions
+    with their top label and confidence, the samples for playback and the waveform peaks.
+    """
+    # every call downloads into its own temporary directory, so sessions never share or leave files
+    with tempfile.TemporaryDirectory(prefix='drum_transcriber_') as temp_dir:
+        video = YouTube(url).streams.filter(only_audio=True).first()
+        out_file = video.download(output_path=temp_dir)
 
-    preds = transcriber.predict(samples, sr)
+        samples, sr = librosa.load(
+            out_file, sr=SETTINGS['ANALYSIS_SR'], duration=30, offset=start_from)
 
-    return preds, samples, sr
+    preds = initialise_transcriber().predict(samples, sr)
 
+    labels = list(SETTINGS['LABELS_INDEX'].values())
+    scores = preds[labels].to_numpy()
+    top_indices = np.argmax(scores, axis=1)
 
-@st.experimental_singleton
-def initialise_transcriber():
-    transcriber = DrumTranscriber()
+    preds['prediction'] = np.array(labels, dtype=object)[top_indices]
+    preds['confidence'] = scores[np.arange(len(scores)), top_indices]
+    preds['time'] = preds['time'].round(2)
 
-    return transcriber
+    return preds, samples, sr, build_peaks(samples, sr)
+
+
+@st.cache_data(ttl=SETTINGS['FRONTEND_CACHE_TTL'], max_entries=SETTINGS['FRONTEND_CACHE_ENTRIES'])
+def get_csv(url, start_from=0):
+    preds = get_predictions(url, start_from)[0]
+    return preds.to_csv(index=False).encode('utf-8')
+
+
+def get_lane_plot(preds, peaks, start_from, min_confidence, lanes):
+    """
+    Waveform from the peaks pyramid above one lane per label, built from whole columns at once.
+    """
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.25, 0.75], vertical_spacing=0.02)
 
+    peak_times, peak_mins, peak_maxs = get_peaks(peaks, max_points=1500)
+    peak_times = peak_times + start_from
+    fig.add_trace(go.Scatter(x=peak_times, y=peak_maxs, mode='lines', line=dict(width=0),
+                             hoverinfo='skip', showlegend=False), row=1, col=1)
+    fig.add_trace(go.Scatter(x=peak_times, y=peak_mins, mode='lines', line=dict(width=0), fill='tonexty',
+                             fillcolor='rgba(90, 106, 154, 0.8)', hoverinfo='skip', showlegend=False),
+                  row=1, col=1)
 
-def convert_df(df):
-    return df.to_csv(index=False).encode('utf-8')
+    shown = preds[(preds['confidence'] >= min_confidence) & preds['prediction'].isin(lanes)]
+    confidences = shown['confidence'].to_numpy()
+    fig.add_trace(go.Scatter(
+        x=shown['time'].to_numpy() + start_from,
+        y=shown['prediction'].to_numpy(),
+        mode='markers',
+        marker=dict(symbol='line-ns-open', size=8 + 14*confidences, line=dict(width=2),
+                    color=confidences, colorscale='Viridis', cmin=0, cmax=1),
+        customdata=confidences*100,
+        hovertemplate='%{y} at %{x:.2f}s (%{customdata:.1f}%)<extra></extra>',
+        showlegend=False,
+    ), row=2, col=1)
 
+    fig.update_yaxes(visible=False, range=[-1, 1], row=1, col=1)
+    fig.update_yaxes(categoryorder='array', categoryarray=[lane for lane in LANE_ORDER[::-1] if lane in lanes],
+                     row=2, col=1)
+    fig.update_xaxes(title_text='time (s)', row=2, col=1)
+    fig.update_layout(height=450, margin=dict(l=10, r=10, t=10, b=10))
+
+    return fig
 
-transcriber = initialise_transcriber()
 
 st.title('Drum Transcriber Demo')
 
@@ -61,54 +104,25 @@ start_from = st.number_input(label='Start from (in seconds)', min_value=0)
 if input:
     st_player(input)
 
-preds = None
-
 if input and start_from is not None:
     st.title('Predictions')
-    preds, samples, sr = get_predictions(input, start_from)
-
-    labelled_preds = [SETTINGS['LABELS_INDEX'][i] for i in
-                      np.argmax(
-                          preds[SETTINGS['LABELS_INDEX'].values()].to_numpy(), axis=1)
-                      ]
-
-    preds['prediction'] = labelled_preds
-    preds['confidence'] = preds.apply(
-        lambda x: f"{x[x['prediction']]*100:.1f}%", axis=1)
-    preds['time'] = preds['time'].round(2)
-
-    st.write(preds[['time', 'prediction', 'confidence']].T)
-
-    fig, ax = plt.subplots(sharex=True, nrows=7, figsize=(20, 20))
-
-    librosa.display.waveshow(
-        samples, sr=sr, offset=start_from, ax=ax[0])
-
-    ax[0].set_yticklabels([])
-    ax[0].set_xlabel(None)
-
-    for i in range(1, 7):
-        label_name = SETTINGS['LABELS_INDEX'][i-1]
-
-        hit_times = np.array(
-            preds[preds['prediction'] == label_name]['time'].to_list())
-
-        ax[i].vlines(hit_times+start_from, -1, 1)
-        ax[i].set_ylabel(label_name, rotation=0, fontsize=20)
-        ax[i].set_yticklabels([])
+    preds, samples, sr, peaks = get_predictions(input, start_from)
+    st.audio(samples, sample_rate=sr)
 
-        if i == 6:
-            ax[i].set_xlabel('time')
-            ax[i].set_xlabel('time')
+    # display options only filter the cached predictions
+    min_confidence = st.slider('Minimum confidence', min_value=0.0, max_value=1.0, value=0.0, step=0.05)
+    lanes = st.multiselect('Instruments', LANE_ORDER, default=LANE_ORDER)
 
-    st.pyplot(fig)
+    st.plotly_chart(get_lane_plot(preds, peaks, start_from, min_confidence, lanes), use_container_width=True)
 
     st.download_button(
         "Press to Download",
-        convert_df(preds),
+        get_csv(input, start_from),
         "predictions.csv",
         "text/csv",
         key='download-csv'
     )
 
-    st.write(preds, use_container_width=True)
+    st.dataframe(preds[['time', 'prediction', 'confidence']], use_container_width=True,
+                 column_config={'confidence': st.column_config.ProgressColumn(
+                     'confidence', format='%.2f', min_value=0, max_value=1)})
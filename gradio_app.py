@@ -18,9 +18,19 @@ import numpy as np
 import pandas as pd
 from DrumTranscriber import DrumTranscriber
 from utils.config import SETTINGS
+from utils.instrumentation import Instrumentation
+from utils.export import save_predictions
+from utils.hit_index import build_hit_index
+from utils.peaks import build_peaks, peaks_to_json
+from utils.audio_utils import get_percussive
+from audio_stream import get_ffmpeg_dir, stream_audio, prefetch, transcribe_stream
 
 # Initialize transcriber globally
 transcriber = None
+separator = None
+
+# what the model transcribes: the mix as is, the HPSS percussive part of it or the Demucs drums stem
+SOURCE_MODES = {"mix": "Full mix", "hpss": "Percussive (HPSS)", "demucs": "Drums stem (Demucs)"}
 
 def load_model():
     global transcriber
@@ -40,7 +50,19 @@ def load_model():
 # Try loading initially (optional, but good if model already exists)
 load_model()
 
-def download_audio(url, progress=gr.Progress()):
+def load_separator():
+    # demucs is optional, it is only imported when the Demucs source mode is first used
+    global separator
+    if separator is None:
+        from demucs_processing import DemucsSeparator
+        separator = DemucsSeparator()
+    return separator
+
+def download_audio(url, progress=gr.Progress(), start_time=None, duration=None):
+    """
+    Downloads the audio of url to temp_audio.wav. If start_time is given, only the range from start_time
+    (for duration seconds) is downloaded and the returned file starts at start_time.
+    """
     progress(0, desc="Starting download...")
     
     def progress_hook(d):
@@ -55,15 +77,7 @@ def download_audio(url, progress=gr.Progress()):
 
     
     # Explicitly set ffmpeg location for portable usage
-    base_dir = os.path.dirname(__file__)
-    ffmpeg_dirs = ['ffmpeg', 'bin']
-    ffmpeg_path = None
-    
-    for relative_dir in ffmpeg_dirs:
-        possible_path = os.path.join(base_dir, relative_dir)
-        if os.path.exists(os.path.join(possible_path, 'ffmpeg.exe')):
-            ffmpeg_path = possible_path
-            break
+    ffmpeg_path = get_ffmpeg_dir()
             
     ydl_opts = {
         'format': 'bestaudio/best',
@@ -81,6 +95,12 @@ def download_audio(url, progress=gr.Progress()):
     if ffmpeg_path:
         ydl_opts['ffmpeg_location'] = ffmpeg_path
     
+    if start_time is not None:
+        from yt_dlp.utils import download_range_func
+        end_time = float('inf') if duration is None else start_time + duration
+        ydl_opts['download_ranges'] = download_range_func(None, [(start_time, end_time)])
+        ydl_opts['force_keyframes_at_cuts'] = True
+    
     # Remove existing temp file if it exists
     if os.path.exists('temp_audio.wav'):
         os.remove('temp_audio.wav')
@@ -92,17 +112,40 @@ def download_audio(url, progress=gr.Progress()):
         except Exception as e:
             return None, f"Error downloading video: {e}"
 
-def process_audio(audio_file, start_time, duration=30, progress=gr.Progress()):
+def process_audio(audio_file, start_time, duration=30, progress=gr.Progress(), instrumentation=None,
+                  source_mode=SOURCE_MODES['mix']):
+    """
+    Transcribes duration seconds of audio_file from start_time. The returned samples are always the mix,
+    source_mode only changes what the model is given.
+    """
     if not audio_file:
         return None, None, None, "No audio file provided."
     
+    if instrumentation is None:
+        instrumentation = Instrumentation(progress=lambda fraction, desc=None: progress(fraction, desc=desc),
+                                          profile_dir=SETTINGS['PROFILE_DIR'])
+    
     try:
         progress(0.1, desc="Loading Audio...")
         # Load audio
-        samples, sr = librosa.load(audio_file, sr=44100, offset=start_time, duration=duration)
+        with instrumentation.stage('decode'):
+            samples, sr = librosa.load(audio_file, sr=SETTINGS['ANALYSIS_SR'], offset=start_time, duration=duration)
     except Exception as e:
         return None, None, None, f"Error loading audio: {e}"
 
+    source = samples
+    if source_mode == SOURCE_MODES['hpss']:
+        progress(0.15, desc="Separating percussion (HPSS)...")
+        with instrumentation.stage('hpss'):
+            source = get_percussive(samples)
+    elif source_mode == SOURCE_MODES['demucs']:
+        drums_path = load_separator().separate(audio_file, instrumentation=instrumentation.scaled(0.1, 0.2),
+                                               offset=start_time, duration=duration)
+        if drums_path is None:
+            return None, None, None, "Demucs separation failed. Please check that demucs is installed."
+        with instrumentation.stage('decode_stem'):
+            source, _ = librosa.load(drums_path, sr=sr)
+
     # Ensure model is loaded
     model = load_model()
     if model is None:
@@ -110,19 +153,66 @@ def process_audio(audio_file, start_time, duration=30, progress=gr.Progress()):
 
     # Predict
     try:
-        progress(0.4, desc="Transcribing (this may take a moment)...")
-        preds = model.predict(samples, sr)
+        progress(0.2, desc="Transcribing (this may take a moment)...")
+        preds = model.predict(source, sr, instrumentation=instrumentation.scaled(0.2, 0.8))
     except Exception as e:
         return None, None, None, f"Error during prediction: {e}"
 
     # Process predictions
     progress(0.8, desc="Processing Results...")
+    with instrumentation.stage('postprocess'):
+        label_predictions(preds)
+        preds.attrs['peaks'] = build_peaks(samples, sr)
+    
+    preds.attrs['instrumentation'] = instrumentation.report()
+    
+    return samples, sr, preds, None
+
+def label_predictions(preds):
+    """Adds the top label and its probability as 'prediction' and 'confidence' columns."""
     top_indices = np.argmax(preds[list(SETTINGS['LABELS_INDEX'].values())].to_numpy(), axis=1)
     labelled_preds = [SETTINGS['LABELS_INDEX'][i] for i in top_indices]
     
     preds['prediction'] = labelled_preds
     preds['confidence'] = preds.apply(lambda x: x[x['prediction']], axis=1)
     
+    return preds
+
+def stream_and_process_audio(url, start_time, duration=30, progress=gr.Progress(), instrumentation=None,
+                             source_mode=SOURCE_MODES['mix']):
+    """
+    Streams only the requested range of url and transcribes it chunk by chunk while the rest downloads.
+    Demucs needs the whole range at once, run_pipeline downloads the audio for it instead.
+    """
+    if instrumentation is None:
+        instrumentation = Instrumentation(progress=lambda fraction, desc=None: progress(fraction, desc=desc),
+                                          profile_dir=SETTINGS['PROFILE_DIR'])
+    
+    model = load_model()
+    if model is None:
+        return None, None, None, "Transcriber model not loaded. Please ensure 'model/drum_transcriber.h5' exists."
+    
+    progress(0.05, desc="Connecting to stream...")
+    sr = SETTINGS['ANALYSIS_SR']
+    blocks = prefetch(stream_audio(url, start_time, duration, sr=sr))
+    
+    with instrumentation.stage('stream_and_transcribe') as stage:
+        samples, preds = transcribe_stream(
+            model, blocks, sr, expected_seconds=duration,
+            progress=lambda fraction, desc=None: progress(0.05 + 0.75*fraction, desc=desc),
+            preprocess=get_percussive if source_mode == SOURCE_MODES['hpss'] else None)
+        stage['onsets'] = len(preds)
+    
+    if len(samples) == 0:
+        return None, None, None, "No audio received from the stream."
+    
+    progress(0.8, desc="Processing Results...")
+    with instrumentation.stage('postprocess'):
+        label_predictions(preds)
+        preds.attrs['peaks'] = build_peaks(samples, sr)
+    
+    preds.attrs['instrumentation'] = instrumentation.report()
+    
     return samples, sr, preds, None
 
 def create_interactive_player(preds, samples, sr):
@@ -155,15 +245,12 @@ def create_interactive_player(preds, samples, sr):
     
     duration = len(samples) / sr
     
-    hits_json = []
-    for _, row in preds.iterrows():
-        hits_json.append({
-            'time': float(row['time']),
-            'label': row['prediction'],
-            'confidence': float(row.get('confidence', 0.5))
-        })
+    # hits bucketed by lane and indexed per second, so each frame only touches the visible ones
+    hit_index_str = json.dumps(build_hit_index(preds, label_order, duration))
     
-    hits_str = json.dumps(hits_json)
+    # waveform as a min/max peaks pyramid, computed with the transcription when it went through process_audio
+    peaks = preds.attrs.get('peaks') or build_peaks(samples, sr)
+    peaks_str = json.dumps(peaks_to_json(peaks))
     labels_str = json.dumps(label_order)
     display_str = json.dumps(label_display)
     colors_str = json.dumps(label_colors)
@@ -184,6 +271,7 @@ def create_interactive_player(preds, samples, sr):
   #playBtn:hover {{ background:#ff6666; }}
   #timeDisplay {{ color:#ccc; font-size:14px; font-variant-numeric:tabular-nums; }}
   #volumeSlider {{ width:80px; accent-color:#ff4444; }}
+  #zoomSlider {{ width:120px; accent-color:#44aaff; }}
   #pianoRoll {{ display:block; width:100%; cursor:crosshair; }}
 </style>
 </head>
@@ -192,12 +280,16 @@ def create_interactive_player(preds, samples, sr):
     <button id="playBtn">&#9654;</button>
     <span id="timeDisplay">0:00.0 / {duration:.1f}s</span>
     <input id="volumeSlider" type="range" min="0" max="100" value="80" title="Volume">
+    <input id="zoomSlider" type="range" min="0" max="1000" value="1000" title="Zoom">
   </div>
   <canvas id="pianoRoll"></canvas>
   <audio id="drumAudio" src="data:audio/wav;base64,{audio_b64}"></audio>
 <script>
 (function() {{
-  const hits = {hits_str};
+  const hitIndex = {hit_index_str};
+  const lanes = hitIndex.lanes;
+  const bucketSeconds = hitIndex.bucket_seconds;
+  const peaks = {peaks_str};
   const labelOrder = {labels_str};
   const labelDisplay = {display_str};
   const labelColors = {colors_str};
@@ -209,15 +301,80 @@ def create_interactive_player(preds, samples, sr):
   const playBtn = document.getElementById('playBtn');
   const timeDisp = document.getElementById('timeDisplay');
   const volSlider = document.getElementById('volumeSlider');
+  const zoomSlider = document.getElementById('zoomSlider');
 
   const dpr = window.devicePixelRatio || 1;
   const LANE_H = 40;
-  const TOP_PAD = 10;
+  const WAVE_H = 50;
+  const TOP_PAD = 10 + WAVE_H;
   const BOTTOM_PAD = 25;
   const LEFT_PAD = 60;
   const NUM_LANES = labelOrder.length;
   const CANVAS_H = TOP_PAD + NUM_LANES * LANE_H + BOTTOM_PAD;
 
+  // peak levels decoded once, interleaved min and max per peak
+  const peakLevels = peaks.levels.map((level) => {{
+    const bytes = atob(level);
+    const values = new Int8Array(bytes.length);
+    for (let i = 0; i < bytes.length; i++) values[i] = bytes.charCodeAt(i) << 24 >> 24;
+    return values;
+  }});
+
+  function drawWaveform(viewStart, viewSpan, rollW) {{
+    // finest level with at least one pixel per peak, so a frame costs O(width) at any zoom
+    const samplesPerPixel = viewSpan * peaks.sr / rollW;
+    let levelIdx = 0;
+    while (levelIdx + 1 < peakLevels.length && peaks.samples_per_peak[levelIdx + 1] <= samplesPerPixel) levelIdx++;
+    const level = peakLevels[levelIdx];
+    const nPeaks = level.length / 2;
+    const peaksPerSecond = peaks.sr / peaks.samples_per_peak[levelIdx];
+    const mid = 5 + WAVE_H / 2;
+    const scale = (WAVE_H - 6) / 2 / 127;
+
+    ctx.strokeStyle = '#5a6a9a';
+    ctx.lineWidth = 1;
+    ctx.beginPath();
+    for (let px = 0; px < rollW; px++) {{
+      const i0 = Math.floor((viewStart + (px / rollW) * viewSpan) * peaksPerSecond);
+      const i1 = Math.max(Math.floor((viewStart + ((px + 1) / rollW) * viewSpan) * peaksPerSecond), i0 + 1);
+      if (i0 >= nPeaks) break;
+      let lo = 127, hi = -127;
+      for (let i = Math.max(i0, 0); i < Math.min(i1, nPeaks); i++) {{
+        if (level[2 * i] < lo) lo = level[2 * i];
+        if (level[2 * i + 1] > hi) hi = level[2 * i + 1];
+      }}
+      if (hi < lo) continue;
+      ctx.moveTo(LEFT_PAD + px + 0.5, mid - hi * scale);
+      ctx.lineTo(LEFT_PAD + px + 0.5, mid - lo * scale + 1);
+    }}
+    ctx.stroke();
+  }}
+
+  // visible window, follows the playhead while playing
+  const MIN_SPAN = Math.min(2, duration);
+  const DEFAULT_SPAN = Math.min({SETTINGS['PLAYER_VIEW_SECONDS']}, duration);
+  let viewSpan = DEFAULT_SPAN;
+  let viewStart = 0;
+  zoomSlider.value = duration > MIN_SPAN ? 1000 * (viewSpan - MIN_SPAN) / (duration - MIN_SPAN) : 1000;
+
+  function clampView() {{
+    viewStart = Math.max(0, Math.min(viewStart, duration - viewSpan));
+  }}
+
+  zoomSlider.addEventListener('input', () => {{
+    const center = viewStart + viewSpan / 2;
+    viewSpan = MIN_SPAN + (duration - MIN_SPAN) * zoomSlider.value / 1000;
+    viewStart = center - viewSpan / 2;
+    clampView();
+  }});
+
+  canvas.addEventListener('wheel', (e) => {{
+    e.preventDefault();
+    const delta = Math.abs(e.deltaX) > Math.abs(e.deltaY) ? e.deltaX : e.deltaY;
+    viewStart += (delta / canvas.clientWidth) * viewSpan;
+    clampView();
+  }}, {{ passive: false }});
+
   let lastW = 0;
   function resize() {{
     const w = document.body.clientWidth;
@@ -252,7 +409,7 @@ def create_interactive_player(preds, samples, sr):
     const rect = canvas.getBoundingClientRect();
     const x = e.clientX - rect.left;
     const w = rect.width;
-    const t = ((x - LEFT_PAD) / (w - LEFT_PAD - 10)) * duration;
+    const t = viewStart + ((x - LEFT_PAD) / (w - LEFT_PAD - 10)) * viewSpan;
     if (t >= 0 && t <= duration) {{
       audio.currentTime = t;
     }}
@@ -263,7 +420,16 @@ def create_interactive_player(preds, samples, sr):
     const h = canvas.height / dpr;
     const rollW = w - LEFT_PAD - 10;
 
+    const ct = audio.currentTime;
+    if (!audio.paused && (ct < viewStart || ct > viewStart + viewSpan)) {{
+      viewStart = ct - 0.05 * viewSpan;
+      clampView();
+    }}
+    const viewEnd = viewStart + viewSpan;
+    const toX = (t) => LEFT_PAD + ((t - viewStart) / viewSpan) * rollW;
+
     ctx.clearRect(0, 0, w, h);
+    drawWaveform(viewStart, viewSpan, rollW);
 
     // Draw lanes
     for (let i = 0; i < NUM_LANES; i++) {{
@@ -287,11 +453,11 @@ def create_interactive_player(preds, samples, sr):
 
     // Time markers
     const totalH = NUM_LANES * LANE_H;
-    const step = duration > 20 ? 5 : duration > 10 ? 2 : 1;
+    const step = viewSpan > 120 ? 30 : viewSpan > 60 ? 10 : viewSpan > 20 ? 5 : viewSpan > 10 ? 2 : 1;
     ctx.font = '10px Segoe UI, sans-serif';
     ctx.textAlign = 'center';
-    for (let t = 0; t <= duration; t += step) {{
-      const x = LEFT_PAD + (t / duration) * rollW;
+    for (let t = Math.ceil(viewStart / step) * step; t <= viewEnd; t += step) {{
+      const x = toX(t);
       ctx.strokeStyle = '#333';
       ctx.lineWidth = 0.5;
       ctx.beginPath();
@@ -302,35 +468,46 @@ def create_interactive_player(preds, samples, sr):
       ctx.fillText(t + 's', x, TOP_PAD + totalH + 14);
     }}
 
-    // Draw hits
-    for (const hit of hits) {{
-      const laneIdx = labelOrder.indexOf(hit.label);
-      if (laneIdx < 0) continue;
-      const x = LEFT_PAD + (hit.time / duration) * rollW;
+    // Draw the hits of the visible window only, starting from the offset of its first bucket
+    ctx.save();
+    ctx.beginPath();
+    ctx.rect(LEFT_PAD - 12, 0, rollW + 22, h);
+    ctx.clip();
+    const firstBucket = Math.max(0, Math.floor(viewStart / bucketSeconds));
+    for (let laneIdx = 0; laneIdx < lanes.length; laneIdx++) {{
+      const lane = lanes[laneIdx];
+      const times = lane.times;
+      const color = labelColors[lane.label] || '#fff';
       const y = TOP_PAD + laneIdx * LANE_H + LANE_H / 2;
-      const r = 4 + hit.confidence * 6;
-      const color = labelColors[hit.label] || '#fff';
 
       ctx.shadowColor = color;
-      ctx.shadowBlur = 8;
       ctx.fillStyle = color;
-      ctx.globalAlpha = 0.25 + hit.confidence * 0.5;
-      ctx.fillRect(x - 2, TOP_PAD + laneIdx * LANE_H + 4, 4, LANE_H - 8);
-      ctx.globalAlpha = 1;
-      ctx.beginPath();
-      ctx.arc(x, y, r, 0, Math.PI * 2);
-      ctx.fill();
+      let i = lane.offsets[Math.min(firstBucket, lane.offsets.length - 1)];
+      for (; i < times.length && times[i] <= viewEnd; i++) {{
+        if (times[i] < viewStart) continue;
+        const confidence = lane.confidences[i];
+        const x = toX(times[i]);
+        const r = 4 + confidence * 6;
+
+        ctx.shadowBlur = 8;
+        ctx.globalAlpha = 0.25 + confidence * 0.5;
+        ctx.fillRect(x - 2, TOP_PAD + laneIdx * LANE_H + 4, 4, LANE_H - 8);
+        ctx.globalAlpha = 1;
+        ctx.beginPath();
+        ctx.arc(x, y, r, 0, Math.PI * 2);
+        ctx.fill();
+      }}
       ctx.shadowBlur = 0;
     }}
+    ctx.restore();
 
     // Playhead
-    const ct = audio.currentTime;
-    if (ct > 0 || !audio.paused) {{
-      const px = LEFT_PAD + (ct / duration) * rollW;
+    if ((ct > 0 || !audio.paused) && ct >= viewStart && ct <= viewEnd) {{
+      const px = toX(ct);
       ctx.strokeStyle = '#ff4444';
       ctx.lineWidth = 2;
       ctx.beginPath();
-      ctx.moveTo(px, TOP_PAD);
+      ctx.moveTo(px, 5);
       ctx.lineTo(px, TOP_PAD + totalH);
       ctx.stroke();
       ctx.fillStyle = '#ff4444';
@@ -365,40 +542,65 @@ def create_interactive_player(preds, samples, sr):
 
 
 # Pre-calculate constant for iframe height
-CANVAS_H = 10 + 6 * 40 + 25  # TOP_PAD + NUM_LANES * LANE_H + BOTTOM_PAD
+CANVAS_H = 10 + 50 + 6 * 40 + 25  # TOP_PAD (with WAVE_H) + NUM_LANES * LANE_H + BOTTOM_PAD
 
-def run_pipeline(url, file_upload, start_time, progress=gr.Progress()):
+def run_pipeline(url, file_upload, start_time, source_mode=SOURCE_MODES['mix'], progress=gr.Progress()):
     audio_path = None
     status_msg = ""
     
-    if url:
-        status_msg += "Downloading from YouTube... "
-        audio_path_result = download_audio(url, progress)
-        
-        if isinstance(audio_path_result, tuple): 
-            return None, None, None, audio_path_result[1]
-        
-        audio_path = audio_path_result
-        
-    elif file_upload:
-        audio_path = file_upload
-    else:
-        return None, None, None, "Please provide a YouTube URL or upload an audio file."
-
-    status_msg += "Processing Audio... "
-    samples, sr, preds, error = process_audio(audio_path, start_time, duration=30, progress=progress)
+    instrumentation = Instrumentation(progress=lambda fraction, desc=None: progress(fraction, desc=desc),
+                                      profile_dir=SETTINGS['PROFILE_DIR'])
     
-    if error:
-        return None, None, None, error
+    with instrumentation.profile('request'):
+        if url:
+            result = None
+            # Demucs separates the whole range at once, so it always works on the downloaded file
+            if source_mode != SOURCE_MODES['demucs']:
+                status_msg += "Streaming from YouTube... "
+                try:
+                    result = stream_and_process_audio(url, start_time, duration=30, progress=progress,
+                                                      instrumentation=instrumentation, source_mode=source_mode)
+                except Exception as e:
+                    # fall back to downloading the range to a file first
+                    print(f"Streaming failed ({e}), downloading instead.")
+            
+            if result is None:
+                status_msg += "Downloading from YouTube... "
+                audio_path_result = download_audio(url, progress, start_time=start_time, duration=30)
+                
+                if isinstance(audio_path_result, tuple): 
+                    return None, None, None, audio_path_result[1]
+                
+                # the downloaded file already starts at start_time
+                result = process_audio(audio_path_result, 0, duration=30, progress=progress,
+                                       instrumentation=instrumentation, source_mode=source_mode)
+            
+            samples, sr, preds, error = result
+            
+        elif file_upload:
+            audio_path = file_upload
+            status_msg += "Processing Audio... "
+            samples, sr, preds, error = process_audio(audio_path, start_time, duration=30, progress=progress,
+                                                      instrumentation=instrumentation, source_mode=source_mode)
+        else:
+            return None, None, None, "Please provide a YouTube URL or upload an audio file."
+        
+        if error:
+            return None, None, None, error
 
-    progress(0.9, desc="Generating Piano Roll...")
-    player_html = create_interactive_player(preds, samples, sr)
+        progress(0.9, desc="Generating Piano Roll...")
+        with instrumentation.stage('interactive_player', onsets=len(preds)):
+            player_html = create_interactive_player(preds, samples, sr)
     
-    csv_path = "predictions.csv"
-    preds.to_csv(csv_path, index=False)
+    output_paths = [save_predictions(preds, path) for path in ["predictions.csv", "predictions.hits"]]
+    try:
+        output_paths.insert(1, save_predictions(preds, "predictions.mid"))
+    except ImportError:
+        print("pretty_midi not installed, skipping the MIDI export (pip install pretty_midi).")
     
     progress(1.0, desc="Done!")
-    return player_html, csv_path, None, "Done!"
+    print(f"Request timings: {instrumentation.summary()}")
+    return player_html, output_paths, None, f"Done! ({instrumentation.summary()})"
 
 
 # Gradio UI
@@ -411,9 +613,12 @@ with gr.Blocks(title="Drum Transcriber") as demo:
             url_input = gr.Textbox(label="YouTube URL", placeholder="https://www.youtube.com/watch?v=...")
             file_input = gr.Audio(label="Or Upload Audio File", type="filepath")
             start_time = gr.Number(label="Start Time (seconds)", value=0, precision=1)
+            source_mode = gr.Radio(list(SOURCE_MODES.values()), value=SOURCE_MODES[SETTINGS['SOURCE_MODE']],
+                                   label="Source",
+                                   info="Transcribe the full mix, its percussive part (fast) or the Demucs drums stem (slow)")
             btn = gr.Button("🎵 Transcribe", variant="primary")
             status = gr.Textbox(label="Status", interactive=False)
-            csv_out = gr.File(label="Download Predictions CSV")
+            csv_out = gr.File(label="Download Predictions (CSV, MIDI, hit records)", file_count="multiple")
         
     with gr.Row():
         player_out = gr.HTML(label="Drum Roll Player")
@@ -422,7 +627,7 @@ with gr.Blocks(title="Drum Transcriber") as demo:
     error_out = gr.Textbox(visible=False)
 
     btn.click(fn=run_pipeline, 
-              inputs=[url_input, file_input, start_time], 
+              inputs=[url_input, file_input, start_time, source_mode], 
               outputs=[player_out, csv_out, error_out, status])
 
 if __name__ == "__main__":
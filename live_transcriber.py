@@ -0,0 +1,265 @@
+import sys
+import time
+import queue
+import argparse
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+import librosa
+
+from utils.config import SETTINGS
+from utils.audio_utils import OnsetTracker, fix_audio_length, get_mel_spectrogram
+from utils.export import export_records
+
+
+class LiveTranscriber:
+    """
+    Real-time drum transcription for audio that arrives in blocks, e.g. from a sounddevice callback.
+
+    Onsets are found incrementally with OnsetTracker and every hit is classified as soon as
+    SETTINGS['LIVE_CONTEXT'] seconds of audio after it have arrived. The latency of every hit,
+    from the arrival of the block holding its onset to the emitted event, is measured.
+    """
+
+    def __init__(self, transcriber=None, sr=SETTINGS['ANALYSIS_SR'], context=SETTINGS['LIVE_CONTEXT'],
+                 latency_budget=SETTINGS['LIVE_LATENCY_BUDGET'], on_hit=None):
+        """
+        :param transcriber (DrumTranscriber): loaded transcriber whose model classifies the hits,
+                                              a new one is loaded if not provided
+        :param sr (int): sample rate of the incoming blocks
+        :param context (float): seconds of audio after an onset used to classify it
+        :param latency_budget (float): latency in seconds a hit is expected to stay under
+        :param on_hit (callable): called with every event dict as soon as it is classified (optional)
+        """
+        if transcriber is None:
+            from DrumTranscriber import DrumTranscriber
+            transcriber = DrumTranscriber()
+
+        self.model = transcriber.model
+        self.sr = sr
+        # no point waiting for more audio than fits in the classification window
+        self.context = int(min(context, SETTINGS['WINDOW_LENGTH'])*sr)
+        self.latency_budget = latency_budget
+        self.on_hit = on_hit
+
+        self.tracker = OnsetTracker(sr=sr)
+
+        if self.tracker.latency + context > latency_budget:
+            print(f"Warning: onset look-ahead and context alone need {self.tracker.latency + context:.3f}s, "
+                  f"more than the {latency_budget:.3f}s latency budget.")
+
+        self.reset()
+
+    def reset(self):
+        self.tracker.reset()
+
+        self.history = np.zeros(0, dtype=np.float32)
+        self.history_start = 0  # absolute sample index of history[0]
+        self.total_samples = 0
+
+        # absolute end sample and arrival time of every kept block
+        self.block_ends = []
+        self.block_arrivals = []
+
+        self.pending = []  # (onset, backtracked onset) waiting for enough context
+        self.events = []
+
+    def process_block(self, block: np.array, arrival_time: float = None) -> list:
+        """
+        :param block (np.array): the next mono samples of the stream
+        :param arrival_time (float): time.perf_counter() at which the block was captured, now if not provided
+        :return events (list): hits classified with this block
+        """
+        if arrival_time is None:
+            arrival_time = time.perf_counter()
+
+        block = np.asarray(block, dtype=np.float32)
+
+        self.history = np.concatenate((self.history, block))
+        self.total_samples += len(block)
+        self.block_ends.append(self.total_samples)
+        self.block_arrivals.append(arrival_time)
+
+        onsets, backtracks = self.tracker.process(block, backtrack=True)
+        self.pending.extend(zip(onsets, backtracks))
+
+        ready = [hit for hit in self.pending if hit[0] + self.context <= self.total_samples]
+        events = self._classify(ready) if ready else []
+
+        self._trim_history()
+
+        return events
+
+    def flush(self) -> list:
+        """
+        Classifies the hits still waiting for context, to be called at the end of a stream.
+        """
+        events = self._classify(list(self.pending)) if self.pending else []
+        self._trim_history()
+        return events
+
+    def _classify(self, hits):
+        known_onsets = sorted(b for _, b in self.pending)
+
+        windows = []
+        for onset, start in hits:
+            # same window as get_onset_samples: from the backtracked onset to the next one, at most context long
+            next_index = bisect_right(known_onsets, start)
+            end = min(start + self.context, self.total_samples)
+            if next_index < len(known_onsets):
+                end = min(end, max(known_onsets[next_index], onset + 1))
+
+            segment = self.history[start - self.history_start:end - self.history_start]
+            windows.append(get_mel_spectrogram(
+                fix_audio_length(segment, self.sr, SETTINGS['WINDOW_LENGTH'], SETTINGS['WINDOW_ALIGN']), sr=self.sr))
+
+        mel_specs = np.expand_dims(np.array(windows), axis=-1).repeat(3, axis=-1)
+        predictions = self.model.predict(mel_specs, verbose=0)
+        emitted = time.perf_counter()
+
+        labels = list(SETTINGS['LABELS_INDEX'].values())
+        events = []
+        for (onset, start), probabilities in zip(hits, predictions):
+            arrival = self.block_arrivals[bisect_right(self.block_ends, onset - 1)]
+            top = int(np.argmax(probabilities))
+
+            event = {
+                'time': onset/self.sr,
+                'prediction': labels[top],
+                'confidence': float(probabilities[top]),
+                'latency': emitted - arrival,
+                **dict(zip(labels, probabilities.astype(float))),
+            }
+            events.append(event)
+
+            if self.on_hit is not None:
+                self.on_hit(event)
+
+        self.pending = [hit for hit in self.pending if hit not in hits]
+        self.events.extend(events)
+
+        return events
+
+    def _trim_history(self):
+        # keep what pending hits still need plus one full classification window
+        keep_from = self.total_samples - self.sr - self.context
+        if self.pending:
+            keep_from = min(keep_from, min(b for _, b in self.pending))
+        keep_from = max(keep_from, self.history_start)
+
+        self.history = self.history[keep_from - self.history_start:]
+        self.history_start = keep_from
+
+        drop = bisect_right(self.block_ends, keep_from)
+        self.block_ends = self.block_ends[drop:]
+        self.block_arrivals = self.block_arrivals[drop:]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        :return predictions (pd.DataFrame): every emitted hit, with the same columns as DrumTranscriber.predict
+                                            plus prediction, confidence and latency
+        """
+        columns = list(SETTINGS['LABELS_INDEX'].values()) + ['time', 'prediction', 'confidence', 'latency']
+        return pd.DataFrame(self.events, columns=columns)
+
+    def latency_report(self) -> dict:
+        """
+        :return report (dict): measured latency statistics against the latency budget
+        """
+        latencies = np.array([e['latency'] for e in self.events])
+        if len(latencies) == 0:
+            return {'hits': 0}
+
+        return {
+            'hits': len(latencies),
+            'mean': float(latencies.mean()),
+            'p95': float(np.percentile(latencies, 95)),
+            'max': float(latencies.max()),
+            'budget': self.latency_budget,
+            'over_budget': int((latencies > self.latency_budget).sum()),
+        }
+
+
+def replay_wav(live: LiveTranscriber, audio_path: str, block_size: int = SETTINGS['LIVE_BLOCK_SIZE'],
+               realtime: bool = True):
+    """
+    Feeds an audio file to the live transcriber block by block, standing in for a microphone.
+
+    :param realtime (bool): wait for each block as if it was being recorded, otherwise feed as fast as possible
+    """
+    samples, _ = librosa.load(audio_path, sr=live.sr)
+
+    start = time.perf_counter()
+    for i in range(0, len(samples), block_size):
+        block = samples[i:i+block_size]
+
+        # a block is available once its last sample has been "recorded"
+        arrival = start + (i + len(block))/live.sr
+        if realtime:
+            time.sleep(max(arrival - time.perf_counter(), 0))
+        else:
+            arrival = time.perf_counter()
+
+        live.process_block(block, arrival)
+
+    live.flush()
+
+
+def stream_microphone(live: LiveTranscriber, device=None, block_size: int = SETTINGS['LIVE_BLOCK_SIZE'],
+                      duration: float = None):
+    """
+    Transcribes from an input device until interrupted or `duration` seconds have passed.
+    Blocks are handed from the audio callback to this thread through a queue so the model
+    never runs inside the callback.
+    """
+    import sounddevice as sd
+
+    blocks = queue.Queue()
+
+    def callback(indata, frames, time_info, status):
+        if status:
+            print(status, file=sys.stderr)
+        blocks.put((indata[:, 0].copy(), time.perf_counter()))
+
+    start = time.perf_counter()
+    with sd.InputStream(samplerate=live.sr, blocksize=block_size, device=device,
+                        channels=1, dtype='float32', callback=callback):
+        try:
+            while duration is None or time.perf_counter() - start < duration:
+                block, arrival = blocks.get()
+                live.process_block(block, arrival)
+        except KeyboardInterrupt:
+            pass
+
+    live.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Real-time drum transcription from a microphone or a replayed file.")
+    parser.add_argument('--wav', default=None, help='replay this file instead of recording from the microphone')
+    parser.add_argument('--device', default=None, help='sounddevice input device')
+    parser.add_argument('--block-size', type=int, default=SETTINGS['LIVE_BLOCK_SIZE'])
+    parser.add_argument('--duration', type=float, default=None, help='seconds to record from the microphone')
+    parser.add_argument('--fast', action='store_true', help='replay the file as fast as possible')
+    parser.add_argument('--output', default=None, help='append every hit to this hit records file (.hits)')
+    args = parser.parse_args()
+
+    if args.output:
+        # start from an empty file, hits are appended as they come
+        open(args.output, 'wb').close()
+
+    def print_hit(event):
+        print(f"{event['time']:8.3f}s  {event['prediction']:<10} {event['confidence']*100:5.1f}%  "
+              f"latency {event['latency']*1000:.0f} ms")
+        if args.output:
+            export_records(pd.DataFrame([event]), args.output, append=True)
+
+    live = LiveTranscriber(on_hit=print_hit)
+
+    if args.wav:
+        replay_wav(live, args.wav, args.block_size, realtime=not args.fast)
+    else:
+        stream_microphone(live, args.device, args.block_size, args.duration)
+
+    print(live.latency_report())
@@ -1,12 +1,40 @@
 import pandas as pd
+import numpy as np
 import pretty_midi
 import os
 import soundfile as sf
 import tempfile
+import librosa
 from utils.config import SETTINGS
+from utils.instrumentation import Instrumentation
+
+# the warm path uses Omnizart internals (app._load_model and the omnizart.drum inference functions),
+# written against this release. When they change, app.transcribe is used instead
+OMNIZART_API_VERSION = '0.5.0'
+
+
+def get_api_change_message(error):
+    try:
+        from importlib.metadata import version
+        installed = version('omnizart')
+    except Exception:
+        installed = 'unknown'
+
+    return (f"Omnizart's internal drum API changed ({type(error).__name__}: {error}), this wrapper was written against "
+            f"Omnizart {OMNIZART_API_VERSION} and {installed} is installed. Falling back to app.transcribe, "
+            f"which reloads the model on every call.")
 
 class OmnizartWrapper:
-    def __init__(self):
+    def __init__(self, label_map=None, model_path=None):
+        """
+        Args:
+            label_map (dict): MIDI pitch -> label mapping, SETTINGS['OMNIZART_LABEL_MAP'] if not provided.
+            model_path (str): Omnizart drum checkpoint, Omnizart's default model if not provided.
+        """
+        self.label_map = SETTINGS['OMNIZART_LABEL_MAP'] if label_map is None else label_map
+        self.model = None
+        self.model_settings = None
+
         # Omnizart is imported inside methods to avoid heavy imports if not used
         try:
             from omnizart.drum import app
@@ -15,74 +43,174 @@ class OmnizartWrapper:
         except ImportError:
             print("Omnizart not found. Please install it with `pip install omnizart`.")
             self.app = None
+            return
 
-    def predict(self, samples, sr):
+        # Load the drum model once and keep it resident, app.transcribe reloads it on every call
+        try:
+            self.model, self.model_settings = self.app._load_model(model_path, custom_objects=self.app.custom_objects)
+        except (AttributeError, TypeError) as e:
+            print(get_api_change_message(e))
+        except Exception as e:
+            print(f"Could not preload the Omnizart drum model ({e}), falling back to app.transcribe.")
+
+    @property
+    def label_map(self):
+        return self._label_map
+
+    @label_map.setter
+    def label_map(self, label_map):
+        self._label_map = label_map
+
+        # pitch -> label lookup table used to map all notes at once
+        self._labels = np.array(sorted(set(label_map.values())))
+        self._pitch_to_label = np.full(128, -1)
+        for pitch, label in label_map.items():
+            self._pitch_to_label[pitch] = np.searchsorted(self._labels, label)
+
+    def predict(self, samples, sr, instrumentation=None):
         """
         Predict drum hits from audio samples.
         Args:
             samples (np.ndarray): Audio samples.
             sr (int): Sampling rate.
+            instrumentation (Instrumentation): Optional per-stage timing and progress reporting.
         Returns:
             pd.DataFrame: DataFrame with columns ['time', 'prediction', 'confidence']
         """
         if self.app is None:
             raise ImportError("Omnizart not installed.")
 
-        # Omnizart expects a file path, not raw samples.
-        # We need to save samples to a temporary wav file.
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
-            temp_path = temp_audio.name
-            
+        if instrumentation is None:
+            instrumentation = Instrumentation(enabled=False)
+
+        with instrumentation.profile('omnizart'):
+            df = self._predict(samples, sr, instrumentation)
+
+        if instrumentation.enabled:
+            df.attrs['instrumentation'] = instrumentation.report()
+
+        return df
+
+    def _predict(self, samples, sr, instrumentation):
         try:
-            sf.write(temp_path, samples, sr, subtype='PCM_16')
-            
-            # Omnizart transcription
-            midi_data = self.app.transcribe(temp_path)
-            
+            midi_data = None
+            if self.model is not None:
+                try:
+                    midi_data = self._transcribe_warm(samples, sr, instrumentation)
+                except (ImportError, AttributeError, TypeError) as e:
+                    print(get_api_change_message(e))
+                    self.model = None
+
+            if midi_data is None:
+                midi_data = self._transcribe_file(samples, sr, instrumentation)
         except Exception as e:
             print(f"Error in Omnizart transcription: {e}")
             return pd.DataFrame(columns=['time', 'prediction', 'confidence'])
+
+        instrumentation.report_progress(0.9, "Processing Omnizart notes...")
+        with instrumentation.stage('midi_to_dataframe') as stage:
+            df = self.midi_to_dataframe(midi_data)
+            stage['onsets'] = len(df)
+
+        instrumentation.report_progress(1.0, "Omnizart transcription complete.")
+        return df
+
+    def _write_audio(self, samples, sr, target_sr):
+        """
+        Omnizart's feature extraction (CQT and madmom beat tracking) only reads from a path, so the samples
+        are handed over as a float WAV already at the model's rate, on a RAM backed directory when there is one.
+        """
+        if sr != target_sr:
+            samples = librosa.resample(samples, orig_sr=sr, target_sr=target_sr)
+
+        temp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        with tempfile.NamedTemporaryFile(suffix=".wav", dir=temp_dir, delete=False) as temp_audio:
+            temp_path = temp_audio.name
+
+        sf.write(temp_path, samples, target_sr, subtype='FLOAT')
+        return temp_path
+
+    def _transcribe_warm(self, samples, sr, instrumentation):
+        from omnizart.drum.inference import inference
+        from omnizart.drum.prediction import predict
+        from omnizart.feature.wrapper_func import extract_patch_cqt
+
+        feature_settings = self.model_settings.feature
+        inference_settings = self.model_settings.inference
+
+        instrumentation.report_progress(0.0, "Preparing audio for Omnizart...")
+        with instrumentation.stage('write_temp_wav'):
+            temp_path = self._write_audio(samples, sr, feature_settings.sampling_rate)
+
+        try:
+            instrumentation.report_progress(0.1, "Extracting Omnizart features...")
+            with instrumentation.stage('omnizart_features'):
+                patch_cqt_feature, mini_beat_arr = extract_patch_cqt(
+                    temp_path, sampling_rate=feature_settings.sampling_rate, hop_size=feature_settings.hop_size)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        instrumentation.report_progress(0.5, "Transcribing with Omnizart...")
+        with instrumentation.stage('omnizart_inference'):
+            pred = predict(patch_cqt_feature, self.model, feature_settings.mini_beat_per_segment)
+            midi_data = inference(
+                pred,
+                mini_beat_arr,
+                bass_drum_th=inference_settings.bass_drum_th,
+                snare_th=inference_settings.snare_th,
+                hihat_th=inference_settings.hihat_th,
+            )
+
+        return midi_data
+
+    def _transcribe_file(self, samples, sr, instrumentation):
+        # Omnizart expects a file path, not raw samples.
+        # We need to save samples to a temporary wav file.
+        instrumentation.report_progress(0.0, "Preparing audio for Omnizart...")
+        with instrumentation.stage('write_temp_wav'):
+            temp_path = self._write_audio(samples, sr, sr)
+
+        try:
+            # Omnizart transcription
+            instrumentation.report_progress(0.1, "Transcribing with Omnizart...")
+            with instrumentation.stage('omnizart_transcribe'):
+                midi_data = self.app.transcribe(temp_path)
         finally:
             # Clean up temp file
             if os.path.exists(temp_path):
                 os.remove(temp_path)
 
-        # Process MIDI data
-        # Mapping MIDI pitches to our labels
-        label_map = {
-            35: 'kick_drum', 36: 'kick_drum',
-            38: 'snare', 40: 'snare',
-            37: 'snare', # Side Stick
-            42: 'hihat_c', 44: 'hihat_c', 46: 'hihat_c', # Simplified all HH to closed for now or map appropriately
-            41: 'tom_h', 43: 'tom_h', 45: 'tom_h', 47: 'tom_h', 48: 'tom_h', 50: 'tom_h',
-            49: 'crash', 57: 'crash',
-            51: 'ride', 59: 'ride'
-        }
-
-        predictions = []
-        
-        for instrument in midi_data.instruments:
-            if not instrument.is_drum:
-                continue
-                
-            for note in instrument.notes:
-                pitch = note.pitch
-                time = note.start
-                velocity = note.velocity / 127.0 # precise confidence
-                
-                if pitch in label_map:
-                    label = label_map[pitch]
-                    predictions.append({
-                        'time': time,
-                        'prediction': label,
-                        'confidence': velocity
-                    })
-        
-        df = pd.DataFrame(predictions)
-        if df.empty:
+        return midi_data
+
+    def midi_to_dataframe(self, midi_data):
+        """
+        Maps the drum notes of a transcription to labels.
+        Args:
+            midi_data (pretty_midi.PrettyMIDI): Transcribed MIDI.
+        Returns:
+            pd.DataFrame: DataFrame with columns ['time', 'prediction', 'confidence'], sorted by time
+        """
+        notes = [note for instrument in midi_data.instruments if instrument.is_drum
+                 for note in instrument.notes]
+
+        if not notes:
             return pd.DataFrame(columns=['time', 'prediction', 'confidence'])
-            
-        return df
+
+        pitches = np.fromiter((note.pitch for note in notes), dtype=np.int64, count=len(notes))
+        times = np.fromiter((note.start for note in notes), dtype=np.float64, count=len(notes))
+        velocities = np.fromiter((note.velocity for note in notes), dtype=np.float64, count=len(notes))
+
+        label_indices = self._pitch_to_label[pitches]
+        mapped = label_indices >= 0
+
+        df = pd.DataFrame({
+            'time': times[mapped],
+            'prediction': self._labels[label_indices[mapped]],
+            'confidence': velocities[mapped] / 127.0,  # velocity as confidence
+        })
+
+        return df.sort_values('time', kind='stable', ignore_index=True)
 
 if __name__ == "__main__":
     # Test stub
@@ -0,0 +1,441 @@
+"""
+Headless HTTP transcription service. Jobs are kept in a SQLite queue (utils.job_queue.JobQueue) and run by
+a pool of worker processes, each keeping its models loaded between jobs. Idle workers claim the next job,
+so work goes to whichever worker is free.
+
+    python server.py --port 8000 --workers 2
+
+    # one replica per 2 cores, pinned, sharing the memory-mapped weights of the .tflite model
+    python server.py --workers 4 --threads 2 --model ./model/drum_transcriber.tflite
+
+    # submit an upload, poll it and fetch the result
+    curl -X POST --data-binary @song.mp3 "localhost:8000/jobs?filename=song.mp3&start=30&duration=60"
+    curl localhost:8000/jobs/<id>
+    curl -o predictions.csv localhost:8000/jobs/<id>/result
+
+    # or a file the server can read, with the Demucs drums stem and MIDI output
+    curl -X POST -H "Content-Type: application/json" localhost:8000/jobs \\
+         -d '{"path": "/data/song.wav", "separate": true, "format": "mid"}'
+"""
+
+import os
+import re
+import json
+import math
+import time
+import uuid
+import shutil
+import tempfile
+import argparse
+import threading
+import multiprocessing as mp
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from utils.config import SETTINGS
+from utils.job_queue import JobQueue, DONE, FAILED
+
+ENGINES = ('drum_transcriber', 'omnizart', 'ensemble')
+RESULT_FORMATS = {'csv': 'text/csv', 'mid': 'audio/midi', 'hits': 'application/octet-stream'}
+
+
+def parse_params(values: dict) -> dict:
+    """
+    :param values (dict): request parameters, from the query string or the json body
+    :return params (dict): validated engine, separate, start, duration and format of a job
+    """
+    def flag(value):
+        return value in (True, 1) or str(value).lower() in ('1', 'true', 'yes')
+
+    params = {
+        'engine': values.get('engine', 'drum_transcriber'),
+        'separate': flag(values.get('separate', False)),
+        'start': float(values.get('start', 0)),
+        'duration': float(values['duration']) if values.get('duration') not in (None, '') else None,
+        'format': values.get('format', 'csv'),
+    }
+
+    if params['engine'] not in ENGINES:
+        raise ValueError(f"engine must be one of {', '.join(ENGINES)}")
+    if params['format'] not in RESULT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(RESULT_FORMATS)}")
+    if not math.isfinite(params['start']) or (params['duration'] is not None and not math.isfinite(params['duration'])):
+        raise ValueError("start and duration must be finite numbers")
+    if params['start'] < 0 or (params['duration'] is not None and params['duration'] <= 0):
+        raise ValueError("start must be positive and duration greater than 0")
+
+    return params
+
+
+def get_worker_cores(n_workers: int, threads: int = None) -> list:
+    """
+    :param n_workers (int): number of worker processes
+    :param threads (int): threads per worker, the available cores split evenly if not provided
+    :return cores (list): cores each worker is pinned to, wrapping around when there are more threads than cores
+    """
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    threads = threads or max(len(available)//n_workers, 1)
+
+    return [[available[(index*threads + i) % len(available)] for i in range(threads)] for index in range(n_workers)]
+
+
+def limit_threads(cores: list):
+    """
+    Pins the calling process to cores and sizes the thread pools of numpy, numba and tensorflow to match,
+    so replicas don't compete for the same cores. Must run before those libraries are imported.
+    """
+    threads = str(len(cores))
+    for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMBA_NUM_THREADS',
+                     'TF_NUM_INTRAOP_THREADS']:
+        os.environ[variable] = threads
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+
+    if hasattr(os, 'sched_setaffinity'):  # linux only
+        os.sched_setaffinity(0, cores)
+
+
+class WorkerEngines:
+    """
+    Models of one worker process, loaded on first use and kept for the following jobs.
+    """
+
+    def __init__(self, data_dir: str, model_path: str = SETTINGS['SAVED_MODEL_PATH'], num_threads: int = None):
+        """
+        :param data_dir (str): directory of the server's uploads and results
+        :param model_path (str): model of the DrumTranscriber, see DrumTranscriber
+        :param num_threads (int): threads of a .tflite model
+        """
+        self.data_dir = data_dir
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.loaded = {}
+
+    def get(self, name: str):
+        if name in self.loaded:
+            return self.loaded[name]
+
+        if name == 'drum_transcriber':
+            from DrumTranscriber import DrumTranscriber
+            engine = DrumTranscriber(model_path=self.model_path, num_threads=self.num_threads)
+        elif name == 'omnizart':
+            from omnizart_wrapper import OmnizartWrapper
+            engine = OmnizartWrapper()
+        elif name == 'ensemble':
+            from ensemble import EnsembleTranscriber
+            engine = EnsembleTranscriber(drum_transcriber=self.get('drum_transcriber'), omnizart=self.get('omnizart'))
+        else:
+            raise ValueError(f"Unknown engine {name}")
+
+        self.loaded[name] = engine
+        return engine
+
+
+def run_job(job: dict, engines: WorkerEngines, data_dir: str):
+    """
+    :return result_path, info (str, dict): written predictions and a summary of the job
+    """
+    import librosa
+    from utils.export import save_predictions
+    from utils.instrumentation import Instrumentation
+
+    params = job['params']
+    instrumentation = Instrumentation()
+
+    audio_path, offset, duration = job['audio_path'], params['start'], params['duration']
+    separation_dir = None
+    try:
+        if params['separate']:
+            from demucs_processing import DemucsSeparator
+
+            # the cut input and the stem are named after the audio file, jobs on the same file need their own directory
+            separation_dir = tempfile.mkdtemp(prefix=f"{job['id']}_", dir=os.path.join(data_dir, 'separated'))
+            drums_path = DemucsSeparator(output_dir=separation_dir).separate(
+                audio_path, instrumentation=instrumentation, offset=offset, duration=duration)
+            if drums_path is None:
+                raise RuntimeError("Demucs separation failed.")
+            # the stem already covers the requested range only
+            audio_path, offset, duration = drums_path, 0, None
+
+        with instrumentation.stage('decode'):
+            samples, sr = librosa.load(audio_path, sr=SETTINGS['ANALYSIS_SR'], offset=offset, duration=duration)
+    finally:
+        if separation_dir is not None:
+            shutil.rmtree(separation_dir, ignore_errors=True)
+
+    engine = engines.get(params['engine'])
+    with instrumentation.stage(params['engine'], seconds_of_audio=len(samples)/sr):
+        if params['engine'] == 'ensemble':
+            preds = engine.predict(samples, sr)
+        else:
+            preds = engine.predict(samples, sr, instrumentation=instrumentation)
+
+    result_path = os.path.join(data_dir, 'results', f"{job['id']}.{params['format']}")
+    save_predictions(preds, result_path)
+
+    return result_path, {'hits': len(preds), 'audio_seconds': len(samples)/sr, 'timings': instrumentation.summary()}
+
+
+def run_worker(name: str, db_path: str, data_dir: str, stop, preload=('drum_transcriber',),
+               poll_interval: float = 0.5, model_path: str = SETTINGS['SAVED_MODEL_PATH'], cores: list = None):
+    """
+    Worker process loop: claims jobs until stop is set. Exceptions fail the job, which is retried
+    by another claim until it used SETTINGS['SERVER_MAX_ATTEMPTS'].
+
+    :param cores (list): cores the worker is pinned to, see limit_threads (optional)
+    """
+    if cores is not None:
+        limit_threads(cores)
+
+    queue = JobQueue(db_path)
+    engines = WorkerEngines(data_dir, model_path, num_threads=len(cores) if cores is not None else None)
+
+    for engine in preload:
+        try:
+            engines.get(engine)
+        except Exception as e:
+            print(f"[{name}] Could not preload {engine} ({e}), it will be loaded on first use.")
+
+    print(f"[{name}] Ready.")
+    while not stop.is_set():
+        job = queue.claim(name)
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+
+        start = time.perf_counter()
+        try:
+            result_path, info = run_job(job, engines, data_dir)
+        except Exception as e:
+            retried = queue.fail(job['id'], f"{type(e).__name__}: {e}", worker=name)
+            print(f"[{name}] Job {job['id']} failed ({e}){', retrying' if retried else ''}.")
+            continue
+
+        if queue.complete(job['id'], name, result_path, info):
+            print(f"[{name}] Job {job['id']} done in {time.perf_counter() - start:.2f}s, {info['hits']} hits.")
+        else:
+            # the job timed out and went back to the queue meanwhile, the result of its new attempt counts
+            print(f"[{name}] Job {job['id']} finished after it was handed back to the queue, result dropped.")
+
+
+class TranscriptionService:
+    """
+    Keeps n_workers worker processes running and maintains the queue: jobs of dead or stuck workers
+    are retried and expired jobs are purged.
+    """
+
+    def __init__(self, db_path: str = SETTINGS['SERVER_DB_PATH'], data_dir: str = SETTINGS['SERVER_DATA_DIR'],
+                 n_workers: int = SETTINGS['SERVER_WORKERS'], preload=('drum_transcriber',),
+                 job_timeout: float = SETTINGS['SERVER_JOB_TIMEOUT'], maintenance_interval: float = 5.0,
+                 model_path: str = SETTINGS['SAVED_MODEL_PATH'], threads: int = SETTINGS['SERVER_WORKER_THREADS'],
+                 pin: bool = True):
+        """
+        :param model_path (str): model of the workers' DrumTranscriber, a .tflite file is memory-mapped
+                                 and its weights shared by all the workers
+        :param threads (int): threads per worker, the available cores split evenly if not provided
+        :param pin (bool): pin every worker to its own cores, see get_worker_cores
+        """
+        self.db_path = db_path
+        self.data_dir = data_dir
+        self.n_workers = n_workers
+        self.preload = tuple(preload)
+        self.model_path = model_path
+        self.cores = get_worker_cores(n_workers, threads) if pin else [None]*n_workers
+        self.job_timeout = job_timeout
+        self.maintenance_interval = maintenance_interval
+
+        for directory in ['uploads', 'results', 'separated']:
+            os.makedirs(os.path.join(data_dir, directory), exist_ok=True)
+
+        # creates the database before the workers open it
+        JobQueue(db_path)
+        # sqlite connections can't be shared by concurrent transactions, every request thread opens its own
+        self._local = threading.local()
+
+        # spawn, tensorflow is not fork safe
+        self._context = mp.get_context('spawn')
+        self._stop = self._context.Event()
+        self.workers = {}
+        self._generations = [0]*n_workers
+        self._maintenance = None
+
+    def get_queue(self) -> JobQueue:
+        if not hasattr(self._local, 'queue'):
+            self._local.queue = JobQueue(self.db_path)
+        return self._local.queue
+
+    def _spawn(self, index: int):
+        # a restarted worker gets a new name, so the jobs of its predecessor count as orphaned
+        self._generations[index] += 1
+        name = f"worker-{index}.{self._generations[index]}"
+
+        process = self._context.Process(target=run_worker, name=name, daemon=True,
+                                        args=(name, self.db_path, self.data_dir, self._stop, self.preload),
+                                        kwargs={'model_path': self.model_path, 'cores': self.cores[index]})
+        process.start()
+        self.workers[index] = process
+
+    def start(self):
+        for index in range(self.n_workers):
+            self._spawn(index)
+
+        self._maintenance = threading.Thread(target=self._maintain, daemon=True)
+        self._maintenance.start()
+
+    def _maintain(self):
+        queue = JobQueue(self.db_path)
+        while not self._stop.wait(self.maintenance_interval):
+            for index, process in list(self.workers.items()):
+                if not process.is_alive():
+                    print(f"{process.name} exited with code {process.exitcode}, restarting.")
+                    self._spawn(index)
+
+            stuck = queue.requeue_stale(self.job_timeout, workers=[p.name for p in self.workers.values()])
+            for index, process in list(self.workers.items()):
+                # its job went back to the queue, a hung worker would otherwise never take another one
+                if process.name in stuck and process.is_alive():
+                    print(f"{process.name} timed out on a job, restarting.")
+                    process.terminate()
+                    process.join(5)
+                    if process.is_alive():
+                        process.kill()
+                    self._spawn(index)
+
+            queue.purge_expired()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        for process in self.workers.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def submit_upload(self, body: bytes, params: dict, filename: str = None) -> str:
+        # keep the extension, some decoders rely on it
+        extension = os.path.splitext(filename or '')[1] or '.wav'
+        job_id = uuid.uuid4().hex
+        audio_path = os.path.join(self.data_dir, 'uploads', f"{job_id}{extension}")
+        with open(audio_path, 'wb') as f:
+            f.write(body)
+
+        return self.get_queue().submit(audio_path, {**params, 'uploaded': True}, job_id=job_id)
+
+    def submit_path(self, audio_path: str, params: dict) -> str:
+        if not os.path.isfile(audio_path):
+            raise ValueError(f"{audio_path} is not a readable file")
+        return self.get_queue().submit(os.path.abspath(audio_path), params)
+
+    def health(self) -> dict:
+        return {'workers': sum(p.is_alive() for p in self.workers.values()),
+                'jobs': self.get_queue().counts()}
+
+
+def describe_job(job: dict) -> dict:
+    description = {key: job[key] for key in ['id', 'status', 'attempts', 'error', 'info',
+                                             'created_at', 'started_at', 'finished_at', 'expires_at']}
+    description['params'] = {key: value for key, value in job['params'].items() if key != 'uploaded'}
+    if job['status'] == DONE:
+        description['result_url'] = f"/jobs/{job['id']}/result"
+
+    return description
+
+
+def make_handler(service: TranscriptionService, max_upload_mb: float = SETTINGS['SERVER_MAX_UPLOAD_MB']):
+    job_route = re.compile(r'^/jobs/([0-9a-f]+)(/result)?$')
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/jobs':
+                return self._send_json(404, {'error': 'Not found'})
+
+            length = int(self.headers.get('Content-Length') or 0)
+            if length == 0:
+                return self._send_json(400, {'error': 'Send the audio as the request body or a json body with a path'})
+            if length > max_upload_mb*1024**2:
+                return self._send_json(413, {'error': f"Uploads are limited to {max_upload_mb} MB"})
+
+            body = self.rfile.read(length)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+            try:
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    values = json.loads(body)
+                    if not isinstance(values, dict) or not isinstance(values.get('path'), str):
+                        raise ValueError('The json body must be an object with a "path" string')
+                    job_id = service.submit_path(values.get('path', ''), parse_params(values))
+                else:
+                    job_id = service.submit_upload(body, parse_params(query), filename=query.get('filename'))
+            except (ValueError, TypeError) as e:  # includes json.JSONDecodeError and parameters of the wrong type
+                return self._send_json(400, {'error': str(e)})
+
+            self._send_json(202, describe_job(service.get_queue().get(job_id)), {'Location': f"/jobs/{job_id}"})
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/health':
+                return self._send_json(200, service.health())
+
+            match = job_route.match(path)
+            job = service.get_queue().get(match.group(1)) if match else None
+            if job is None:
+                return self._send_json(404, {'error': 'Unknown or expired job'})
+
+            if not match.group(2):
+                return self._send_json(200, describe_job(job))
+
+            if job['status'] == FAILED:
+                return self._send_json(410, describe_job(job))
+            if job['status'] != DONE or not os.path.exists(job['result_path']):
+                return self._send_json(409, describe_job(job))
+
+            with open(job['result_path'], 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', RESULT_FORMATS[job['params']['format']])
+            self.send_header('Content-Disposition', f"attachment; filename={os.path.basename(job['result_path'])}")
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=SETTINGS['SERVER_WORKERS'])
+    parser.add_argument('--db', default=SETTINGS['SERVER_DB_PATH'], help='SQLite job database')
+    parser.add_argument('--data-dir', default=SETTINGS['SERVER_DATA_DIR'], help='directory for uploads and results')
+    parser.add_argument('--preload', nargs='*', default=['drum_transcriber'], choices=ENGINES,
+                        help='models every worker loads before taking jobs, the others are loaded on first use')
+    parser.add_argument('--model', default=SETTINGS['SAVED_MODEL_PATH'],
+                        help=f"DrumTranscriber model, e.g. {SETTINGS['SHARED_MODEL_PATH']} to share the weights")
+    parser.add_argument('--threads', type=int, default=SETTINGS['SERVER_WORKER_THREADS'],
+                        help='threads per worker, the cores split evenly by default')
+    parser.add_argument('--no-pin', action='store_true', help='let the OS schedule the workers freely')
+    args = parser.parse_args()
+
+    service = TranscriptionService(args.db, args.data_dir, n_workers=args.workers, preload=args.preload,
+                                   model_path=args.model, threads=args.threads, pin=not args.no_pin)
+    service.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
@@ -0,0 +1,7 @@
+import sys
+import os
+
+# make the repository root importable when running the tests from any directory
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
@@ -0,0 +1,149 @@
+import os
+import time
+import shutil
+import functools
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+import pytest
+import soundfile as sf
+
+from utils.config import SETTINGS
+from audio_stream import stream_audio, prefetch, transcribe_stream
+
+SR = 1000
+
+
+class ImpulseTranscriber:
+    """
+    Reports a hit at every sample above 0.5, so the hits of a chunked transcription can be checked exactly.
+    """
+
+    def predict(self, samples, sr):
+        times = np.flatnonzero(samples > 0.5)/sr
+        df = pd.DataFrame(np.zeros((len(times), len(SETTINGS['LABELS_INDEX']))),
+                          columns=list(SETTINGS['LABELS_INDEX'].values()))
+        df['time'] = times
+        return df
+
+
+def split_blocks(samples, sizes):
+    blocks, start = [], 0
+    for size in sizes:
+        blocks.append(samples[start:start+size])
+        start += size
+    blocks.append(samples[start:])
+    return blocks
+
+
+@pytest.mark.parametrize('seconds', [0.5, 3, 25.3])
+def test_transcribe_stream_matches_whole_audio(seconds):
+    rng = np.random.default_rng(0)
+    samples = np.zeros(int(seconds*SR), dtype=np.float32)
+    hits = np.sort(rng.choice(len(samples), size=max(len(samples)//100, 1), replace=False))
+    samples[hits] = 1
+
+    blocks = split_blocks(samples, rng.integers(1, 700, size=len(samples)//300))
+    chunks = []
+    streamed, predictions = transcribe_stream(ImpulseTranscriber(), blocks, SR, chunk_seconds=2, on_chunk=chunks.append)
+
+    np.testing.assert_array_equal(streamed, samples)
+    np.testing.assert_allclose(predictions['time'].to_numpy(), hits/SR)
+    assert sum(len(chunk) for chunk in chunks) == len(hits)
+
+
+def test_transcribe_stream_empty():
+    samples, predictions = transcribe_stream(ImpulseTranscriber(), [], SR)
+
+    assert len(samples) == 0
+    assert len(predictions) == 0
+
+
+def test_prefetch_keeps_order():
+    blocks = [np.full(10, i, dtype=np.float32) for i in range(50)]
+    assert [block[0] for block in prefetch(iter(blocks), max_blocks=4)] == list(range(50))
+
+
+def test_prefetch_reraises():
+    def blocks():
+        yield np.zeros(10)
+        raise RuntimeError("decode failed")
+
+    fetched = prefetch(blocks())
+    next(fetched)
+    with pytest.raises(RuntimeError, match="decode failed"):
+        next(fetched)
+
+
+def test_prefetch_stops_when_the_caller_stops():
+    produced = []
+    closed = threading.Event()
+
+    def blocks():
+        try:
+            while True:
+                produced.append(len(produced))
+                yield np.zeros(10)
+        finally:
+            closed.set()
+
+    fetched = prefetch(blocks(), max_blocks=3)
+    next(fetched)
+    fetched.close()
+
+    assert closed.wait(5)
+    # bounded by the queue, not decoding on forever
+    assert len(produced) <= 6
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    """
+    Serves tmp_path over HTTP, standing in for YouTube or a remote audio file.
+    """
+    handler = functools.partial(type('QuietHandler', (SimpleHTTPRequestHandler,), {'log_message': lambda *args: None}),
+                                directory=str(tmp_path))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+
+@requires_ffmpeg
+def test_stream_audio_decodes_the_requested_range(file_server, tmp_path):
+    pytest.importorskip('yt_dlp')
+
+    sr = 8000
+    t = np.arange(10*sr)/sr
+    # the frequency rises with time, so the decoded range can be told apart from the rest
+    samples = (0.5*np.sin(2*np.pi*(200 + 20*t)*t)).astype(np.float32)
+    sf.write(str(tmp_path / 'clip.wav'), samples, sr, subtype='PCM_16')
+
+    blocks = list(stream_audio(f"{file_server}/clip.wav", start_time=2, duration=3, sr=sr, block_seconds=0.25))
+    decoded = np.concatenate(blocks)
+
+    assert all(len(block) <= int(sr*0.25) for block in blocks)
+    assert abs(len(decoded) - 3*sr) <= sr//100
+    np.testing.assert_allclose(decoded[:sr], samples[2*sr:3*sr], atol=1e-4)
+
+
+@requires_ffmpeg
+def test_stream_audio_reports_decode_errors(file_server, tmp_path):
+    pytest.importorskip('yt_dlp')
+
+    with open(tmp_path / 'broken.wav', 'wb') as f:
+        f.write(os.urandom(64*1024))
+
+    # ffmpeg's error output is read once it exited, it can't fill a pipe and block the decode
+    start = time.time()
+    with pytest.raises(RuntimeError, match="ffmpeg failed"):
+        list(stream_audio(f"{file_server}/broken.wav"))
+    assert time.time() - start < 30
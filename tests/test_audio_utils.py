@@ -0,0 +1,37 @@
+import numpy as np
+
+from utils.audio_utils import suppress_onsets
+
+
+def test_suppress_onsets_disabled():
+    keep = suppress_onsets([0.0, 0.01, 0.02], [1.0, 2.0, 3.0], min_interval=0)
+    assert keep.tolist() == [True, True, True]
+
+
+def test_suppress_onsets_drops_weaker_neighbour():
+    keep = suppress_onsets([0.0, 0.02, 0.5], [2.0, 3.0, 1.0], min_interval=0.05, suppress_ratio=1.0)
+    assert keep.tolist() == [False, True, True]
+
+
+def test_suppress_onsets_ties_keep_earlier():
+    keep = suppress_onsets([0.0, 0.02], [2.0, 2.0], min_interval=0.05, suppress_ratio=1.0)
+    assert keep.tolist() == [True, False]
+
+
+def test_suppress_onsets_low_ratio_only_drops_much_weaker():
+    # a flam keeps both hits when they are of similar strength
+    keep = suppress_onsets([0.0, 0.02], [3.0, 2.0], min_interval=0.05, suppress_ratio=0.5)
+    assert keep.tolist() == [True, True]
+
+    keep = suppress_onsets([0.0, 0.02], [3.0, 1.0], min_interval=0.05, suppress_ratio=0.5)
+    assert keep.tolist() == [True, False]
+
+    keep = suppress_onsets([0.0, 0.02], [1.0, 3.0], min_interval=0.05, suppress_ratio=0.5)
+    assert keep.tolist() == [False, True]
+
+
+def test_suppress_onsets_chain():
+    # dropped onsets don't drop their own neighbours
+    times = np.arange(4)*0.02
+    keep = suppress_onsets(times, [1.0, 2.0, 3.0, 4.0], min_interval=0.03, suppress_ratio=1.0)
+    assert keep.tolist() == [False, True, False, True]
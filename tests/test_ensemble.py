@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.config import SETTINGS
+from ensemble import EnsembleTranscriber
+
+LABELS = list(SETTINGS['LABELS_INDEX'].values())
+
+
+class FakeDrumTranscriber:
+    def predict(self, samples, sr, instrumentation=None):
+        df = pd.DataFrame(np.eye(len(LABELS))[[0, 2]], columns=LABELS)
+        df['time'] = [0.5, 1.0]
+        return df
+
+
+class FakeOmnizart:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def predict(self, samples, sr, instrumentation=None):
+        if self.fail:
+            raise RuntimeError("no model")
+        return pd.DataFrame({'time': [0.51, 2.0], 'prediction': [LABELS[0], LABELS[4]], 'confidence': [1.0, 0.8]})
+
+
+@pytest.mark.parametrize('weights', [{'drum_transcriber': 0, 'omnizart': 0}, {'drum_transcriber': -1, 'omnizart': 2},
+                                     {'drum_transcriber': float('nan'), 'omnizart': 1}, {'drum_transcriber': 1}])
+def test_invalid_weights(weights):
+    with pytest.raises(ValueError):
+        EnsembleTranscriber(FakeDrumTranscriber(), FakeOmnizart(), weights=weights)
+
+
+def test_fuse_weighted_scores():
+    ensemble = EnsembleTranscriber(FakeDrumTranscriber(), FakeOmnizart(), weights={'drum_transcriber': 3, 'omnizart': 1})
+    df = ensemble.predict(np.zeros(100), 100)
+
+    assert df['time'].tolist() == [0.5, 1.0, 2.0]
+    assert df['engines'].tolist() == ['both', 'drum_transcriber', 'omnizart']
+    assert df['prediction'].tolist() == [LABELS[0], LABELS[2], LABELS[4]]
+    np.testing.assert_allclose(df['confidence'], [1.0, 0.75, 0.2])
+
+
+def test_failed_engine_with_the_only_weight():
+    ensemble = EnsembleTranscriber(FakeDrumTranscriber(), FakeOmnizart(fail=True),
+                                   weights={'drum_transcriber': 0, 'omnizart': 1})
+    df = ensemble.predict(np.zeros(100), 100)
+
+    # the engine left keeps its scores as they are
+    np.testing.assert_allclose(df['confidence'], [1.0, 1.0])
+    assert df.attrs['timings']['omnizart']['error'] == 'no model'
@@ -0,0 +1,121 @@
+import os
+import threading
+
+import pytest
+
+from utils.job_queue import JobQueue, QUEUED, RUNNING, DONE, FAILED
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'jobs.sqlite')
+
+
+def test_claim_is_exclusive(db_path):
+    queue = JobQueue(db_path)
+    job_ids = {queue.submit(f"{i}.wav") for i in range(50)}
+
+    claimed = []
+
+    def work(name):
+        # every worker opens its own connection, as the worker processes do
+        worker_queue = JobQueue(db_path)
+        while True:
+            job = worker_queue.claim(name)
+            if job is None:
+                return
+            claimed.append(job['id'])
+
+    threads = [threading.Thread(target=work, args=(f"worker-{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+    assert queue.counts() == {RUNNING: 50}
+
+
+def test_fail_retries_up_to_max_attempts(db_path):
+    queue = JobQueue(db_path, max_attempts=2)
+    job_id = queue.submit('a.wav')
+
+    queue.claim('worker')
+    assert queue.fail(job_id, 'first', worker='worker')
+    assert queue.get(job_id)['status'] == QUEUED
+
+    queue.claim('worker')
+    assert not queue.fail(job_id, 'second', worker='worker')
+
+    job = queue.get(job_id)
+    assert (job['status'], job['attempts'], job['error']) == (FAILED, 2, 'second')
+    assert queue.claim('worker') is None
+
+
+def test_complete_only_by_the_holding_worker(db_path):
+    queue = JobQueue(db_path)
+    job_id = queue.submit('a.wav')
+    queue.claim('worker-1')
+
+    assert not queue.complete(job_id, 'worker-2', 'result.csv')
+    assert queue.complete(job_id, 'worker-1', 'result.csv', {'hits': 3})
+
+    job = queue.get(job_id)
+    assert (job['status'], job['result_path'], job['info']) == (DONE, 'result.csv', {'hits': 3})
+
+
+def test_requeue_stale_dead_worker(db_path):
+    queue = JobQueue(db_path)
+    job_id = queue.submit('a.wav')
+    queue.claim('worker-1.1')
+
+    assert queue.requeue_stale(timeout=3600, workers=['worker-1.1']) == []
+    assert queue.requeue_stale(timeout=3600, workers=['worker-1.2']) == ['worker-1.1']
+    assert queue.get(job_id)['status'] == QUEUED
+
+
+def test_stale_attempt_does_not_fail_a_new_claim(db_path):
+    queue = JobQueue(db_path)
+    job_id = queue.submit('a.wav')
+    first = queue.claim('worker-1')
+
+    # handed back and claimed by a healthy worker after requeue_stale read the first attempt
+    queue.fail(job_id, 'timed out', worker='worker-1')
+    queue.claim('worker-2')
+    queue.fail(job_id, 'timed out', worker=first['worker'], started_at=first['started_at'])
+
+    job = queue.get(job_id)
+    assert (job['status'], job['worker']) == (RUNNING, 'worker-2')
+    assert queue.complete(job_id, 'worker-2', 'result.csv')
+
+
+def test_purge_expired_deletes_only_uploads(db_path, tmp_path):
+    queue = JobQueue(db_path, result_ttl=-1)
+
+    paths = {}
+    for name, uploaded in [('upload', True), ('local', False)]:
+        paths[name] = {'audio': str(tmp_path / f"{name}.wav"), 'result': str(tmp_path / f"{name}.csv")}
+        for path in paths[name].values():
+            open(path, 'w').close()
+
+        job_id = queue.submit(paths[name]['audio'], {'uploaded': uploaded})
+        queue.claim('worker')
+        queue.complete(job_id, 'worker', paths[name]['result'])
+
+    assert queue.purge_expired() == 2
+    assert queue.counts() == {}
+
+    assert not os.path.exists(paths['upload']['audio'])
+    assert os.path.exists(paths['local']['audio'])
+    assert not os.path.exists(paths['upload']['result'])
+    assert not os.path.exists(paths['local']['result'])
+
+
+def test_purge_keeps_unexpired_jobs(db_path):
+    queue = JobQueue(db_path, result_ttl=3600)
+    job_id = queue.submit('a.wav')
+    queue.claim('worker')
+    queue.complete(job_id, 'worker', None)
+
+    assert queue.purge_expired() == 0
+    assert queue.get(job_id)['status'] == DONE
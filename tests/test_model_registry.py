@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from utils import model_registry
+from utils.config import SETTINGS
+from utils.model_registry import register_model, verify_model, read_registry
+
+INPUT_SHAPE = (*SETTINGS['TARGET_SHAPE'], 3)
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = tmp_path / 'model.tflite'
+    path.write_bytes(b'weights'*1000)
+    return str(path)
+
+
+@pytest.fixture
+def registry_path(tmp_path):
+    return str(tmp_path / 'registry.json')
+
+
+def test_unregistered_model(model_path, registry_path):
+    assert verify_model(model_path, registry_path) is None
+
+
+def test_new_mtime_is_written_back(model_path, registry_path, monkeypatch):
+    register_model(model_path, INPUT_SHAPE, registry_path=registry_path)
+
+    # same contents, new mtime, as after a copy or a checkout
+    os.utime(model_path, (1e9, 1e9))
+
+    hashes = []
+    get_hash = model_registry.get_hash
+    monkeypatch.setattr(model_registry, 'get_hash', lambda path: hashes.append(path) or get_hash(path))
+
+    assert verify_model(model_path, registry_path)['mtime'] == 1e9
+    assert read_registry(registry_path)['model.tflite']['mtime'] == 1e9
+    assert len(hashes) == 1
+
+    verify_model(model_path, registry_path)
+    assert len(hashes) == 1
+
+
+def test_changed_contents_are_rejected(model_path, registry_path):
+    register_model(model_path, INPUT_SHAPE, registry_path=registry_path)
+
+    with open(model_path, 'ab') as f:
+        f.write(b'retrained')
+
+    with pytest.raises(ValueError, match='changed since it was registered'):
+        verify_model(model_path, registry_path)
+
+
+def test_other_input_shape_is_rejected(model_path, registry_path):
+    register_model(model_path, (64, 64, 3), registry_path=registry_path)
+
+    with pytest.raises(ValueError, match='takes inputs of shape'):
+        verify_model(model_path, registry_path)
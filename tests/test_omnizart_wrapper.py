@@ -0,0 +1,47 @@
+import sys
+import types
+
+import numpy as np
+import pretty_midi
+import pytest
+
+from omnizart_wrapper import OmnizartWrapper
+
+
+class FakeApp:
+    """
+    Omnizart's drum app without the private _load_model, as after an API change.
+    """
+    custom_objects = {}
+
+    def __init__(self):
+        self.transcribed = []
+
+    def transcribe(self, path):
+        self.transcribed.append(path)
+        midi = pretty_midi.PrettyMIDI()
+        drums = pretty_midi.Instrument(0, is_drum=True)
+        drums.notes.append(pretty_midi.Note(velocity=100, pitch=38, start=0.5, end=0.6))
+        midi.instruments.append(drums)
+        return midi
+
+
+@pytest.fixture
+def fake_app(monkeypatch):
+    app = FakeApp()
+    drum = types.ModuleType('omnizart.drum')
+    drum.app = app
+    monkeypatch.setitem(sys.modules, 'omnizart', types.ModuleType('omnizart'))
+    monkeypatch.setitem(sys.modules, 'omnizart.drum', drum)
+    return app
+
+
+def test_missing_private_api_falls_back_to_transcribe(fake_app, capsys):
+    wrapper = OmnizartWrapper()
+
+    assert wrapper.model is None
+    assert "internal drum API changed" in capsys.readouterr().out
+
+    df = wrapper.predict(np.zeros(4410, dtype=np.float32), 44100)
+    assert len(fake_app.transcribed) == 1
+    assert df['time'].tolist() == [0.5]
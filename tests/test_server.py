@@ -0,0 +1,153 @@
+import io
+import json
+import threading
+import http.client
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+import soundfile as sf
+
+from utils.config import SETTINGS
+from server import TranscriptionService, make_handler, parse_params, run_job
+
+
+class FakeEngine:
+    def predict(self, samples, sr, instrumentation=None):
+        df = pd.DataFrame(np.eye(len(SETTINGS['LABELS_INDEX']))[:2], columns=list(SETTINGS['LABELS_INDEX'].values()))
+        df['time'] = [0.1, 0.5]
+        return df
+
+
+class FakeEngines:
+    def get(self, name):
+        return FakeEngine()
+
+
+@pytest.fixture
+def service(tmp_path):
+    # no worker processes, the tests run the jobs themselves
+    return TranscriptionService(str(tmp_path / 'jobs.sqlite'), str(tmp_path / 'data'), n_workers=1, pin=False)
+
+
+@pytest.fixture
+def request_server(service):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service, max_upload_mb=1))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def request(method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(*server.server_address, timeout=10)
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        payload = response.read()
+        connection.close()
+        if response.getheader('Content-Type') == 'application/json':
+            payload = json.loads(payload)
+        return response.status, payload
+
+    yield request
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def wav_bytes(tmp_path):
+    path = tmp_path / 'clip.wav'
+    sf.write(str(path), np.zeros(SETTINGS['ANALYSIS_SR'], dtype=np.float32), SETTINGS['ANALYSIS_SR'])
+    return path.read_bytes()
+
+
+@pytest.mark.parametrize('values', [{'start': 'nan'}, {'duration': 'inf'}, {'start': -1}, {'duration': 0},
+                                    {'engine': 'unknown'}, {'format': 'wav'}])
+def test_parse_params_rejects(values):
+    with pytest.raises(ValueError):
+        parse_params(values)
+
+
+def test_parse_params_defaults():
+    assert parse_params({}) == {'engine': 'drum_transcriber', 'separate': False, 'start': 0.0,
+                                'duration': None, 'format': 'csv'}
+
+
+def test_upload_run_and_fetch_result(service, request_server, wav_bytes):
+    status, job = request_server('POST', '/jobs?format=csv&filename=clip.wav', wav_bytes)
+    assert status == 202
+    assert job['status'] == 'queued'
+
+    status, _ = request_server('GET', f"/jobs/{job['id']}/result")
+    assert status == 409
+
+    queue = service.get_queue()
+    claimed = queue.claim('worker')
+    result_path, info = run_job(claimed, FakeEngines(), service.data_dir)
+    assert queue.complete(claimed['id'], 'worker', result_path, info)
+
+    status, description = request_server('GET', f"/jobs/{job['id']}")
+    assert status == 200
+    assert description['status'] == 'done'
+    assert description['info']['hits'] == 2
+    assert description['result_url'] == f"/jobs/{job['id']}/result"
+
+    status, body = request_server('GET', description['result_url'])
+    assert status == 200
+    assert pd.read_csv(io.BytesIO(body))['time'].tolist() == [0.1, 0.5]
+
+
+def test_failed_job_result_is_gone(service, request_server, wav_bytes):
+    _, job = request_server('POST', '/jobs', wav_bytes)
+
+    queue = service.get_queue()
+    for _ in range(SETTINGS['SERVER_MAX_ATTEMPTS']):
+        queue.claim('worker')
+        queue.fail(job['id'], 'RuntimeError: boom', worker='worker')
+
+    status, description = request_server('GET', f"/jobs/{job['id']}/result")
+    assert status == 410
+    assert description['error'] == 'RuntimeError: boom'
+
+
+@pytest.mark.parametrize('body', [b'[1, 2]', b'"path"', b'{"path": 3}', b'{not json', b'{"path": "x", "start": "nan"}'])
+def test_bad_json_body(request_server, body):
+    status, payload = request_server('POST', '/jobs', body, {'Content-Type': 'application/json'})
+    assert status == 400
+    assert 'error' in payload
+
+
+def test_json_body_with_missing_file(request_server, tmp_path):
+    body = json.dumps({'path': str(tmp_path / 'missing.wav')}).encode()
+    status, _ = request_server('POST', '/jobs', body, {'Content-Type': 'application/json'})
+    assert status == 400
+
+
+def test_json_body_with_path(service, request_server, tmp_path, wav_bytes):
+    audio_path = tmp_path / 'local.wav'
+    audio_path.write_bytes(wav_bytes)
+
+    body = json.dumps({'path': str(audio_path), 'format': 'hits'}).encode()
+    status, job = request_server('POST', '/jobs', body, {'Content-Type': 'application/json'})
+    assert status == 202
+    assert job['params']['format'] == 'hits'
+    assert service.get_queue().get(job['id'])['audio_path'] == str(audio_path)
+
+
+def test_empty_and_oversized_uploads(request_server):
+    assert request_server('POST', '/jobs', b'')[0] == 400
+    # refused from the header, before the body is read
+    assert request_server('POST', '/jobs', b'0', {'Content-Length': str(1024**2 + 1)})[0] == 413
+
+
+def test_unknown_routes(request_server):
+    assert request_server('GET', '/jobs/0123abcd')[0] == 404
+    assert request_server('GET', '/nothing')[0] == 404
+    assert request_server('POST', '/nothing', b'x')[0] == 404
+
+
+def test_health(request_server, wav_bytes):
+    request_server('POST', '/jobs', wav_bytes)
+
+    status, health = request_server('GET', '/health')
+    assert status == 200
+    assert health == {'workers': 0, 'jobs': {'queued': 1}}
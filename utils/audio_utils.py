@@ -1,30 +1,40 @@
 import librosa
 import numpy as np
+from scipy.ndimage import median_filter
 from sklearn.preprocessing import MinMaxScaler
 
 from utils.config import SETTINGS
 
 
-def fix_audio_length(samples: np.array, sr: int, length: int) -> np.array:
+def fix_audio_length(samples: np.array, sr: int, length: float, align: str = 'center') -> np.array:
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
-    :param length (int): target length in seconds
-    :return samples (np.array): samples with padding or trimmings performed
+    :param length (float): target length in seconds
+    :param align (str): 'center' pads or trims both ends symmetrically,
+                        'onset' keeps the start of the samples and pads or trims the end
+    :return samples (np.array): samples with padding or trimmings performed, exactly int(sr*length) long
     """
     desired_length = int(sr*length)
+    if align == 'onset':
+        # keep the attack at the start of the window
+        if len(samples) >= desired_length:
+            return samples[:desired_length]
+
+        return np.concatenate((samples, np.zeros(desired_length - len(samples))))
+
     if len(samples) > desired_length:
         # trim from both ends, symmetrically
         trim_amount = (len(samples) - desired_length)//2
-        return samples[trim_amount:len(samples)-trim_amount]
+        return samples[trim_amount:trim_amount+desired_length]
 
     else:
         # add silence from both ends
         add_amount = (desired_length - len(samples))//2
-        return np.concatenate((np.zeros(add_amount), samples, np.zeros(add_amount)))
+        return np.concatenate((np.zeros(add_amount), samples, np.zeros(desired_length - len(samples) - add_amount)))
 
 
-def get_onset_frames(samples: np.array, sr: int = 44100) -> list:
+def get_onset_frames(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR']) -> list:
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
@@ -33,31 +43,37 @@ def get_onset_frames(samples: np.array, sr: int = 44100) -> list:
     onset_backtracks = librosa.onset.onset_detect(y=samples, sr=sr,
                                                   units='samples', backtrack=True)
 
+    if len(onset_backtracks) == 0:
+        return []
+
     # this to include the last frame end as onset_detect backtracking goes to the previous min point
     onset_backtracks = np.append(onset_backtracks, min(
-        onset_backtracks[-1]+sr, len(samples)))
+        onset_backtracks[-1]+int(sr*SETTINGS['WINDOW_LENGTH']), len(samples)))
 
     onset_frames = list(zip(onset_backtracks[:-1], onset_backtracks[1:]))
     return onset_frames
 
 
-def get_onset_samples(samples: np.array, sr: int = 44100, onset_frames: list = None) -> list:
+def get_onset_samples(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR'], onset_frames: list = None,
+                      window_length: float = SETTINGS['WINDOW_LENGTH'], align: str = SETTINGS['WINDOW_ALIGN']) -> list:
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
     :para onset_frames (list): if provided, will use precomputed onset_frames (optional)
+    :param window_length (float): length in seconds of the window cut around each onset
+    :param align (str): how each onset is placed in its window, see fix_audio_length
     :return on_set_samples (list): list of np.arrays containing samples for each onset
     """
     if onset_frames is None:
         onset_frames = get_onset_frames(samples, sr)
 
-    onset_samples = [fix_audio_length(samples[s:e], sr, 1)
+    onset_samples = [fix_audio_length(samples[s:e], sr, window_length, align)
                      for s, e in onset_frames]
 
     return onset_samples
 
 
-def get_onset_times(samples: np.array, sr: int = 44100) -> np.array:
+def get_onset_times(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR']) -> np.array:
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
@@ -69,20 +85,388 @@ def get_onset_times(samples: np.array, sr: int = 44100) -> np.array:
     return onset_times
 
 
-def get_mel_spectrogram(samples: np.array, sr: int = 44100, target_shape=SETTINGS['TARGET_SHAPE']) -> np.array:
+def suppress_onsets(times: np.array, strengths: np.array, min_interval: float = SETTINGS['ONSET_MIN_INTERVAL'],
+                    suppress_ratio: float = SETTINGS['ONSET_SUPPRESS_RATIO']) -> np.array:
+    """
+    Greedy non-maximum suppression of near-duplicate onsets (flams, cymbal swells, ringing toms).
+    Onsets are visited from the strongest, each kept onset drops the onsets less than min_interval away
+    whose strength is below its strength*suppress_ratio, ties keep the earlier onset.
+    Dropped onsets don't drop their own neighbours, so a chain of close onsets isn't reduced to one.
+
+    :param times (np.array): sorted onset times in seconds
+    :param strengths (np.array): onset envelope strength at each onset
+    :param min_interval (float): minimum seconds between two kept onsets, 0 keeps everything
+    :param suppress_ratio (float): 1 drops every weaker neighbour, lower values only drop much weaker ones
+    :return keep (np.array): boolean mask of the onsets to keep
+    """
+    times = np.asarray(times, dtype=np.float64)
+    strengths = np.asarray(strengths, dtype=np.float64)
+    keep = np.ones(len(times), dtype=bool)
+
+    if min_interval <= 0 or len(times) < 2:
+        return keep
+
+    # onsets are sorted, so the neighbours within min_interval are a contiguous range
+    lows = np.searchsorted(times, times - min_interval, side='right')
+    highs = np.searchsorted(times, times + min_interval, side='left')
+
+    visited = np.zeros(len(times), dtype=bool)
+    # strongest first, the earlier onset first among equal strengths
+    for i in np.lexsort((times, -strengths)):
+        visited[i] = True
+        if not keep[i]:
+            continue
+
+        neighbours = np.arange(lows[i], highs[i])
+        threshold = strengths[i]*suppress_ratio
+        weaker = (strengths[neighbours] < threshold) | ((strengths[neighbours] == threshold) & (neighbours > i))
+        drop = neighbours[weaker & ~visited[neighbours]]
+        keep[drop] = False
+        visited[drop] = True
+
+    return keep
+
+
+def get_active_regions(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR'], top_db: float = SETTINGS['GATE_TOP_DB'],
+                       min_silence: float = SETTINGS['GATE_MIN_SILENCE'], padding: float = SETTINGS['GATE_PADDING'],
+                       frame_length: int = 2048, hop_length: int = 512) -> np.array:
+    """
+    RMS energy gate, finds the parts of the audio worth running onset detection on.
+
+    :param samples (np.array): samples array of the audio
+    :param sr (int): sample rate used for the samples
+    :param top_db (float): frames more than top_db below the loudest frame are silent
+    :param min_silence (float): silences shorter than this many seconds are kept inside the surrounding region
+    :param padding (float): seconds added on both sides of every region, so onset detection and backtracking
+                            see the audio leading into the first hit
+    :return regions (np.array): (n_regions, 2) int array of start and end samples, sorted and not overlapping
+    """
+    rms = librosa.feature.rms(y=samples, frame_length=frame_length, hop_length=hop_length)[0] if len(samples) else []
+    if len(rms) == 0 or np.max(rms) < 1e-5:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    active = librosa.amplitude_to_db(rms, ref=np.max, top_db=None) > -top_db
+
+    # rising and falling edges of the active frames, frames are centered on frame*hop_length
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    starts = edges[0::2]*hop_length - frame_length//2 - int(padding*sr)
+    ends = (edges[1::2] - 1)*hop_length + frame_length//2 + int(padding*sr)
+
+    # merge regions separated by less than min_silence
+    breaks = starts[1:] - ends[:-1] >= min_silence*sr
+    starts = np.concatenate((starts[:1], starts[1:][breaks]))
+    ends = np.concatenate((ends[:-1][breaks], ends[-1:]))
+
+    return np.stack([np.clip(starts, 0, len(samples)), np.clip(ends, 0, len(samples))], axis=1).astype(np.int64)
+
+
+def get_onsets(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR'], min_interval: float = SETTINGS['ONSET_MIN_INTERVAL'],
+               suppress_ratio: float = SETTINGS['ONSET_SUPPRESS_RATIO'], gate_top_db: float = SETTINGS['GATE_TOP_DB']):
+    """
+    Same onsets as get_onset_frames and get_onset_times from a single onset detection pass,
+    with near-duplicates removed by suppress_onsets. Onset detection only runs inside the active regions
+    found by get_active_regions, so silence costs next to nothing. The regions are cut on the frame grid
+    and their envelopes normalised together, so peak picking sees the same envelope as without the gate.
+
+    :param samples (np.array): samples array of the audio
+    :param sr (int): sample rate used for the samples
+    :param min_interval (float): see suppress_onsets
+    :param suppress_ratio (float): see suppress_onsets
+    :param gate_top_db (float): see get_active_regions, None runs onset detection on the whole audio
+    :return onset_frames, onset_times, n_suppressed (list, np.array, int): see get_onset_frames and get_onset_times,
+                                                                           and the number of onsets dropped
+    """
+    hop_length = 512  # librosa's default, onset_strength and onset_detect use it
+    if gate_top_db is None:
+        regions = [(0, len(samples))]
+    else:
+        # starts on the frame grid, so region frames line up with the frames of the whole audio
+        regions = [(start - start % hop_length, end) for start, end in get_active_regions(samples, sr, gate_top_db)]
+
+    # onset_strength clips its dB spectrogram 80 dB below the loudest bin and onset_detect normalises
+    # the envelope to [0, 1], both per call. Both are done across all the regions at once instead,
+    # so quiet regions keep their level relative to the loud ones as without the gate
+    spectrograms = [librosa.feature.melspectrogram(y=samples[start:end], sr=sr, hop_length=hop_length)
+                    for start, end in regions]
+    envelopes = []
+    if spectrograms:
+        floor = librosa.power_to_db(max(np.max(S) for S in spectrograms)) - 80
+        envelopes = [librosa.onset.onset_strength(S=np.maximum(librosa.power_to_db(S, top_db=None), floor),
+                                                  sr=sr, hop_length=hop_length) for S in spectrograms]
+        low = min(np.min(e) for e in envelopes)
+        high = max(np.max(e) for e in envelopes) - low
+        envelopes = [(e - low)/(high + np.finfo(e.dtype).tiny) for e in envelopes]
+
+    onset_times, strengths, onset_backtracks = [np.zeros(0)], [np.zeros(0)], [np.zeros(0, dtype=np.int64)]
+    for (start, end), onset_envelope in zip(regions, envelopes):
+        peaks = librosa.onset.onset_detect(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length,
+                                           units='frames', normalize=False)
+
+        # back to the global timeline
+        onset_times.append(librosa.frames_to_time(peaks, sr=sr, hop_length=hop_length) + start/sr)
+        strengths.append(onset_envelope[peaks])
+        # backtracked to the previous envelope minimum, as onset_detect(backtrack=True) does
+        onset_backtracks.append(librosa.frames_to_samples(librosa.onset.onset_backtrack(peaks, onset_envelope),
+                                                          hop_length=hop_length) + start)
+
+    onset_times = np.concatenate(onset_times)
+    onset_backtracks = np.concatenate(onset_backtracks)
+
+    keep = suppress_onsets(onset_times, np.concatenate(strengths), min_interval, suppress_ratio)
+    onset_times, onset_backtracks = onset_times[keep], onset_backtracks[keep]
+
+    if len(onset_times) == 0:
+        return [], onset_times, int((~keep).sum())
+
+    onset_backtracks = np.append(onset_backtracks, min(
+        onset_backtracks[-1]+int(sr*SETTINGS['WINDOW_LENGTH']), len(samples)))
+
+    onset_frames = list(zip(onset_backtracks[:-1], onset_backtracks[1:]))
+    return onset_frames, onset_times, int((~keep).sum())
+
+
+def get_percussive(samples: np.array, kernel_size: int = SETTINGS['HPSS_KERNEL_SIZE'],
+                   margin: float = SETTINGS['HPSS_MARGIN'], n_fft: int = 2048, hop_length: int = 512) -> np.array:
+    """
+    Median-filter harmonic/percussive separation (Fitzgerald 2010), keeps the percussive part.
+    Both median filters run over the whole magnitude spectrogram at once.
+
+    :param samples (np.array): samples array of the audio
+    :param kernel_size (int): median filter length, in frames across time for the harmonic part
+                              and in bins across frequency for the percussive part
+    :param margin (float): how much louder than the harmonic part a bin has to be to count as percussive
+    :return percussive (np.array): percussive samples, as long as the input
+    """
+    if len(samples) == 0:
+        return samples
+
+    stft = librosa.stft(samples, n_fft=n_fft, hop_length=hop_length)
+    magnitude = np.abs(stft)
+
+    harmonic = median_filter(magnitude, size=(1, kernel_size), mode='reflect')
+    percussive = median_filter(magnitude, size=(kernel_size, 1), mode='reflect')
+    mask = librosa.util.softmask(percussive, margin*harmonic, power=2)
+
+    return librosa.istft(stft*mask, hop_length=hop_length, length=len(samples)).astype(np.float32)
+
+
+def to_analysis_rate(samples: np.array, sr: int, analysis_sr: int = SETTINGS['ANALYSIS_SR']):
     """
     :param samples (np.array): samples array of the audio
     :param sr (int): sample rate used for the samples
+    :param analysis_sr (int): sample rate onset detection and features run at
+    :return samples, sr (np.array, int): the samples resampled to analysis_sr, unchanged if already there
+    """
+    if sr == analysis_sr:
+        return samples, sr
+
+    return librosa.resample(samples, orig_sr=sr, target_sr=analysis_sr), analysis_sr
+
+
+def match_onsets(reference: np.array, estimate: np.array, tolerance: float = 0.05):
+    """
+    One-to-one matching of two sorted onset time arrays with a single sorted merge, O(n + m).
+
+    :param reference (np.array): sorted onset times in seconds
+    :param estimate (np.array): sorted onset times in seconds
+    :param tolerance (float): maximum distance in seconds between matched onsets
+    :return reference_indices, estimate_indices (np.array, np.array): indices of the matched pairs
+    """
+    reference_indices = []
+    estimate_indices = []
+
+    i, j = 0, 0
+    while i < len(reference) and j < len(estimate):
+        difference = estimate[j] - reference[i]
+
+        if abs(difference) <= tolerance:
+            # take the closer of this and the next estimate for the same reference onset
+            if j + 1 < len(estimate) and abs(estimate[j+1] - reference[i]) < abs(difference):
+                j += 1
+                continue
+
+            reference_indices.append(i)
+            estimate_indices.append(j)
+            i += 1
+            j += 1
+        elif difference < 0:
+            j += 1
+        else:
+            i += 1
+
+    return np.array(reference_indices, dtype=np.int64), np.array(estimate_indices, dtype=np.int64)
+
+
+def get_mel_spectrogram(samples: np.array, sr: int = SETTINGS['ANALYSIS_SR'], target_shape=SETTINGS['TARGET_SHAPE'],
+                        hop_length: int = SETTINGS['MEL_HOP_LENGTH']) -> np.array:
+    """
+    :param samples (np.array): samples array of the audio
+    :param sr (int): sample rate used for the samples
+    :param target_shape (tuple): (n_mels, n_frames) of the returned spectrogram
+    :param hop_length (int): hop in samples, None to stretch the samples over target_shape
     :return mel_spectrogram (np.array): np.array containing melspectrogram features in decibels
     """
-    hop_length = len(samples)//target_shape[0]
+    if hop_length is None:
+        hop_length = len(samples)//target_shape[0]
 
     mel_features = librosa.feature.melspectrogram(
         y=samples, sr=sr, hop_length=hop_length, n_mels=target_shape[0])
 
+    # a fixed hop on a short window can give fewer frames than the target, pad them as silence
     mel_features = mel_features[:, :target_shape[1]]
+    if mel_features.shape[1] < target_shape[1]:
+        mel_features = np.pad(mel_features, ((0, 0), (0, target_shape[1] - mel_features.shape[1])))
 
     mel_in_db = librosa.power_to_db(mel_features, ref=np.max)
     scaler = MinMaxScaler(feature_range=(0, 1))
 
     return scaler.fit_transform(mel_in_db)
+
+
+def get_pooled_features(windows: np.array, sr: int = SETTINGS['ANALYSIS_SR'], n_mels: int = 64,
+                        hop_length: int = 1024) -> np.array:
+    """
+    Cheap fixed-size features for the cascade's first stage, computed for all windows at once.
+
+    :param windows (np.array): 2D array of equally long onset windows
+    :param sr (int): sample rate used for the samples
+    :param n_mels (int): number of mel bands
+    :param hop_length (int): hop in samples
+    :return features (np.array): (n_windows, 3*n_mels) mean, standard deviation and max over time of every band
+                                 of the log-mel spectrogram, relative to the loudest bin so gain does not matter
+    """
+    windows = np.asarray(windows, dtype=np.float32)
+    if len(windows) == 0:
+        return np.zeros((0, 3*n_mels), dtype=np.float32)
+
+    mel_features = librosa.feature.melspectrogram(y=windows, sr=sr, hop_length=hop_length, n_mels=n_mels)
+    mel_in_db = librosa.power_to_db(mel_features, ref=1.0, top_db=None)
+    mel_in_db = np.maximum(mel_in_db - mel_in_db.max(axis=(1, 2), keepdims=True), -80)
+
+    return np.concatenate([mel_in_db.mean(axis=2), mel_in_db.std(axis=2), mel_in_db.max(axis=2)],
+                          axis=1).astype(np.float32)
+
+
+class OnsetTracker():
+    """
+    Incremental version of get_onset_times for audio that arrives in blocks.
+
+    Uses the same spectral flux onset envelope and peak picking rules as librosa.onset.onset_detect,
+    but only looks ahead `lookahead` seconds instead of the 0.1s post average window, and normalises
+    the envelope by its running maximum instead of the maximum over the whole clip.
+    """
+
+    def __init__(self, sr: int = SETTINGS['ANALYSIS_SR'], hop_length: int = 512, n_fft: int = 2048, n_mels: int = 128,
+                 lookahead: float = SETTINGS['LIVE_LOOKAHEAD'], delta: float = 0.07):
+        """
+        :param sr (int): sample rate of the incoming blocks
+        :param hop_length (int): hop between onset envelope frames in samples
+        :param n_fft (int): fft size of the onset envelope frames
+        :param n_mels (int): mel bands used for the spectral flux
+        :param lookahead (float): seconds of envelope after a frame needed to confirm it as an onset
+        :param delta (float): threshold above the local average of the normalised envelope
+        """
+        self.sr = sr
+        self.hop_length = hop_length
+        self.n_fft = n_fft
+        self.n_mels = n_mels
+        self.delta = delta
+
+        # peak picking parameters of librosa.onset.onset_detect, in frames
+        self.pre_max = int(0.03*sr//hop_length)
+        self.pre_avg = int(0.10*sr//hop_length)
+        self.wait = int(0.03*sr//hop_length)
+        self.post = max(int(lookahead*sr//hop_length), 1)
+
+        self.reset()
+
+    def reset(self):
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.buffer_start = 0  # absolute sample index of buffer[0]
+
+        self.previous_db = None
+        self.envelope = np.zeros(0)
+        self.envelope_start = 0  # absolute frame index of envelope[0]
+        self.envelope_max = 1e-6
+
+        self.next_frame = 0  # first frame not yet checked for a peak
+        self.last_onset_frame = -np.inf
+
+    @property
+    def latency(self) -> float:
+        """
+        :return latency (float): seconds between an onset and the moment it can be reported
+        """
+        return (self.n_fft + self.post*self.hop_length)/self.sr
+
+    def frame_to_sample(self, frame: int) -> int:
+        # frames are not centred, and librosa reports the flux of a frame half an fft after its centre
+        return frame*self.hop_length + self.n_fft
+
+    def process(self, block: np.array, backtrack: bool = False):
+        """
+        :param block (np.array): the next samples of the stream
+        :param backtrack (bool): also return the onsets rolled back to the preceding envelope minimum,
+                                 like get_onset_frames does
+        :return onset_samples (np.array): absolute sample positions of the onsets confirmed by this block,
+                                          and the backtracked positions if backtrack is True
+        """
+        self.buffer = np.concatenate((self.buffer, np.asarray(block, dtype=np.float32)))
+
+        n_frames = 1 + (len(self.buffer) - self.n_fft)//self.hop_length
+        if n_frames <= 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return (empty, empty) if backtrack else empty
+
+        mel = librosa.feature.melspectrogram(y=self.buffer[:(n_frames-1)*self.hop_length + self.n_fft],
+                                             sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length,
+                                             n_mels=self.n_mels, center=False)
+        mel_db = librosa.power_to_db(mel)
+
+        if self.previous_db is None:
+            # treat the stream as starting from silence so a hit in the first frame is not lost
+            self.previous_db = np.full((self.n_mels, 1), mel_db.min())
+
+        # spectral flux, one value per new frame
+        flux = np.maximum(0, np.diff(np.hstack((self.previous_db, mel_db)), axis=1)).mean(axis=0)
+        self.previous_db = mel_db[:, -1:]
+
+        consumed = n_frames*self.hop_length
+        self.buffer = self.buffer[consumed:]
+        self.buffer_start += consumed
+
+        self.envelope_max = max(self.envelope_max, flux.max())
+        self.envelope = np.concatenate((self.envelope, flux))
+
+        onsets = []
+        backtracks = []
+        env = self.envelope/self.envelope_max
+        last_checkable = self.envelope_start + len(self.envelope) - self.post
+        for frame in range(self.next_frame, last_checkable):
+            i = frame - self.envelope_start
+
+            is_max = env[i] >= env[max(i-self.pre_max, 0):i+self.post+1].max()
+            above_avg = env[i] >= env[max(i-self.pre_avg, 0):i+self.post+1].mean() + self.delta
+
+            if is_max and above_avg and frame > self.last_onset_frame + self.wait:
+                onsets.append(self.frame_to_sample(frame))
+                self.last_onset_frame = frame
+
+                # walk back to the local minimum within the kept history
+                j = i
+                while j > 0 and env[j-1] <= env[j]:
+                    j -= 1
+                backtracks.append(self.frame_to_sample(j + self.envelope_start))
+
+        self.next_frame = max(self.next_frame, last_checkable)
+
+        # only keep the history the peak picking windows can still reach
+        keep_from = max(self.next_frame - self.pre_avg - self.pre_max, self.envelope_start)
+        self.envelope = self.envelope[keep_from - self.envelope_start:]
+        self.envelope_start = keep_from
+
+        onsets = np.array(onsets, dtype=np.int64)
+        if backtrack:
+            return onsets, np.array(backtracks, dtype=np.int64)
+
+        return onsets
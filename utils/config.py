@@ -7,6 +7,91 @@ SETTINGS = {
         4: 'snare',
         5: 'tom_h'
     },
+    # sample rate audio is decoded and analysed at, onset times are always reported in seconds.
+    # The shipped model was trained at 44100, use benchmarks/compare_analysis_rates.py before lowering it
+    'ANALYSIS_SR': 44100,
     'TARGET_SHAPE': (256, 256),
-    'SAVED_MODEL_PATH': "./model/drum_transcriber.h5"
+    # length in seconds of the window classified for every hit and how the onset is placed in it,
+    # 'center' matches the shipped model, 'onset' keeps the attack when using short windows.
+    # MEL_HOP_LENGTH None stretches the window over TARGET_SHAPE, with a fixed hop
+    # TARGET_SHAPE[1] should be about 1 + WINDOW_LENGTH*sr/MEL_HOP_LENGTH frames,
+    # e.g. WINDOW_LENGTH 0.2, WINDOW_ALIGN 'onset', MEL_HOP_LENGTH 128 and TARGET_SHAPE (128, 75)
+    'WINDOW_LENGTH': 1,
+    'WINDOW_ALIGN': 'center',
+    'MEL_HOP_LENGTH': None,
+    # onsets closer than ONSET_MIN_INTERVAL seconds to a stronger one are dropped before classification
+    # (flams, cymbal swells, ringing toms), 0 disables. Off by default as it changes the transcription,
+    # e.g. 0.05 skips the weaker hit of flams. See utils.audio_utils.suppress_onsets
+    'ONSET_MIN_INTERVAL': 0,
+    'ONSET_SUPPRESS_RATIO': 1.0,
+    # energy gate: onset detection is skipped where the audio is more than GATE_TOP_DB below its loudest part
+    # for at least GATE_MIN_SILENCE seconds, None disables. See utils.audio_utils.get_active_regions
+    'GATE_TOP_DB': 50,
+    'GATE_MIN_SILENCE': 0.5,
+    'GATE_PADDING': 0.1,
+    'SAVED_MODEL_PATH': "./model/drum_transcriber.h5",
+    # memory-mapped TFLite copy of the model shared by server replicas, see utils.shared_model
+    'SHARED_MODEL_PATH': "./model/drum_transcriber.tflite",
+    # SavedModel copy with a pre-traced serving signature and the registry of converted models,
+    # both written by convert_model.py
+    'SIGNATURE_MODEL_PATH': "./model/drum_transcriber_saved_model",
+    'MODEL_REGISTRY_PATH': "./model/registry.json",
+    'PREDICT_BATCH_SIZE': 32,
+    # cascade: a small classifier trained by dev/train_cascade.py labels the hits it is at least
+    # CASCADE_THRESHOLD confident about, only the others go through the full model. None disables it
+    'CASCADE_MODEL_PATH': "./model/cascade_stage1.joblib",
+    'CASCADE_THRESHOLD': None,
+    # live transcription: seconds of look-ahead for onset peak picking, seconds of audio
+    # after an onset used to classify it and the latency a hit is expected to stay under
+    'LIVE_BLOCK_SIZE': 512,
+    'LIVE_LOOKAHEAD': 0.03,
+    'LIVE_CONTEXT': 0.2,
+    'LIVE_LATENCY_BUDGET': 0.35,
+    # General MIDI drum pitch -> label used for Omnizart transcriptions,
+    # the first pitch of each label is the one written by the MIDI export
+    'OMNIZART_LABEL_MAP': {
+        36: 'kick_drum', 35: 'kick_drum',
+        38: 'snare', 40: 'snare', 37: 'snare',  # 37 is side stick
+        42: 'hihat_c', 44: 'hihat_c', 46: 'hihat_c',  # all hi-hats map to closed for now
+        50: 'tom_h', 48: 'tom_h', 47: 'tom_h', 45: 'tom_h', 43: 'tom_h', 41: 'tom_h',
+        49: 'crash', 57: 'crash',
+        51: 'ride', 59: 'ride'
+    },
+    # ensemble of DrumTranscriber and Omnizart: seconds between hits of both engines to count
+    # as the same hit and weight of each engine's scores in the fused confidence
+    'ENSEMBLE_TOLERANCE': 0.05,
+    'ENSEMBLE_WEIGHTS': {'drum_transcriber': 0.5, 'omnizart': 0.5},
+    # interactive player: seconds shown at once by default and resolution of the hit offset tables
+    'PLAYER_VIEW_SECONDS': 30,
+    'HIT_INDEX_BUCKET_SECONDS': 1.0,
+    # samples covered by one peak of the finest level of the waveform peaks pyramid
+    'PEAKS_SAMPLES_PER_PEAK': 256,
+    # streamlit frontend: seconds and number of transcriptions kept in the cache
+    'FRONTEND_CACHE_TTL': 3600,
+    'FRONTEND_CACHE_ENTRIES': 16,
+    # what gradio_app transcribes by default: 'mix', 'hpss' (percussive part) or 'demucs' (drums stem)
+    'SOURCE_MODE': 'mix',
+    # percussive source mode: median filter length and separation margin, see utils.audio_utils.get_percussive
+    'HPSS_KERNEL_SIZE': 17,
+    'HPSS_MARGIN': 1.0,
+    # seconds of audio separated on both sides of the requested range, see DemucsSeparator.separate
+    'DEMUCS_CONTEXT_MARGIN': 5.0,
+    # streaming from a URL: seconds per decoded block, seconds of audio transcribed at a time
+    # and blocks decoded ahead of the transcription at most
+    'STREAM_BLOCK_SECONDS': 0.5,
+    'STREAM_CHUNK_SECONDS': 10,
+    'STREAM_PREFETCH_BLOCKS': 120,
+    # headless HTTP service (server.py): job database, directory for uploads and results, worker processes,
+    # attempts per job, seconds results are kept and seconds a job may run before it is retried
+    'SERVER_DB_PATH': "./jobs/jobs.sqlite",
+    'SERVER_DATA_DIR': "./jobs",
+    'SERVER_WORKERS': 2,
+    'SERVER_MAX_ATTEMPTS': 3,
+    'SERVER_RESULT_TTL': 24*3600,
+    'SERVER_JOB_TIMEOUT': 600,
+    'SERVER_MAX_UPLOAD_MB': 200,
+    # threads of every server worker, each one is pinned to its own cores when possible. None splits the cores evenly
+    'SERVER_WORKER_THREADS': None,
+    # directory for a cProfile dump of every gradio request, None to disable
+    'PROFILE_DIR': None
 }
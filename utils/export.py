@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.config import SETTINGS
+
+# fixed-width record of one hit, files are plain concatenations of records so they can be appended to
+# while a stream is transcribed and read back with np.fromfile. label is the SETTINGS['LABELS_INDEX'] key
+HIT_DTYPE = np.dtype([('time', '<f8'), ('label', 'u1'), ('confidence', '<f4')])
+
+
+def get_top_labels(preds: pd.DataFrame) -> tuple:
+    """
+    :param preds (pd.DataFrame): predictions with either 'prediction' and 'confidence' columns
+                                 or one probability column per label, as returned by DrumTranscriber.predict
+    :return label_indices, confidences (np.array, np.array): SETTINGS['LABELS_INDEX'] key and confidence per hit
+    """
+    labels = list(SETTINGS['LABELS_INDEX'].values())
+
+    if 'prediction' in preds and 'confidence' in preds:
+        label_indices = preds['prediction'].map({label: i for i, label in enumerate(labels)})
+        if label_indices.isna().any():
+            raise ValueError(f"Unknown labels: {sorted(set(preds['prediction'][label_indices.isna()]))}")
+        return label_indices.to_numpy(dtype=np.int64), preds['confidence'].to_numpy(dtype=np.float64)
+
+    scores = preds[labels].to_numpy()
+    label_indices = np.argmax(scores, axis=1)
+    return label_indices, scores[np.arange(len(scores)), label_indices]
+
+
+def get_midi_pitches(label_map: dict = None) -> dict:
+    """
+    :param label_map (dict): MIDI pitch -> label mapping, SETTINGS['OMNIZART_LABEL_MAP'] if not provided
+    :return pitches (dict): label -> MIDI pitch, the first pitch listed for each label
+    """
+    label_map = SETTINGS['OMNIZART_LABEL_MAP'] if label_map is None else label_map
+
+    pitches = {}
+    for pitch, label in label_map.items():
+        pitches.setdefault(label, pitch)
+
+    return pitches
+
+
+def predictions_to_midi(preds: pd.DataFrame, label_map: dict = None, note_duration: float = 0.1):
+    """
+    :param preds (pd.DataFrame): predictions, see get_top_labels
+    :param label_map (dict): MIDI pitch -> label mapping, SETTINGS['OMNIZART_LABEL_MAP'] if not provided
+    :param note_duration (float): length in seconds of the written notes
+    :return midi (pretty_midi.PrettyMIDI): General MIDI drum track with one note per hit, confidence as velocity
+    """
+    import pretty_midi
+
+    pitches = get_midi_pitches(label_map)
+    labels = list(SETTINGS['LABELS_INDEX'].values())
+    missing = [label for label in labels if label not in pitches]
+    if missing:
+        raise ValueError(f"No MIDI pitch for labels {missing}")
+
+    label_indices, confidences = get_top_labels(preds)
+    note_pitches = np.array([pitches[label] for label in labels])[label_indices]
+    velocities = np.clip(np.round(confidences*127), 1, 127).astype(int)
+    times = preds['time'].to_numpy(dtype=np.float64)
+
+    drums = pretty_midi.Instrument(program=0, is_drum=True, name='Drums')
+    drums.notes = [pretty_midi.Note(velocity=int(velocity), pitch=int(pitch), start=float(time),
+                                    end=float(time) + note_duration)
+                   for time, pitch, velocity in zip(times, note_pitches, velocities)]
+
+    midi = pretty_midi.PrettyMIDI()
+    midi.instruments.append(drums)
+    return midi
+
+
+def export_midi(preds: pd.DataFrame, path: str, label_map: dict = None, note_duration: float = 0.1) -> str:
+    """
+    Writes the predictions as a General MIDI drum file, see predictions_to_midi.
+    """
+    predictions_to_midi(preds, label_map, note_duration).write(path)
+    return path
+
+
+def predictions_to_records(preds: pd.DataFrame) -> np.array:
+    """
+    :param preds (pd.DataFrame): predictions, see get_top_labels
+    :return records (np.array): structured array of HIT_DTYPE
+    """
+    label_indices, confidences = get_top_labels(preds)
+
+    records = np.empty(len(preds), dtype=HIT_DTYPE)
+    records['time'] = preds['time'].to_numpy(dtype=np.float64)
+    records['label'] = label_indices
+    records['confidence'] = confidences
+
+    return records
+
+
+def export_records(preds: pd.DataFrame, path: str, append: bool = False) -> str:
+    """
+    Writes the predictions as fixed-width HIT_DTYPE records, 13 bytes per hit.
+
+    :param append (bool): add the hits to the end of an existing file, e.g. once per transcribed chunk
+    """
+    with open(path, 'ab' if append else 'wb') as f:
+        predictions_to_records(preds).tofile(f)
+
+    return path
+
+
+def load_records(path: str) -> pd.DataFrame:
+    """
+    :param path (str): file written by export_records
+    :return predictions (pd.DataFrame): 'time', 'prediction' and 'confidence' columns
+    """
+    records = np.fromfile(path, dtype=HIT_DTYPE)
+    labels = np.array(list(SETTINGS['LABELS_INDEX'].values()), dtype=object)
+
+    return pd.DataFrame({
+        'time': records['time'],
+        'prediction': labels[records['label']],
+        'confidence': records['confidence'].astype(np.float64),
+    })
+
+
+def save_predictions(preds: pd.DataFrame, path: str) -> str:
+    """
+    Writes the predictions in the format matching the file extension: .mid/.midi, .hits (records) or .csv.
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in ('.mid', '.midi'):
+        return export_midi(preds, path)
+    if extension == '.hits':
+        return export_records(preds, path)
+
+    preds.to_csv(path, index=False)
+    return path
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from utils.config import SETTINGS
+from utils.export import get_top_labels
+
+
+def build_hit_index(preds: pd.DataFrame, lane_order: list, duration: float,
+                    bucket_seconds: float = SETTINGS['HIT_INDEX_BUCKET_SECONDS']) -> dict:
+    """
+    Buckets the hits by lane and sorts them by time, so a viewer can find the hits of any time window
+    without scanning all of them.
+
+    :param preds (pd.DataFrame): predictions, see utils.export.get_top_labels
+    :param lane_order (list): labels in lane order, hits of other labels are left out
+    :param duration (float): length of the audio in seconds
+    :param bucket_seconds (float): resolution of the offset tables
+    :return index (dict): 'bucket_seconds' and one entry per lane in 'lanes', each with sorted 'times',
+                          their 'confidences' and 'offsets', where offsets[b] is the index of the first hit
+                          at or after b*bucket_seconds (one more entry than there are buckets)
+    """
+    labels = list(SETTINGS['LABELS_INDEX'].values())
+    label_indices, confidences = get_top_labels(preds)
+    times = preds['time'].to_numpy(dtype=np.float64)
+
+    n_buckets = int(np.ceil(duration/bucket_seconds)) + 1
+    bucket_starts = np.arange(n_buckets + 1)*bucket_seconds
+
+    lanes = []
+    for label in lane_order:
+        in_lane = label_indices == labels.index(label)
+        order = np.argsort(times[in_lane], kind='stable')
+        lane_times = times[in_lane][order]
+
+        lanes.append({
+            'label': label,
+            'times': np.round(lane_times, 4).tolist(),
+            'confidences': np.round(confidences[in_lane][order], 3).tolist(),
+            'offsets': np.searchsorted(lane_times, bucket_starts, side='left').tolist(),
+        })
+
+    return {'bucket_seconds': bucket_seconds, 'lanes': lanes}
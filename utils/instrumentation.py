@@ -0,0 +1,160 @@
+import os
+import time
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+def get_rss_mb() -> float:
+    """
+    :return rss (float): current resident set size of this process in MB, None if it cannot be read
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss/1024**2
+    except ImportError:
+        pass
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1024**2
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if resource is not None:
+        # only the peak is available here, still better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+    return None
+
+
+class Instrumentation():
+    """
+    Opt-in per-stage timing, memory and progress reporting for a single transcription request.
+
+    A disabled instance still forwards progress, so callers can always pass one in and only pay
+    for the measurements when they ask for them.
+    """
+
+    def __init__(self, enabled: bool = True, progress=None, profile_dir: str = None, profiler: str = 'cprofile'):
+        """
+        :param enabled (bool): whether to record the stages
+        :param progress (callable): called as progress(fraction, desc) with fraction in [0, 1] (optional)
+        :param profile_dir (str): if provided, a profile of every profile() block is written there (optional)
+        :param profiler (str): 'cprofile' for a .prof dump or 'pyinstrument' for an html report
+        """
+        self.enabled = enabled
+        self.progress = progress
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+
+        self.stages = []
+        self.profiles = []
+        self._profiling = False
+
+    def report_progress(self, fraction: float, desc: str = None):
+        if self.progress is not None:
+            self.progress(min(max(fraction, 0.0), 1.0), desc)
+
+    def scaled(self, start: float, end: float):
+        """
+        :return instrumentation (Instrumentation): view recording into the same stages whose progress
+                                                   fractions are mapped onto [start, end]
+        """
+        child = Instrumentation(enabled=self.enabled, profile_dir=self.profile_dir, profiler=self.profiler)
+        child.stages = self.stages
+        child.profiles = self.profiles
+        child._profiling = self._profiling
+
+        if self.progress is not None:
+            child.progress = lambda fraction, desc=None: self.report_progress(start + (end - start)*fraction, desc)
+
+        return child
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        """
+        Records wall time and memory of the enclosed block. The yielded dict can be updated with
+        extra information, such as onset counts or batch sizes, while the stage runs.
+        """
+        record = {'stage': name, **info}
+
+        if not self.enabled:
+            yield record
+            return
+
+        rss_before = get_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+
+            rss_after = get_rss_mb()
+            record['rss_mb'] = rss_after
+            if rss_before is not None and rss_after is not None:
+                record['rss_delta_mb'] = rss_after - rss_before
+
+            self.stages.append(record)
+
+    @contextmanager
+    def profile(self, name: str):
+        """
+        Profiles the enclosed block if a profile_dir was given. Nested blocks are folded into the outermost one.
+        """
+        if self.profile_dir is None or self._profiling:
+            yield
+            return
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+
+        self._profiling = True
+        try:
+            if self.profiler == 'pyinstrument':
+                from pyinstrument import Profiler
+
+                profiler = Profiler()
+                profiler.start()
+                try:
+                    yield
+                finally:
+                    profiler.stop()
+                    path = os.path.join(self.profile_dir, f"{name}_{timestamp}.html")
+                    with open(path, 'w') as f:
+                        f.write(profiler.output_html())
+
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    path = os.path.join(self.profile_dir, f"{name}_{timestamp}.prof")
+                    profiler.dump_stats(path)
+
+            self.profiles.append(path)
+        finally:
+            self._profiling = False
+
+    def report(self) -> dict:
+        """
+        :return report (dict): recorded stages, their total wall time and the written profiles
+        """
+        return {
+            'stages': list(self.stages),
+            'total_seconds': sum(s.get('seconds', 0) for s in self.stages),
+            'profiles': list(self.profiles),
+        }
+
+    def summary(self) -> str:
+        """
+        :return summary (str): one line of stage timings, e.g. 'onset_detection 0.12s | mel_conversion 0.70s'
+        """
+        return ' | '.join(f"{s['stage']} {s['seconds']:.2f}s" for s in self.stages if 'seconds' in s)
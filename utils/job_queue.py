@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+from contextlib import contextmanager
+
+from utils.config import SETTINGS
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class JobQueue:
+    """
+    Transcription jobs persisted in SQLite, shared by the HTTP server and the worker processes.
+
+    Every process opens its own JobQueue on the same file. Claiming a job runs in an immediate
+    transaction, so two workers never get the same job. Failed jobs go back to the queue until
+    they used max_attempts, and finished jobs are deleted with their files once expired.
+    """
+
+    def __init__(self, path: str = SETTINGS['SERVER_DB_PATH'], max_attempts: int = SETTINGS['SERVER_MAX_ATTEMPTS'],
+                 result_ttl: float = SETTINGS['SERVER_RESULT_TTL']):
+        """
+        :param path (str): SQLite database file, created if missing
+        :param max_attempts (int): times a job is tried before it is marked as failed
+        :param result_ttl (float): seconds a finished job and its result are kept
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # autocommit, transactions are opened explicitly where needed
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                audio_path TEXT NOT NULL,
+                params TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                error TEXT,
+                result_path TEXT,
+                info TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                expires_at REAL
+            )""")
+        self.connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so a read followed by an update is atomic across processes
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def submit(self, audio_path: str, params: dict = None, job_id: str = None) -> str:
+        """
+        :param audio_path (str): audio file to transcribe, it must stay readable until the job has finished
+        :param params (dict): engine, separate, start, duration and format, see server.py
+        :param job_id (str): id of the job, a random one if not provided
+        :return job_id (str): id to poll the job with
+        """
+        job_id = uuid.uuid4().hex if job_id is None else job_id
+
+        self.connection.execute(
+            'INSERT INTO jobs (id, status, audio_path, params, created_at) VALUES (?, ?, ?, ?, ?)',
+            (job_id, QUEUED, audio_path, json.dumps(params or {}), time.time()))
+
+        return job_id
+
+    def claim(self, worker: str) -> dict:
+        """
+        :param worker (str): name of the claiming worker, stored with the job
+        :return job (dict): oldest queued job, now running, None if the queue is empty
+        """
+        with self._transaction() as connection:
+            row = connection.execute('SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1',
+                                     (QUEUED,)).fetchone()
+            if row is None:
+                return None
+
+            connection.execute('UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, started_at = ? '
+                               'WHERE id = ?', (RUNNING, worker, time.time(), row['id']))
+
+        return self.get(row['id'])
+
+    def complete(self, job_id: str, worker: str, result_path: str, info: dict = None) -> bool:
+        """
+        :param worker (str): worker that ran the job, its result is dropped if the job was handed to another one
+        :return completed (bool): whether the job was still held by worker and is now done
+        """
+        now = time.time()
+        cursor = self.connection.execute(
+            'UPDATE jobs SET status = ?, result_path = ?, info = ?, error = NULL, finished_at = ?, expires_at = ? '
+            'WHERE id = ? AND status = ? AND worker = ?',
+            (DONE, result_path, json.dumps(info or {}), now, now + self.result_ttl, job_id, RUNNING, worker))
+
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, error: str, worker: str = None, started_at: float = None) -> bool:
+        """
+        :param worker (str): worker that ran the job, nothing changes if the job was handed to another one.
+                             None fails the job whoever runs it
+        :param started_at (float): start of the attempt to fail, nothing changes if the job was claimed again since.
+                                   None fails the current attempt
+        :return retried (bool): whether the job went back to the queue for another attempt
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute('SELECT attempts, status, worker, started_at FROM jobs WHERE id = ?',
+                                     (job_id,)).fetchone()
+            if row is None or row['status'] != RUNNING or (worker is not None and row['worker'] != worker) \
+                    or (started_at is not None and row['started_at'] != started_at):
+                return False
+
+            retried = row['attempts'] < self.max_attempts
+            if retried:
+                connection.execute('UPDATE jobs SET status = ?, error = ?, worker = NULL WHERE id = ?',
+                                   (QUEUED, error, job_id))
+            else:
+                connection.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ?, expires_at = ? '
+                                   'WHERE id = ?', (FAILED, error, now, now + self.result_ttl, job_id))
+
+        return retried
+
+    def requeue_stale(self, timeout: float = SETTINGS['SERVER_JOB_TIMEOUT'], workers: list = None) -> list:
+        """
+        Hands running jobs back to the queue when they ran for more than timeout seconds, or when their
+        worker is not in workers anymore, e.g. after it crashed. This counts as a failed attempt.
+
+        :param timeout (float): seconds a job may run
+        :param workers (list): names of the live workers, None only applies the timeout
+        :return stale_workers (list): workers of the jobs handed back or failed, the live ones among them are stuck
+        """
+        rows = self.connection.execute('SELECT id, worker, started_at FROM jobs WHERE status = ?',
+                                       (RUNNING,)).fetchall()
+
+        now = time.time()
+        stale = [row for row in rows
+                 if now - row['started_at'] > timeout or (workers is not None and row['worker'] not in workers)]
+
+        for row in stale:
+            # only the attempt read above, the job may have been handed back and claimed again since
+            self.fail(row['id'], "Worker timed out or died while running the job.",
+                      worker=row['worker'], started_at=row['started_at'])
+
+        return [row['worker'] for row in stale]
+
+    def purge_expired(self) -> int:
+        """
+        Deletes the expired jobs along with their audio and result files.
+
+        :return n_purged (int): number of deleted jobs
+        """
+        rows = self.connection.execute('SELECT id, audio_path, result_path, params FROM jobs WHERE expires_at < ?',
+                                       (time.time(),)).fetchall()
+
+        for row in rows:
+            paths = [row['result_path']]
+            # audio given by path belongs to the caller, only uploads are removed
+            if json.loads(row['params']).get('uploaded'):
+                paths.append(row['audio_path'])
+            for path in paths:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            self.connection.execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+
+        return len(rows)
+
+    def get(self, job_id: str) -> dict:
+        """
+        :return job (dict): the job with its params and info decoded, None if it does not exist or expired
+        """
+        row = self.connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['info'] = json.loads(job['info']) if job['info'] else None
+
+        return job
+
+    def counts(self) -> dict:
+        """
+        :return counts (dict): number of jobs per status
+        """
+        rows = self.connection.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
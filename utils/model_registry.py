@@ -0,0 +1,184 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+from utils.config import SETTINGS
+
+# loaded models of this process, keyed by real path and thread count
+_loaded_models = {}
+_lock = threading.Lock()
+
+
+def get_format(path: str) -> str:
+    """
+    :return format (str): 'tflite', 'saved_model' for a SavedModel directory or 'keras'
+    """
+    if path.endswith('.tflite'):
+        return 'tflite'
+    if os.path.isdir(path):
+        return 'saved_model'
+    return 'keras'
+
+
+def get_files(path: str) -> list:
+    """
+    :return files (list): the file, or every file of a directory in a stable order
+    """
+    if not os.path.isdir(path):
+        return [path]
+
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+
+
+def get_stat(path: str) -> dict:
+    files = get_files(path)
+    return {'size': sum(os.path.getsize(f) for f in files),
+            'mtime': max(os.path.getmtime(f) for f in files)}
+
+
+def get_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    :return sha256 (str): hash of the file, or of the relative paths and contents of a directory
+    """
+    sha256 = hashlib.sha256()
+    for file_path in get_files(path):
+        if os.path.isdir(path):
+            sha256.update(os.path.relpath(file_path, path).encode())
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def read_registry(registry_path: str = SETTINGS['MODEL_REGISTRY_PATH']) -> dict:
+    if not os.path.exists(registry_path):
+        return {}
+    with open(registry_path, 'r') as f:
+        return json.load(f)
+
+
+def _registry_key(path: str, registry_path: str) -> str:
+    # relative to the registry, so the registry stays valid when the model directory moves
+    return os.path.relpath(os.path.abspath(path), os.path.dirname(os.path.abspath(registry_path)))
+
+
+def _update_entry(path: str, entry: dict, registry_path: str):
+    registry = read_registry(registry_path)
+    registry[_registry_key(path, registry_path)] = entry
+
+    # written next to the registry and renamed, processes loading models at the same time never read half a file
+    temp_path = f"{registry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(registry, f, indent=2)
+    os.replace(temp_path, registry_path)
+
+
+def register_model(path: str, input_shape: tuple, source_path: str = None,
+                   registry_path: str = SETTINGS['MODEL_REGISTRY_PATH']) -> dict:
+    """
+    Records the hash, format, label map and input shape of a model artifact.
+
+    :param path (str): model file or SavedModel directory
+    :param input_shape (tuple): model input shape without the batch dimension
+    :param source_path (str): model the artifact was converted from (optional)
+    :return entry (dict): the registry entry
+    """
+    entry = {
+        'format': get_format(path),
+        'sha256': get_hash(path),
+        **get_stat(path),
+        'labels': list(SETTINGS['LABELS_INDEX'].values()),
+        'input_shape': [int(d) for d in input_shape],
+        'source': None if source_path is None else _registry_key(source_path, registry_path),
+        'source_sha256': None if source_path is None else get_hash(source_path),
+        'registered_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+    _update_entry(path, entry, registry_path)
+
+    return entry
+
+
+def verify_model(path: str, registry_path: str = SETTINGS['MODEL_REGISTRY_PATH']) -> dict:
+    """
+    Checks that a registered model still matches its registry entry and the current settings.
+    The hash is only recomputed when the size or modification time changed.
+
+    :return entry (dict): the registry entry, None if the model is not registered
+    """
+    entry = read_registry(registry_path).get(_registry_key(path, registry_path))
+    if entry is None:
+        return None
+
+    labels = list(SETTINGS['LABELS_INDEX'].values())
+    if entry['labels'] != labels:
+        raise ValueError(f"{path} was registered for the labels {entry['labels']}, SETTINGS['LABELS_INDEX'] is {labels}")
+    if tuple(entry['input_shape'][:2]) != tuple(SETTINGS['TARGET_SHAPE']):
+        raise ValueError(f"{path} takes inputs of shape {entry['input_shape']}, "
+                         f"SETTINGS['TARGET_SHAPE'] is {SETTINGS['TARGET_SHAPE']}")
+
+    stat = get_stat(path)
+    if (stat['size'], stat['mtime']) != (entry['size'], entry['mtime']):
+        if get_hash(path) != entry['sha256']:
+            raise ValueError(f"{path} changed since it was registered, convert it again with convert_model.py")
+
+        # same contents with a new mtime, e.g. after a copy or a checkout, the next load skips the hash
+        entry.update(stat)
+        try:
+            _update_entry(path, entry, registry_path)
+        except OSError as e:
+            print(f"Could not update {registry_path} ({e}), {path} will be hashed again on the next load.")
+
+    return entry
+
+
+def load_keras_model(path: str):
+    import tensorflow as tf
+
+    try:
+        return tf.keras.models.load_model(path, compile=False, safe_mode=False)
+    except TypeError:
+        # Fallback for older keras versions that don't verify safe_mode
+        return tf.keras.models.load_model(path, compile=False)
+
+
+def load_model(path: str = SETTINGS['SAVED_MODEL_PATH'], num_threads: int = None,
+               registry_path: str = SETTINGS['MODEL_REGISTRY_PATH']):
+    """
+    Loads a keras model, a SavedModel directory or a .tflite file once per process. Registered models
+    are verified first, unregistered ones are loaded as they are.
+
+    :param path (str): model to load
+    :param num_threads (int): threads of a .tflite model, TFLite's default if not provided
+    :return model: loaded model with a keras-like predict(x, verbose=0) method and input_shape
+    """
+    key = (os.path.realpath(path), num_threads)
+
+    with _lock:
+        if key in _loaded_models:
+            return _loaded_models[key]
+
+        entry = verify_model(path, registry_path)
+        if entry is None:
+            print(f"{path} is not in {registry_path}, loading it unverified.")
+
+        model_format = get_format(path)
+        if model_format == 'tflite':
+            from utils.shared_model import SharedModel
+            model = SharedModel(path, num_threads=num_threads)
+        elif model_format == 'saved_model':
+            from utils.shared_model import SignatureModel
+            model = SignatureModel(path)
+        else:
+            model = load_keras_model(path)
+
+        if entry is not None and tuple(model.input_shape[1:]) != tuple(entry['input_shape']):
+            raise ValueError(f"{path} takes inputs of shape {model.input_shape[1:]}, "
+                             f"its registry entry says {entry['input_shape']}")
+
+        _loaded_models[key] = model
+
+    return model
@@ -0,0 +1,78 @@
+import base64
+
+import numpy as np
+
+from utils.config import SETTINGS
+
+
+def build_peaks(samples: np.array, sr: int, samples_per_peak: int = SETTINGS['PEAKS_SAMPLES_PER_PEAK'],
+                min_peaks: int = 256) -> dict:
+    """
+    Min/max peaks pyramid of the waveform, like audiowaveform's .dat files. Level 0 holds the min and max
+    of every samples_per_peak samples, every next level merges pairs of the previous one, so a waveform
+    can be drawn at any zoom from about one peak per pixel without touching the samples.
+
+    :param samples (np.array): samples array of the audio
+    :param sr (int): sample rate used for the samples
+    :param samples_per_peak (int): samples covered by one peak of level 0
+    :param min_peaks (int): the coarsest level has at most this many peaks
+    :return peaks (dict): 'sr', 'samples_per_peak' of every level and 'levels', (n_peaks, 2) int8 arrays
+                          of min and max scaled to [-127, 127]
+    """
+    samples = np.clip(np.asarray(samples, dtype=np.float32), -1, 1)
+    n_peaks = max(int(np.ceil(len(samples)/samples_per_peak)), 1)
+
+    # the last block is padded with its own last sample so the padding cannot add a peak
+    blocks = np.pad(samples, (0, n_peaks*samples_per_peak - len(samples)), mode='edge' if len(samples) else 'constant')
+    blocks = blocks.reshape(n_peaks, samples_per_peak)
+    level = np.stack([blocks.min(axis=1), blocks.max(axis=1)], axis=1)
+    level = np.round(level*127).astype(np.int8)
+
+    levels = [level]
+    while len(level) > min_peaks:
+        if len(level) % 2:
+            level = np.concatenate([level, level[-1:]])
+        pairs = level.reshape(-1, 2, 2)
+        level = np.stack([pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)], axis=1)
+        levels.append(level)
+
+    return {
+        'sr': sr,
+        'samples_per_peak': [samples_per_peak*2**i for i in range(len(levels))],
+        'levels': levels,
+    }
+
+
+def get_peaks(peaks: dict, start: float = 0, end: float = None, max_points: int = 2000) -> tuple:
+    """
+    :param peaks (dict): pyramid from build_peaks
+    :param start (float): start of the range in seconds
+    :param end (float): end of the range in seconds, the end of the audio if not provided
+    :param max_points (int): maximum number of peaks returned, e.g. the width of the plot in pixels
+    :return times, mins, maxs (np.array, np.array, np.array): peaks of the finest level that fits in max_points,
+                                                              with mins and maxs in [-1, 1]
+    """
+    sr = peaks['sr']
+    end = len(peaks['levels'][0])*peaks['samples_per_peak'][0]/sr if end is None else end
+
+    for level, samples_per_peak in zip(peaks['levels'], peaks['samples_per_peak']):
+        first = max(int(start*sr/samples_per_peak), 0)
+        last = min(int(np.ceil(end*sr/samples_per_peak)), len(level))
+        if last - first <= max_points:
+            break
+
+    selected = level[first:last].astype(np.float32)/127
+    times = (np.arange(first, last) + 0.5)*samples_per_peak/sr
+
+    return times, selected[:, 0], selected[:, 1]
+
+
+def peaks_to_json(peaks: dict) -> dict:
+    """
+    :return peaks (dict): JSON serializable pyramid, every level as base64 of interleaved int8 min and max
+    """
+    return {
+        'sr': peaks['sr'],
+        'samples_per_peak': peaks['samples_per_peak'],
+        'levels': [base64.b64encode(level.tobytes()).decode('ascii') for level in peaks['levels']],
+    }
@@ -0,0 +1,140 @@
+import threading
+
+import numpy as np
+
+from utils.config import SETTINGS
+
+
+def convert_to_shared(keras_model_path: str = SETTINGS['SAVED_MODEL_PATH'],
+                      output_path: str = SETTINGS['SHARED_MODEL_PATH']) -> str:
+    """
+    Converts the Keras model to a TFLite flatbuffer, SharedModel memory-maps it so every process
+    loading the same file reads the weights from the same page cache pages.
+
+    :param keras_model_path (str): .h5 model, as loaded by DrumTranscriber
+    :param output_path (str): .tflite file to write
+    :return output_path (str): the written file
+    """
+    import tensorflow as tf
+    from utils.model_registry import load_keras_model
+
+    model = load_keras_model(keras_model_path)
+
+    # float32 weights, so the predictions match the Keras model
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+    return output_path
+
+
+def convert_to_saved_model(keras_model_path: str = SETTINGS['SAVED_MODEL_PATH'],
+                           output_path: str = SETTINGS['SIGNATURE_MODEL_PATH']) -> str:
+    """
+    Saves the Keras model as a SavedModel with a serving signature traced for any batch size,
+    so loading it neither rebuilds the keras layers nor traces the graph again.
+
+    :param keras_model_path (str): .h5 model, as loaded by DrumTranscriber
+    :param output_path (str): SavedModel directory to write
+    :return output_path (str): the written directory
+    """
+    import tensorflow as tf
+    from utils.model_registry import load_keras_model
+
+    model = load_keras_model(keras_model_path)
+
+    @tf.function(input_signature=[tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name='mel_specs')])
+    def serve(mel_specs):
+        return {'predictions': model(mel_specs, training=False)}
+
+    tf.saved_model.save(model, output_path, signatures={'serving_default': serve})
+
+    return output_path
+
+
+class SignatureModel:
+    """
+    Serving signature of a SavedModel written by convert_to_saved_model, with the model.predict(x, verbose=0)
+    interface DrumTranscriber and LiveTranscriber use.
+    """
+
+    def __init__(self, path: str = SETTINGS['SIGNATURE_MODEL_PATH']):
+        import tensorflow as tf
+
+        self.path = path
+        # keep the loaded object alive, the signature only holds weak references to its variables
+        self._loaded = tf.saved_model.load(path)
+        self._serve = self._loaded.signatures['serving_default']
+
+        input_spec = self._serve.structured_input_signature[1]['mel_specs']
+        self.input_shape = tuple(input_spec.shape.as_list())
+
+    def predict(self, x: np.array, verbose: int = 0) -> np.array:
+        """
+        :param x (np.array): batch of model inputs
+        :param verbose (int): unused, kept for compatibility with keras
+        :return predictions (np.array): model outputs, one row per input
+        """
+        return self._serve(mel_specs=np.asarray(x, dtype=np.float32))['predictions'].numpy()
+
+
+class SharedModel:
+    """
+    TFLite interpreter over a memory-mapped model file, with the model.predict(x, verbose=0) interface
+    DrumTranscriber and LiveTranscriber use.
+
+    The default XNNPACK delegate repacks the weights into private memory, it is left out so the kernels
+    read the weights straight from the mapped file. Replicas in several processes then hold close to
+    one copy of the weights between them.
+
+    TFLite interpreters are not thread safe, calls from several threads are serialised.
+    """
+
+    def __init__(self, path: str = SETTINGS['SHARED_MODEL_PATH'], num_threads: int = None,
+                 batch_size: int = SETTINGS['PREDICT_BATCH_SIZE']):
+        """
+        :param path (str): .tflite file written by convert_to_shared
+        :param num_threads (int): threads of the interpreter, TFLite's default if not provided
+        :param batch_size (int): largest batch run at once, larger inputs are split
+        """
+        import tensorflow as tf
+
+        self.path = path
+        self.batch_size = batch_size
+        self.interpreter = tf.lite.Interpreter(
+            model_path=path, num_threads=num_threads,
+            experimental_op_resolver_type=tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_shape = (None, *input_details['shape'][1:])
+
+        self._input_index = input_details['index']
+        self._output_index = self.interpreter.get_output_details()[0]['index']
+        self._allocated_batch = None
+        self._lock = threading.Lock()
+
+    def _run(self, batch: np.array) -> np.array:
+        # tensors are only reallocated when the batch size changes, e.g. for the last partial batch
+        if len(batch) != self._allocated_batch:
+            self.interpreter.resize_tensor_input(self._input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self._allocated_batch = len(batch)
+
+        self.interpreter.set_tensor(self._input_index, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output_index)
+
+    def predict(self, x: np.array, verbose: int = 0) -> np.array:
+        """
+        :param x (np.array): batch of model inputs
+        :param verbose (int): unused, kept for compatibility with keras
+        :return predictions (np.array): model outputs, one row per input
+        """
+        x = np.asarray(x, dtype=np.float32)
+
+        with self._lock:
+            outputs = [self._run(x[i:i+self.batch_size]) for i in range(0, len(x), self.batch_size)]
+            if not outputs:
+                return np.zeros((0, *self.interpreter.get_output_details()[0]['shape'][1:]), dtype=np.float32)
+
+        return np.concatenate(outputs)